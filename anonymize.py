@@ -0,0 +1,151 @@
+# anonymize.py
+"""
+Неинтерактивный запуск анонимизации для скриптов и конвейеров оболочки.
+Текст читается потоково (файл, сжатый файл .gz/.xz/.zst или '-' - стандартный ввод),
+режется на части по границам абзацев (CLI_CHUNK_CHARS) и проходит конвейер pipeline.py;
+результат выводится по мере готовности в стандартный вывод ('-') или атомарно в файл.
+Журнал пишется в stderr (или --log-file) и не смешивается с результатом.
+Запуск: zcat corpus.txt.gz | python anonymize.py - | zstd > corpus.anon.txt.zst
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from config import (
+    ENTITIES_FILENAME, EXCEPTIONS_FILENAME, LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN,
+    USE_GPU, PIPELINE_PROFILES, PIPELINE_QUEUE_SIZE, CLI_CHUNK_CHARS
+)
+
+# --- Коды завершения ---
+EXIT_OK = 0
+EXIT_IO_ERROR = 1       # Ошибка чтения входа или записи результата
+EXIT_USAGE = 2          # Неверные аргументы (код argparse)
+EXIT_SETUP_ERROR = 3    # Не загружены модели, пустой список сущностей, ошибка создания анализатора
+EXIT_PARTIAL = 4        # Часть текста не обработана и пропущена в результате
+# Модели, без которых анализ невозможен (как в main.py)
+REQUIRED_MODELS = ("spacy_engine", "stanza")
+
+
+def positive_int(value: str) -> int:
+    """Тип аргумента argparse: целое число больше 0."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"ожидается целое число больше 0, получено {value}")
+    return number
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Потоковая анонимизация текста (файл или stdin -> файл или stdout).",
+        epilog=(
+            f"Коды завершения: {EXIT_OK} - успешно, {EXIT_IO_ERROR} - ошибка ввода-вывода, "
+            f"{EXIT_USAGE} - неверные аргументы, {EXIT_SETUP_ERROR} - ошибка загрузки моделей или конфигурации, "
+            f"{EXIT_PARTIAL} - часть текста не обработана (пропущена в результате, исходный текст не выводится)."
+        )
+    )
+    parser.add_argument("input", nargs="?", default="-", help="Входной файл (.txt, .gz, .xz, .zst) или '-' - стандартный ввод.")
+    parser.add_argument("-o", "--output", default="-", help="Выходной файл или '-' - стандартный вывод (по умолчанию).")
+    parser.add_argument("--entities", help="Типы сущностей через запятую (по умолчанию из --entities-file).")
+    parser.add_argument("--entities-file", default=ENTITIES_FILENAME, help=f"Файл со списком сущностей (по умолчанию {ENTITIES_FILENAME}).")
+    parser.add_argument("--exceptions-file", default=EXCEPTIONS_FILENAME, help=f"Файл исключений (по умолчанию {EXCEPTIONS_FILENAME}).")
+    parser.add_argument("--profile", choices=list(PIPELINE_PROFILES), help="Профиль скорость/полнота (по умолчанию PIPELINE_PROFILE из config.py).")
+    parser.add_argument("--workers", type=positive_int, help="Сколько частей документа анализировать параллельно (ANALYSIS_WORKERS).")
+    parser.add_argument("--shard-chars", type=positive_int, help="Размер частей для параллельного анализа (ANALYSIS_SHARD_CHARS).")
+    parser.add_argument("--chunk-chars", type=positive_int, default=CLI_CHUNK_CHARS, help=f"Размер части потока в символах (по умолчанию {CLI_CHUNK_CHARS}).")
+    parser.add_argument("--queue-size", type=positive_int, default=PIPELINE_QUEUE_SIZE, help=f"Размер очередей конвейера (по умолчанию {PIPELINE_QUEUE_SIZE}).")
+    parser.add_argument("--encoding", help="Кодировка входа (по умолчанию определяется: utf-8 или cp1251).")
+    parser.add_argument("--log-file", help="Писать журнал в файл вместо stderr.")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="Подробный журнал (-v - INFO, -vv - DEBUG).")
+    return parser.parse_args()
+
+
+async def _run(args: argparse.Namespace) -> int:
+    logger = logging.getLogger()
+    import anonymizer_logic
+    from anonymizer_logic import get_analysis_bundle, save_known_entity_dictionary
+    from file_utils import iter_text_chunks, open_text_atomic, load_entities_to_process, load_exceptions
+    from model_loader import load_models_parallel
+    from pipeline import anonymize_chunks_pipelined
+
+    # --- Конфигурация ---
+    # Параметры параллельного анализа читаются anonymizer_logic при каждом анализе
+    if args.workers is not None:
+        anonymizer_logic.ANALYSIS_WORKERS = args.workers
+    if args.shard_chars is not None:
+        anonymizer_logic.ANALYSIS_SHARD_CHARS = args.shard_chars
+    if args.entities:
+        entities_to_process = [entity.strip() for entity in args.entities.split(",") if entity.strip()]
+    else:
+        entities_to_process = await load_entities_to_process(args.entities_file)
+    if not entities_to_process:
+        logger.error("Список сущностей для обработки пуст. Анонимизация невозможна.")
+        return EXIT_SETUP_ERROR
+    exceptions_list = await load_exceptions(args.exceptions_file)
+
+    # --- Модели и анализатор ---
+    models = await load_models_parallel(LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN, USE_GPU)
+    missing_models = [name for name in REQUIRED_MODELS if models["errors"].get(name) is not None]
+    if missing_models:
+        for name in missing_models:
+            logger.error(f"Не удалось загрузить модель '{name}': {models['errors'][name]}")
+        return EXIT_SETUP_ERROR
+    bundle = await asyncio.to_thread(
+        get_analysis_bundle, entities_to_process, LANGUAGE_CODE, SPACY_MODEL_RU,
+        nlp_engine=models["spacy_engine"], en_nlp=models["spacy_en"], profile=args.profile
+    )
+    if bundle is None:
+        return EXIT_SETUP_ERROR
+
+    # --- Потоковая обработка ---
+    chunks = iter_text_chunks(args.input, args.chunk_chars, args.encoding)
+    start_time = time.perf_counter()
+    try:
+        if args.output == "-":
+            sys.stdout.reconfigure(encoding="utf-8")
+            counts = await anonymize_chunks_pipelined(chunks, sys.stdout, bundle, exceptions_list, args.queue_size)
+        else:
+            with open_text_atomic(args.output) as output:
+                counts = await anonymize_chunks_pipelined(chunks, output, bundle, exceptions_list, args.queue_size)
+    except BrokenPipeError:
+        # Читатель stdout завершился раньше (например, '| head'): дальнейший вывод не нужен
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        logger.warning("Стандартный вывод закрыт до завершения обработки.")
+        return EXIT_IO_ERROR
+    except (OSError, UnicodeError, LookupError) as e:
+        logger.error(f"Ошибка ввода-вывода: {e}")
+        return EXIT_IO_ERROR
+    finally:
+        save_known_entity_dictionary()
+
+    logger.info(f"Обработано частей: {counts['chunks']} ({counts['chars']} символов) за {time.perf_counter() - start_time:.2f} сек.")
+    if counts["failed"]:
+        logger.error(f"Частей с ошибкой: {counts['failed']} из {counts['chunks']}; они пропущены в результате.")
+        return EXIT_PARTIAL
+    return EXIT_OK
+
+
+def main() -> int:
+    args = _parse_args()
+    level = {0: logging.WARNING, 1: logging.INFO}.get(args.verbose, logging.DEBUG)
+    handler = logging.FileHandler(args.log_file, encoding='utf-8') if args.log_file else logging.StreamHandler(sys.stderr)
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[handler])
+    logger = logging.getLogger()
+
+    if args.input != "-" and not os.path.isfile(args.input):
+        logger.error(f"Входной файл '{args.input}' не найден.")
+        return EXIT_IO_ERROR
+    try:
+        return asyncio.run(_run(args))
+    except ImportError as e:
+        logger.critical(f"Ошибка импорта необходимой библиотеки: {e}. Установите зависимости: pip install -r requirements.txt")
+        return EXIT_SETUP_ERROR
+    except KeyboardInterrupt:
+        logger.warning("Прервано пользователем.")
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
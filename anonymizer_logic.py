@@ -3,11 +3,17 @@
 Содержит основную логику анонимизации с использованием Presidio и Natasha.
 """
 import logging
+import os
 import stanza
 import spacy
 import time # Для замера времени Natasha
 import asyncio # <-- Добавлено для to_thread
-import aiofiles
+import threading
+import zipfile
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 import re # <-- Добавлено для проверки паттернов в _adjust_ner_scores
 
 # Импорты Presidio
@@ -15,10 +21,8 @@ from presidio_analyzer import AnalyzerEngine, Pattern, PatternRecognizer, Recogn
 from presidio_analyzer.nlp_engine import SpacyNlpEngine
 from presidio_analyzer.predefined_recognizers import (
     EmailRecognizer, PhoneRecognizer, CreditCardRecognizer, IbanRecognizer,
-    IpRecognizer, UrlRecognizer, StanzaRecognizer
+    IpRecognizer, UrlRecognizer, StanzaRecognizer, SpacyRecognizer
 )
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
 
 # --- НОВОЕ: Импорты Natasha ---
 try:
@@ -31,28 +35,95 @@ try:
         Doc
     )
     NATASHA_AVAILABLE = True
-    # Инициализация компонентов Natasha (остается синхронной при импорте)
-    segmenter = Segmenter()
-    morph_vocab = MorphVocab()
-    emb = NewsEmbedding()
-    morph_tagger = NewsMorphTagger(emb)
-    ner_tagger = NewsNERTagger(emb)
-    logging.info("Компоненты Natasha успешно инициализированы.")
 except ImportError:
     logging.warning("Библиотека Natasha не найдена. NER с помощью Natasha не будет использоваться.")
     logging.warning("Установите ее: pip install natasha")
     NATASHA_AVAILABLE = False
-    segmenter, morph_vocab, emb, morph_tagger, ner_tagger = None, None, None, None, None
+# Компоненты Natasha загружаются функцией init_natasha() (при старте - параллельно с другими моделями)
+segmenter, morph_vocab, emb, morph_tagger, ner_tagger = None, None, None, None, None
+_natasha_init_lock = threading.Lock()
+
+
+def _mmap_embedding_arrays(embedding, mmap_dir: str) -> int:
+    """
+    Заменяет массивы PQ эмбеддингов Natasha (Navec: indexes, codes) отображенными в память
+    копиями из mmap_dir (файлы .npy создаются при первом запуске). Страницы отображения
+    берутся из кэша ОС и общие для всех процессов. Возвращает размер массивов (байт).
+    """
+    import numpy as np
+
+    os.makedirs(mmap_dir, exist_ok=True)
+    mapped_bytes = 0
+    for name in ("indexes", "codes"):
+        array = getattr(embedding.pq, name)
+        filename = os.path.join(mmap_dir, f"{embedding.meta.id}.{name}.npy")
+        mapped = np.load(filename, mmap_mode='r') if os.path.exists(filename) else None
+        if mapped is None or mapped.shape != array.shape or mapped.dtype != array.dtype:
+            temp_filename = filename + ".tmp.npy"
+            np.save(temp_filename, array)
+            os.replace(temp_filename, filename)
+            mapped = np.load(filename, mmap_mode='r')
+        setattr(embedding.pq, name, mapped)
+        mapped_bytes += mapped.nbytes
+    return mapped_bytes
+
+
+def init_natasha(mmap_dir: str | None = None) -> bool:
+    """
+    Инициализирует компоненты Natasha (один раз за процесс, потокобезопасно).
+    mmap_dir - каталог для отображения массивов эмбеддингов в память (None - обычная загрузка);
+    при ошибке отображения используются загруженные массивы.
+    Возвращает True, если Natasha доступна и загружена.
+    """
+    global segmenter, morph_vocab, emb, morph_tagger, ner_tagger
+    if not NATASHA_AVAILABLE:
+        return False
+    with _natasha_init_lock:
+        if ner_tagger is None:
+            segmenter = Segmenter()
+            morph_vocab = MorphVocab()
+            emb = NewsEmbedding()
+            if mmap_dir is not None:
+                # До создания теггеров: они ссылаются на массивы эмбеддингов, а не копируют их
+                try:
+                    mapped_bytes = _mmap_embedding_arrays(emb, mmap_dir)
+                    logging.info(f"Эмбеддинги Natasha отображены в память из '{mmap_dir}' ({mapped_bytes / 2**20:.1f} МБ).")
+                except Exception as e:
+                    logging.warning(f"Не удалось отобразить эмбеддинги Natasha в память, используются загруженные массивы: {e}")
+            morph_tagger = NewsMorphTagger(emb)
+            ner_tagger = NewsNERTagger(emb)
+            # Размер пакета предложений для NER (и для кодировщика, который делит пакет на части)
+            ner_tagger.batch_size = NATASHA_BATCH_SIZE
+            ner_tagger.infer.encoder.batch_size = NATASHA_BATCH_SIZE
+            logging.info("Компоненты Natasha успешно инициализированы.")
+    return True
 # -----------------------------
 
 # Импорты из других наших модулей
 from config import ( # ИЗМЕНЕНО: Импортируем новые константы
-    ENTITY_PLACEHOLDERS, DEFAULT_SCORE_THRESHOLD,
+    DEFAULT_SCORE_THRESHOLD,
     ANCHOR_SCORE_THRESHOLD, NER_FILTER_LOW_SCORE_THRESHOLD,
-    NER_LOW_CONFIDENCE_SCORE_MULTIPLIER, NATASHA_DEFAULT_SCORE
+    NER_LOW_CONFIDENCE_SCORE_MULTIPLIER, NATASHA_DEFAULT_SCORE,
+    NER_CASCADE_MODE, USE_KNOWN_ENTITIES, KNOWN_ENTITIES_FILENAME,
+    KNOWN_ENTITIES_MAX_SIZE, KNOWN_ENTITY_MIN_COUNT, KNOWN_ENTITY_SCORE,
+    USE_LANGUAGE_ROUTING, ROUTING_MIN_LATIN_WORDS, SPACY_MODEL_EN,
+    PIPELINE_PROFILES, PIPELINE_PROFILE, NATASHA_TAG_MORPH, NATASHA_BATCH_SIZE,
+    SAVE_STANDOFF_SPANS, STANDOFF_SUFFIX, ANALYSIS_SHARD_CHARS, ANALYSIS_WORKERS, ANALYSIS_EXECUTOR,
+    USE_ENTITY_PROPAGATION, PROPAGATION_SCORE, PROPAGATION_MIN_SURNAME_LENGTH, BUNDLE_CACHE_SIZE
 )
+from context_enhancer import IndexedContextAwareEnhancer
 from custom_recognizers import create_custom_recognizers
-from text_utils import post_process_text
+from entity_propagation import propagate_entities, PROPAGATION_RECOGNIZER_NAME
+from file_utils import read_text
+from known_entities import KnownEntityDictionary, KNOWN_ENTITY_RECOGNIZER_NAME
+from microbatch import MicroBatcher
+from rendering import get_anonymizer_operators, resolve_replacements, write_document
+from replacement_engine import SpanReplacementEngine
+from standoff import standoff_filename, save_spans
+from text_utils import (
+    segment_sentences, route_sentences, merge_adjacent_regions, shard_regions,
+    SCRIPT_CYRILLIC, SCRIPT_LATIN, SCRIPT_NONE
+)
 
 # Список слов/фраз для дополнительной фильтрации NER-результатов
 NER_FALSE_POSITIVE_FILTER = {
@@ -101,80 +172,156 @@ STANZA_RECOGNIZER_NAME = "StanzaRecognizer"
 SPACY_RECOGNIZER_NAME = "SpacyRecognizer"
 NATASHA_RECOGNIZER_NAME = "NatashaRecognizer"
 PRESIDIO_NLP_ENGINE_NAME = "NLP Engine (Presidio)"
-NER_RECOGNIZER_NAMES = {SPACY_RECOGNIZER_NAME, STANZA_RECOGNIZER_NAME, PRESIDIO_NLP_ENGINE_NAME, NATASHA_RECOGNIZER_NAME}
+# Результаты словаря известных сущностей получены из подтвержденных NER-результатов и считаются NER
+NER_RECOGNIZER_NAMES = {SPACY_RECOGNIZER_NAME, STANZA_RECOGNIZER_NAME, PRESIDIO_NLP_ENGINE_NAME, NATASHA_RECOGNIZER_NAME, KNOWN_ENTITY_RECOGNIZER_NAME, PROPAGATION_RECOGNIZER_NAME}
+
+# --- Пороги и множители из config.py ---
+# Передаются в функции анализа словарем (снимок конфигурации в bundle["thresholds"]),
+# чтобы их можно было обновить без перезапуска (см. config_watcher.py)
+THRESHOLD_NAMES = (
+    "DEFAULT_SCORE_THRESHOLD", "ANCHOR_SCORE_THRESHOLD", "NER_FILTER_LOW_SCORE_THRESHOLD",
+    "NER_LOW_CONFIDENCE_SCORE_MULTIPLIER", "NATASHA_DEFAULT_SCORE"
+)
+DEFAULT_THRESHOLDS = {
+    "DEFAULT_SCORE_THRESHOLD": DEFAULT_SCORE_THRESHOLD,
+    "ANCHOR_SCORE_THRESHOLD": ANCHOR_SCORE_THRESHOLD,
+    "NER_FILTER_LOW_SCORE_THRESHOLD": NER_FILTER_LOW_SCORE_THRESHOLD,
+    "NER_LOW_CONFIDENCE_SCORE_MULTIPLIER": NER_LOW_CONFIDENCE_SCORE_MULTIPLIER,
+    "NATASHA_DEFAULT_SCORE": NATASHA_DEFAULT_SCORE
+}
+
+# --- Словарь известных сущностей (создается при первом использовании) ---
+_known_entity_dictionary = None
+
+
+def get_known_entity_dictionary() -> KnownEntityDictionary:
+    """Возвращает общий для процесса словарь известных сущностей, загружая его при первом вызове."""
+    global _known_entity_dictionary
+    if _known_entity_dictionary is None:
+        _known_entity_dictionary = KnownEntityDictionary(
+            KNOWN_ENTITIES_FILENAME,
+            max_size=KNOWN_ENTITIES_MAX_SIZE,
+            min_count=KNOWN_ENTITY_MIN_COUNT,
+            score=KNOWN_ENTITY_SCORE
+        )
+        _known_entity_dictionary.load()
+    return _known_entity_dictionary
+
+
+def save_known_entity_dictionary() -> None:
+    """Сохраняет словарь известных сущностей в конце запуска (если он использовался)."""
+    if USE_KNOWN_ENTITIES and _known_entity_dictionary is not None:
+        _known_entity_dictionary.save()
 
-# --- Пороги и множители теперь импортируются из config.py ---
-# ANCHOR_SCORE_THRESHOLD
-# NER_FILTER_LOW_SCORE_THRESHOLD
-# NER_LOW_CONFIDENCE_SCORE_MULTIPLIER
-# NATASHA_DEFAULT_SCORE
 
 # --- Паттерн для проверки начала текста ---
 KNOWN_LOWERCASE_PREFIX_PATTERN = re.compile(r"^(г|ул|просп|пер|пл|ш|б-р|наб|д|кв|корп|стр|пом|обл|р-н|пос|днп|снт|тер)\.?\s", re.IGNORECASE)
 
 
 # --- Функция для запуска Natasha NER ---
-def run_natasha_ner(text: str) -> list[RecognizerResult]: # Убран score_threshold как аргумент
+def _natasha_spans_ner_only(text: str, sentences: list[tuple[int, int]]) -> list[tuple[int, int, str]]:
+    """
+    Только NER: предложения передаются в NewsNERTagger пакетами (NATASHA_BATCH_SIZE),
+    без токенизации Doc и морфологического разбора. Возвращает (start, stop, тип) в координатах text.
+    """
+    spans = []
+    for batch_start in range(0, len(sentences), NATASHA_BATCH_SIZE):
+        batch = sentences[batch_start:batch_start + NATASHA_BATCH_SIZE]
+        batch_texts = [text[start:end] for start, end in batch]
+        markups = _natasha_batcher.submit(batch_texts) if _natasha_batcher is not None else ner_tagger.map(batch_texts)
+        for (sentence_start, _), markup in zip(batch, markups):
+            for span in markup.spans:
+                spans.append((sentence_start + span.start, sentence_start + span.stop, span.type))
+    return spans
+
+
+def _natasha_spans_with_morph(text: str, regions: list[tuple[int, int]]) -> list[tuple[int, int, str]]:
+    """Полный разбор Doc (сегментация, морфология, NER) по регионам. Возвращает (start, stop, тип) в координатах text."""
+    logger = logging.getLogger()
+    spans = []
+    for region_start, region_end in regions:
+        doc = Doc(text[region_start:region_end])
+        doc.segment(segmenter)
+        if morph_tagger:
+             doc.tag_morph(morph_tagger)
+        else:
+             logger.warning("Morphological tagger (Natasha) не инициализирован, морфологический анализ пропущен.")
+        doc.tag_ner(ner_tagger)
+        spans.extend((region_start + span.start, region_start + span.stop, span.type) for span in doc.spans)
+    return spans
+
+
+def run_natasha_ner(
+    text: str,
+    thresholds: dict | None = None,
+    sentences: list[tuple[int, int]] | None = None,
+    tag_morph: bool | None = None
+) -> list[RecognizerResult]: # Убран score_threshold как аргумент
     """
     Выполняет NER с использованием Natasha и возвращает результаты в формате Presidio.
-    Использует NATASHA_DEFAULT_SCORE из config.py.
+    Использует NATASHA_DEFAULT_SCORE из thresholds (по умолчанию - из config.py).
+    sentences - уже найденные предложения (segment_sentences); анализируются только они.
+    tag_morph=None означает NATASHA_TAG_MORPH из config.py: морфологический разбор
+    выполняется только если он нужен, иначе - только NER по пакетам предложений.
     Эта функция является СИНХРОННОЙ и блокирующей.
     """
-    if not NATASHA_AVAILABLE:
+    if not init_natasha():
         return []
 
     logger = logging.getLogger()
-    logger.info("Запуск NER с помощью Natasha (в отдельном потоке)...")
+    if tag_morph is None:
+        tag_morph = NATASHA_TAG_MORPH
+    mode_name = "морфология + NER" if tag_morph else "только NER"
+    logger.info(f"Запуск NER с помощью Natasha (в отдельном потоке, режим: {mode_name})...")
     start_time = time.time()
     natasha_results = []
+    score = (thresholds or DEFAULT_THRESHOLDS)["NATASHA_DEFAULT_SCORE"]
     try:
-        doc = Doc(text)
-        doc.segment(segmenter)
-        if morph_tagger:
-             doc.tag_morph(morph_tagger)
-        else:
-             logger.warning("Morphological tagger (Natasha) не инициализирован, морфологический анализ пропущен.")
-
-        if ner_tagger:
-            doc.tag_ner(ner_tagger)
-        else:
+        if not ner_tagger:
              logger.warning("NER tagger (Natasha) не инициализирован, NER анализ пропущен.")
              return []
 
+        if sentences is None:
+            sentences = segment_sentences(text)
+        if tag_morph:
+            spans = _natasha_spans_with_morph(text, merge_adjacent_regions(text, sentences))
+        else:
+            spans = _natasha_spans_ner_only(text, sentences)
+
         type_mapping = {
             "PER": "PERSON",
             "LOC": "LOCATION",
             "ORG": "ORG"
         }
 
-        for span in doc.spans:
-            entity_type = type_mapping.get(span.type)
+        for span_start, span_stop, span_type in spans:
+            entity_type = type_mapping.get(span_type)
             if entity_type:
-                # ИЗМЕНЕНО: Используем score из config.py
-                score = NATASHA_DEFAULT_SCORE
-
+                span_text = text[span_start:span_stop]
                 explanation = {
                     "recognizer_name": NATASHA_RECOGNIZER_NAME,
                     "original_score": score,
-                    "text": span.text,
-                    "natasha_type": span.type
+                    "text": span_text,
+                    "natasha_type": span_type
                 }
 
                 result = RecognizerResult(
                     entity_type=entity_type,
-                    start=span.start,
-                    end=span.stop,
+                    start=span_start,
+                    end=span_stop,
                     score=score,
                     analysis_explanation=explanation
                 )
                 natasha_results.append(result)
-                logger.debug(f"  Natasha нашла: {entity_type} [{span.start}:{span.stop}] '{span.text}' (Score: {score:.2f})")
+                logger.debug(f"  Natasha нашла: {entity_type} [{span_start}:{span_stop}] '{span_text}' (Score: {score:.2f})")
 
     except Exception as e:
         logger.error(f"Ошибка во время выполнения Natasha NER: {e}", exc_info=True)
 
-    end_time = time.time()
-    logger.info(f"Natasha NER завершен за {end_time - start_time:.2f} сек. Найдено {len(natasha_results)} сущностей (PER, LOC, ORG).")
+    elapsed = time.time() - start_time
+    analyzed_mb = sum(end - start for start, end in sentences or []) / (1024 * 1024)
+    per_mb = f", {elapsed / analyzed_mb:.2f} сек./МБ" if analyzed_mb > 0 else ""
+    logger.info(f"Natasha NER завершен за {elapsed:.2f} сек.{per_mb} ({mode_name}). Найдено {len(natasha_results)} сущностей (PER, LOC, ORG).")
     return natasha_results
 # ------------------------------------------
 
@@ -270,13 +417,13 @@ def log_results_list(results: list[RecognizerResult], stage_name: str, text: str
 # ----------------------------------------------------------------------
 
 # --- Вспомогательная функция для определения "якоря" (без изменений) ---
-def _is_anchor(result: RecognizerResult) -> bool:
+def _is_anchor(result: RecognizerResult, anchor_score_threshold: float = ANCHOR_SCORE_THRESHOLD) -> bool:
     """Определяет, является ли результат 'якорным' (высококачественным)."""
     recognizer_name, _ = _get_recognizer_info(result)
     if recognizer_name == STANZA_RECOGNIZER_NAME:
         return True
-    # Используем ANCHOR_SCORE_THRESHOLD из config
-    if result.score >= ANCHOR_SCORE_THRESHOLD:
+    # Используем ANCHOR_SCORE_THRESHOLD из config (или из снимка thresholds)
+    if result.score >= anchor_score_threshold:
         return True
     return False
 # ----------------------------------------------------------------------
@@ -291,13 +438,15 @@ def _check_overlap(res1: RecognizerResult, res2: RecognizerResult) -> bool:
 def _adjust_ner_scores(
     results: list[RecognizerResult],
     text: str,
-    logger: logging.Logger
+    logger: logging.Logger,
+    thresholds: dict | None = None
 ) -> list[RecognizerResult]:
     """
     Понижает score для NER-результатов (PERSON, LOCATION, ORG),
     которые начинаются со строчной буквы (кроме известных исключений).
-    Использует NER_LOW_CONFIDENCE_SCORE_MULTIPLIER из config.
+    Использует NER_LOW_CONFIDENCE_SCORE_MULTIPLIER из thresholds (по умолчанию - из config).
     """
+    score_multiplier = (thresholds or DEFAULT_THRESHOLDS)["NER_LOW_CONFIDENCE_SCORE_MULTIPLIER"]
     adjusted_count = 0
     adjusted_results = []
     ner_types_to_adjust = {"PERSON", "LOCATION", "ORG"}
@@ -310,7 +459,7 @@ def _adjust_ner_scores(
                 if res_text and res_text[0].islower() and not KNOWN_LOWERCASE_PREFIX_PATTERN.match(res_text):
                     original_score = result.score
                     # Используем множитель из config
-                    result.score *= NER_LOW_CONFIDENCE_SCORE_MULTIPLIER
+                    result.score *= score_multiplier
                     adjusted_count += 1
                     logger.debug(
                         f"  Понижен score для '{res_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) "
@@ -336,13 +485,15 @@ def _adjust_ner_scores(
 def merge_and_filter_results(
     presidio_results: list[RecognizerResult],
     natasha_results: list[RecognizerResult],
-    text_for_debug: str
+    text_for_debug: str,
+    thresholds: dict | None = None
 ) -> list[RecognizerResult]:
     """
     Объединяет результаты от Presidio и Natasha, используя двухпроходный метод.
     Эта функция является СИНХРОННОЙ.
     """
     logger = logging.getLogger()
+    anchor_score_threshold = (thresholds or DEFAULT_THRESHOLDS)["ANCHOR_SCORE_THRESHOLD"]
     combined_results = presidio_results + natasha_results
     if not combined_results:
         return []
@@ -350,7 +501,7 @@ def merge_and_filter_results(
     combined_results.sort(key=lambda r: (r.start, -r.end))
     log_results_list(combined_results, "Объединенные и отсортированные результаты (перед слиянием)", text_for_debug, logger)
 
-    potential_anchors = [res for res in combined_results if _is_anchor(res)]
+    potential_anchors = [res for res in combined_results if _is_anchor(res, anchor_score_threshold)]
     log_results_list(potential_anchors, "Потенциальные якоря", text_for_debug, logger)
 
     anchor_results = []
@@ -420,7 +571,7 @@ def merge_and_filter_results(
         if final_results:
              last_added_non_anchor = None
              for res in reversed(final_results):
-                 if not _is_anchor(res):
+                 if not _is_anchor(res, anchor_score_threshold):
                      last_added_non_anchor = res
                      break
 
@@ -507,57 +658,9 @@ def filter_by_ner_priority(
     return final_results
 # ----------------------------------------------------------------------
 
-# --- Функция get_anonymizer_operators (без изменений) ---
-def get_anonymizer_operators(entities: list[str]) -> dict[str, OperatorConfig]:
-    """Создает словарь операторов для AnonymizerEngine на основе плейсхолдеров."""
-    logger = logging.getLogger()
-    operators = {}
-    if "DEFAULT" in ENTITY_PLACEHOLDERS and ("DEFAULT" not in entities or not entities):
-        operators["DEFAULT"] = OperatorConfig("replace", {"new_value": ENTITY_PLACEHOLDERS["DEFAULT"]})
-        logger.debug("Добавлен оператор DEFAULT для замены.")
-
-    processed_entities = set()
-    for entity in entities:
-        if entity in processed_entities:
-            continue
-
-        if entity in ENTITY_PLACEHOLDERS:
-            placeholder = ENTITY_PLACEHOLDERS[entity]
-            operators[entity] = OperatorConfig("replace", {"new_value": placeholder})
-            processed_entities.add(entity)
-        elif entity == "DEFAULT" and entity in ENTITY_PLACEHOLDERS:
-             operators["DEFAULT"] = OperatorConfig("replace", {"new_value": ENTITY_PLACEHOLDERS["DEFAULT"]})
-             processed_entities.add(entity)
-        else:
-            known_types = set(ENTITY_PLACEHOLDERS.keys()) | {"PERSON", "LOCATION", "ORG", "DATE_TIME", "NRP",
-                             "EMAIL_ADDRESS", "PHONE_NUMBER", "CREDIT_CARD", "IBAN_CODE", "IP_ADDRESS", "URL",
-                             "RU_QUOTED_DATE", "RU_ADDRESS_PART", "RU_POSTAL_CODE", "RU_IDENTIFIER"}
-            if entity not in known_types:
-                 logger.warning(f"Неизвестный тип сущности '{entity}' обнаружен. Плейсхолдер не будет создан (кроме DEFAULT).")
-            elif entity != "DEFAULT":
-                 logger.warning(f"Сущность '{entity}' не найдена в словаре плейсхолдеров ENTITY_PLACEHOLDERS. Для нее не будет создан оператор замены (кроме DEFAULT, если он активен).")
-            processed_entities.add(entity)
-
-    logger.info(f"Сконфигурированы операторы анонимизации (замена на плейсхолдеры): {list(operators.keys())}")
-    return operators
-
-
-# --- Основная функция анонимизации (асинхронная) ---
-async def anonymize_text_file(
-    input_file: str,
-    output_file: str,
-    entities_to_process: list[str],
-    exceptions_list: set[str],
-    language: str,
-    spacy_model: str
-) -> None:
-    """
-    Основная функция анонимизации текста из файла (асинхронная).
-    Оркестрирует загрузку моделей, настройку Presidio, анализ (Presidio + Natasha),
-    понижение score подозрительных NER, объединение результатов (с приоритетом Stanza),
-    фильтрацию и замену.
-    Блокирующие NLP операции выполняются в отдельных потоках.
-    """
+# --- Подготовка списка сущностей ---
+def _prepare_entities(entities_to_process: list[str]) -> list[str]:
+    """Возвращает список сущностей для обработки (с Natasha-сущностями, если исходный список пуст)."""
     logger = logging.getLogger()
 
     current_entities_to_process = list(entities_to_process)
@@ -574,276 +677,1082 @@ async def anonymize_text_file(
 
         if not current_entities_to_process:
              logger.error("Список сущностей пуст и Natasha недоступна или не ищет нужные типы. Анонимизация невозможна.")
-             return
+             return []
+
+    return current_entities_to_process
 
-    try:
-        # --- 0. Создание кастомных распознавателей ---
-        custom_recognizers_list = create_custom_recognizers()
-        logger.info(f"Создано {len(custom_recognizers_list)} пользовательских распознавателей.")
 
-        # --- 1. Создание основного NLP Engine (spaCy) ---
+# --- Создание анализатора (распознаватели, реестр, Analyzer Engine) ---
+def create_analysis_bundle(
+    entities_to_process: list[str],
+    language: str,
+    spacy_model: str,
+    cascade_mode: bool | None = None,
+    nlp_engine: SpacyNlpEngine | None = None,
+    routing: bool | None = None,
+    en_nlp=None,
+    thresholds: dict | None = None,
+    profile: str | None = None
+) -> dict | None:
+    """
+    Создает все необходимое для анализа документа: реестр распознавателей,
+    Analyzer Engine Presidio, (в каскадном режиме и при маршрутизации) Regex-анализатор без NER
+    и (при маршрутизации) легкий анализатор для английских фрагментов.
+    profile - профиль скорость/полнота из PIPELINE_PROFILES (None - PIPELINE_PROFILE из config.py):
+    определяет, добавляется ли NER spaCy/Stanza в реестр, используется ли каскадный режим и Natasha.
+    cascade_mode=None и routing=None означают значения из профиля/NER_CASCADE_MODE и USE_LANGUAGE_ROUTING из config.py.
+    nlp_engine - уже загруженный SpacyNlpEngine (см. model_loader); если не передан, создается новый.
+    en_nlp - уже загруженная модель spaCy SPACY_MODEL_EN (см. model_loader).
+    thresholds - пороги и множители score (по умолчанию DEFAULT_THRESHOLDS из config.py).
+    Возвращает словарь с ключами language, entities, analyzer, regex_analyzer, en_analyzer,
+    cascade, routing, thresholds, profile, natasha, operators, spec или None, если анализ невозможен.
+    operators - операторы замены для entities (get_anonymizer_operators).
+    spec - аргументы, по которым набор воссоздается в другом процессе (без загруженных моделей).
+    Эта функция является СИНХРОННОЙ (загружает модель spaCy).
+    """
+    logger = logging.getLogger()
+
+    current_entities_to_process = _prepare_entities(entities_to_process)
+    if not current_entities_to_process:
+        return None
+
+    if profile is None:
+        profile = PIPELINE_PROFILE
+    if profile not in PIPELINE_PROFILES:
+        logger.error(f"Неизвестный профиль конвейера '{profile}'. Доступные профили: {', '.join(PIPELINE_PROFILES)}.")
+        return None
+    profile_settings = PIPELINE_PROFILES[profile]
+    use_ner = profile_settings["ner"]
+    logger.info(f"Профиль конвейера: '{profile}' ({profile_settings}).")
+
+    # --- 0. Создание кастомных распознавателей ---
+    custom_recognizers_list = create_custom_recognizers()
+    logger.info(f"Создано {len(custom_recognizers_list)} пользовательских распознавателей.")
+
+    # --- 1. Создание основного NLP Engine (spaCy) ---
+    if not use_ner:
+        spacy_engine = None
+        logger.info("NER spaCy/Stanza отключен профилем: основной NLP Engine не создается.")
+    elif nlp_engine is not None:
+        spacy_engine = nlp_engine
+        logger.info("Используется заранее загруженный NLP Engine (spaCy).")
+    else:
         logger.info(f"Создание основного NLP Engine (spaCy) для языка: {language} с моделью {spacy_model}")
         spacy_engine = SpacyNlpEngine(models=[{"lang_code": language, "model_name": spacy_model}])
         logger.info("Основной NLP Engine (spaCy) успешно создан.")
 
-        # --- 2. Создание и Наполнение Кастомного Реестра Распознавателей Presidio ---
-        logger.info("Создание и наполнение кастомного RecognizerRegistry Presidio...")
-        registry = RecognizerRegistry(supported_languages=[language])
-        logger.info(f"RecognizerRegistry Presidio успешно создан для языков: {[language]}")
+    # --- 2. Создание и Наполнение Кастомного Реестра Распознавателей Presidio ---
+    logger.info("Создание и наполнение кастомного RecognizerRegistry Presidio...")
+    registry = RecognizerRegistry(supported_languages=[language])
+    logger.info(f"RecognizerRegistry Presidio успешно создан для языков: {[language]}")
 
-        # Добавление StanzaRecognizer
-        stanza_supported = {"PERSON", "LOCATION", "ORG", "NRP", "DATE_TIME"}
-        stanza_entities_to_use = list(set(current_entities_to_process) & stanza_supported)
-        if stanza_entities_to_use:
-            logger.info(f"Добавление StanzaRecognizer для сущностей: {stanza_entities_to_use}")
-            try:
-                stanza_recognizer = StanzaRecognizer(
-                    supported_language=language,
-                    supported_entities=stanza_entities_to_use
-                )
-                registry.add_recognizer(stanza_recognizer)
-                logger.info(f"{type(stanza_recognizer).__name__} успешно добавлен в реестр Presidio.")
-            except Exception as e:
-                logger.error(f"Не удалось инициализировать StanzaRecognizer: {e}", exc_info=True)
-        else:
-            logger.info("StanzaRecognizer не используется в Presidio.")
-
-        # Добавление встроенных распознавателей Presidio (Regex)
-        added_built_in = []
-        if "EMAIL_ADDRESS" in current_entities_to_process:
-            registry.add_recognizer(EmailRecognizer(supported_language=language))
-            added_built_in.append("EmailRecognizer")
-        if "PHONE_NUMBER" in current_entities_to_process:
-            custom_phone_exists = any(
-                hasattr(rec, 'supported_entities') and rec.supported_entities and rec.supported_entities[0] == "PHONE_NUMBER"
-                for rec in custom_recognizers_list
+    # Добавление StanzaRecognizer
+    stanza_supported = {"PERSON", "LOCATION", "ORG", "NRP", "DATE_TIME"}
+    stanza_entities_to_use = list(set(current_entities_to_process) & stanza_supported) if use_ner else []
+    if stanza_entities_to_use:
+        logger.info(f"Добавление StanzaRecognizer для сущностей: {stanza_entities_to_use}")
+        try:
+            stanza_recognizer = StanzaRecognizer(
+                supported_language=language,
+                supported_entities=stanza_entities_to_use
             )
-            if not custom_phone_exists:
-                 registry.add_recognizer(PhoneRecognizer(supported_language=language, context=["телефон", "номер", "тел"], default_score=0.6))
-                 added_built_in.append("PhoneRecognizer (встроенный)")
-                 logger.info("Добавлен встроенный PhoneRecognizer.")
-            else:
-                 logger.debug("Встроенный PhoneRecognizer не добавляется, т.к. есть кастомный.")
-
-        if "CREDIT_CARD" in current_entities_to_process:
-            registry.add_recognizer(CreditCardRecognizer(supported_language=language))
-            added_built_in.append("CreditCardRecognizer")
-        if "IBAN_CODE" in current_entities_to_process:
-            registry.add_recognizer(IbanRecognizer(supported_language=language))
-            added_built_in.append("IbanRecognizer")
-        if "IP_ADDRESS" in current_entities_to_process:
-            registry.add_recognizer(IpRecognizer(supported_language=language))
-            added_built_in.append("IpRecognizer")
-        if "URL" in current_entities_to_process:
-            registry.add_recognizer(UrlRecognizer(supported_language=language))
-            added_built_in.append("UrlRecognizer")
-
-        if added_built_in:
-            logger.info(f"Добавлены встроенные распознаватели Presidio (Regex): {', '.join(added_built_in)}.")
-
-        # Добавление пользовательских распознавателей (Regex)
-        added_custom_count = 0
-        for recognizer in custom_recognizers_list:
-            if hasattr(recognizer, 'supported_language') and recognizer.supported_language != language:
-                logger.warning(f"Кастомный распознаватель {getattr(recognizer, 'name', type(recognizer).__name__)} имеет несовпадающий язык ({recognizer.supported_language} вместо {language}) и будет пропущен.")
-                continue
-
-            if hasattr(recognizer, 'supported_entities') and recognizer.supported_entities:
-                 entity_name = recognizer.supported_entities[0]
-                 if entity_name in current_entities_to_process:
-                     registry.add_recognizer(recognizer)
-                     logger.info(f"Добавлен кастомный распознаватель Presidio (Regex): {getattr(recognizer, 'name', type(recognizer).__name__)} для сущности {entity_name}")
-                     added_custom_count += 1
-                 else:
-                      logger.debug(f"Кастомный распознаватель Presidio {getattr(recognizer, 'name', type(recognizer).__name__)} для сущности {entity_name} пропущен (нет в списке entities).")
-            else:
-                 logger.warning(f"Кастомный распознаватель Presidio {getattr(recognizer, 'name', type(recognizer).__name__)} не имеет указанной supported_entities.")
+            registry.add_recognizer(stanza_recognizer)
+            logger.info(f"{type(stanza_recognizer).__name__} успешно добавлен в реестр Presidio.")
+        except Exception as e:
+            logger.error(f"Не удалось инициализировать StanzaRecognizer: {e}", exc_info=True)
+    else:
+        logger.info("StanzaRecognizer не используется в Presidio.")
+
+    # Добавление встроенных распознавателей Presidio (Regex)
+    # Regex-распознаватели собираются в отдельный список: они же используются в каскадном режиме
+    pattern_recognizers = []
+    added_built_in = []
+    if "EMAIL_ADDRESS" in current_entities_to_process:
+        pattern_recognizers.append(EmailRecognizer(supported_language=language))
+        added_built_in.append("EmailRecognizer")
+    if "PHONE_NUMBER" in current_entities_to_process:
+        custom_phone_exists = any(
+            hasattr(rec, 'supported_entities') and rec.supported_entities and rec.supported_entities[0] == "PHONE_NUMBER"
+            for rec in custom_recognizers_list
+        )
+        if not custom_phone_exists:
+             pattern_recognizers.append(PhoneRecognizer(supported_language=language, context=["телефон", "номер", "тел"], default_score=0.6))
+             added_built_in.append("PhoneRecognizer (встроенный)")
+             logger.info("Добавлен встроенный PhoneRecognizer.")
+        else:
+             logger.debug("Встроенный PhoneRecognizer не добавляется, т.к. есть кастомный.")
+
+    if "CREDIT_CARD" in current_entities_to_process:
+        pattern_recognizers.append(CreditCardRecognizer(supported_language=language))
+        added_built_in.append("CreditCardRecognizer")
+    if "IBAN_CODE" in current_entities_to_process:
+        pattern_recognizers.append(IbanRecognizer(supported_language=language))
+        added_built_in.append("IbanRecognizer")
+    if "IP_ADDRESS" in current_entities_to_process:
+        pattern_recognizers.append(IpRecognizer(supported_language=language))
+        added_built_in.append("IpRecognizer")
+    if "URL" in current_entities_to_process:
+        pattern_recognizers.append(UrlRecognizer(supported_language=language))
+        added_built_in.append("UrlRecognizer")
+
+    if added_built_in:
+        logger.info(f"Добавлены встроенные распознаватели Presidio (Regex): {', '.join(added_built_in)}.")
+
+    # Добавление пользовательских распознавателей (Regex)
+    added_custom_count = 0
+    for recognizer in custom_recognizers_list:
+        if hasattr(recognizer, 'supported_language') and recognizer.supported_language != language:
+            logger.warning(f"Кастомный распознаватель {getattr(recognizer, 'name', type(recognizer).__name__)} имеет несовпадающий язык ({recognizer.supported_language} вместо {language}) и будет пропущен.")
+            continue
 
+        if hasattr(recognizer, 'supported_entities') and recognizer.supported_entities:
+             entity_name = recognizer.supported_entities[0]
+             if entity_name in current_entities_to_process:
+                 pattern_recognizers.append(recognizer)
+                 logger.info(f"Добавлен кастомный распознаватель Presidio (Regex): {getattr(recognizer, 'name', type(recognizer).__name__)} для сущности {entity_name}")
+                 added_custom_count += 1
+             else:
+                  logger.debug(f"Кастомный распознаватель Presidio {getattr(recognizer, 'name', type(recognizer).__name__)} для сущности {entity_name} пропущен (нет в списке entities).")
+        else:
+             logger.warning(f"Кастомный распознаватель Presidio {getattr(recognizer, 'name', type(recognizer).__name__)} не имеет указанной supported_entities.")
 
-        logger.info(f"Добавлено {added_custom_count} пользовательских распознавателей Presidio (Regex).")
-        logger.info("Кастомный RecognizerRegistry Presidio успешно наполнен.")
 
-        # --- 3. Настройка Analyzer Engine Presidio ---
+    for recognizer in pattern_recognizers:
+        registry.add_recognizer(recognizer)
+    logger.info(f"Добавлено {added_custom_count} пользовательских распознавателей Presidio (Regex).")
+    logger.info("Кастомный RecognizerRegistry Presidio успешно наполнен.")
+
+    # --- 3. Настройка Analyzer Engine Presidio ---
+    if use_ner:
         logger.info("Инициализация Analyzer Engine Presidio с SpacyNlpEngine и кастомным реестром...")
         analyzer = AnalyzerEngine(
             nlp_engine=spacy_engine,
             registry=registry,
             supported_languages=[language],
-            default_score_threshold=DEFAULT_SCORE_THRESHOLD
+            default_score_threshold=DEFAULT_SCORE_THRESHOLD,
+            # Индекс ключевых слов строится один раз на документ (score те же, что у LemmaContextAwareEnhancer)
+            context_aware_enhancer=IndexedContextAwareEnhancer()
         )
         logger.info(f"Analyzer Engine Presidio успешно инициализирован (Default Score Threshold: {DEFAULT_SCORE_THRESHOLD}).")
+    else:
+        analyzer = _create_regex_only_analyzer(pattern_recognizers, language, spacy_model)
+        logger.info("Analyzer Engine Presidio инициализирован только с Regex-распознавателями (без NER-модели).")
+
+    # --- 3.1 Regex-анализатор без NER для каскадного режима и маршрутизации ---
+    regex_analyzer = None
+    if cascade_mode is None:
+        cascade_mode = NER_CASCADE_MODE or profile_settings["cascade"]
+    if not use_ner:
+        cascade_mode = False # Без NER каскаду нечего уточнять
+    if routing is None:
+        routing = USE_LANGUAGE_ROUTING
+    if not use_ner and routing:
+        regex_analyzer = analyzer
+    elif cascade_mode or routing:
+        regex_analyzer = _create_regex_only_analyzer(pattern_recognizers, language, spacy_model)
+        logger.info("Создан Regex-анализатор без NER-модели (каскадный режим NER или маршрутизация по письменности).")
+
+    # --- 3.2 Легкий анализатор для английских фрагментов ---
+    en_analyzer = None
+    if routing:
+        en_analyzer = _create_en_analyzer(current_entities_to_process, en_nlp)
+        logger.info(
+            "Маршрутизация по письменности включена: английские фрагменты обрабатываются "
+            + (f"моделью '{SPACY_MODEL_EN}' и Regex." if en_analyzer else "только Regex.")
+        )
 
-        # --- 4. Настройка Anonymizer Engine (Presidio) ---
-        logger.info("Инициализация Anonymizer Engine Presidio...")
-        anonymizer = AnonymizerEngine()
-        logger.info("Anonymizer Engine Presidio успешно инициализирован.")
+    return {
+        "language": language,
+        "entities": current_entities_to_process,
+        "analyzer": analyzer,
+        "regex_analyzer": regex_analyzer,
+        "en_analyzer": en_analyzer,
+        "cascade": bool(cascade_mode),
+        "routing": bool(routing),
+        "thresholds": dict(thresholds or DEFAULT_THRESHOLDS),
+        "profile": profile,
+        "natasha": profile_settings["natasha"],
+        "operators": get_anonymizer_operators(current_entities_to_process),
+        "spec": {
+            "entities_to_process": list(entities_to_process),
+            "language": language,
+            "spacy_model": spacy_model,
+            "cascade_mode": bool(cascade_mode),
+            "routing": bool(routing),
+            "thresholds": dict(thresholds or DEFAULT_THRESHOLDS),
+            "profile": profile
+        }
+    }
 
-        # --- 5. Чтение входного файла ---
-        logger.info(f"Чтение входного файла: {input_file}")
-        try:
-            async with aiofiles.open(input_file, mode='r', encoding='utf-8') as f_in:
-                text_to_anonymize_local = await f_in.read()
-            logger.info(f"Файл '{input_file}' успешно прочитан (длина: {len(text_to_anonymize_local)} символов).")
-        except FileNotFoundError:
-            logger.error(f"Входной файл '{input_file}' не найден.")
-            return
-        except Exception as e:
-            logger.error(f"Ошибка при чтении файла '{input_file}': {e}")
-            return
-
-        # --- 6. Анализ текста ---
-        # --- 6.1 Анализ с помощью Presidio (ВЫНОСИМ В ПОТОК) ---
-        logger.info(f"Запуск анализа текста с помощью Presidio (в отдельном потоке) для поиска сущностей: {current_entities_to_process}...")
-        presidio_analyzer_results = await asyncio.to_thread(
-            analyzer.analyze,
-            text=text_to_anonymize_local,
-            entities=current_entities_to_process,
-            language=language,
-            return_decision_process=True
+
+# --- Кэш наборов для анализа (разные списки сущностей и профили в одном процессе) ---
+_bundle_cache = OrderedDict()
+_bundle_builds: dict[tuple, Future] = {} # Наборы, создаваемые сейчас (ключ кэша -> Future с набором)
+_bundle_cache_lock = threading.Lock()
+
+
+def get_analysis_bundle(
+    entities_to_process: list[str],
+    language: str,
+    spacy_model: str,
+    nlp_engine: SpacyNlpEngine | None = None,
+    en_nlp=None,
+    thresholds: dict | None = None,
+    profile: str | None = None
+) -> dict | None:
+    """
+    Возвращает набор для анализа из кэша (последние BUNDLE_CACHE_SIZE наборов) или создает его
+    create_analysis_bundle. Ключ - множество сущностей (без учета порядка и повторов), профиль,
+    пороги score и загруженные модели: наборы используют общие модели, поэтому переключение между
+    списками сущностей разных клиентов не пересоздает реестр распознавателей, анализаторы и операторы.
+    Набор с другими порогами, но тем же реестром, создается копированием без пересоздания анализаторов.
+    Возвращаемый набор общий для всех вызывающих и не должен изменяться.
+    Эта функция является СИНХРОННОЙ.
+    """
+    logger = logging.getLogger()
+    thresholds = dict(thresholds or DEFAULT_THRESHOLDS)
+    entities = sorted(set(entities_to_process))
+    registry_key = (tuple(entities), language, spacy_model, profile or PIPELINE_PROFILE, id(nlp_engine), id(en_nlp))
+    key = (registry_key, tuple(sorted(thresholds.items())))
+
+    # Блокировка удерживается только для чтения и вставки: набор создается вне ее (секунды), и обращения
+    # к другим наборам не ждут. Одновременные запросы одного нового набора ждут его общий Future
+    with _bundle_cache_lock:
+        bundle = _bundle_cache.get(key)
+        if bundle is not None:
+            _bundle_cache.move_to_end(key)
+            return bundle
+
+        same_registry = next((cached for (cached_key, _), cached in _bundle_cache.items() if cached_key == registry_key), None)
+        if same_registry is not None:
+            bundle = dict(same_registry, thresholds=thresholds, spec=dict(same_registry["spec"], thresholds=thresholds))
+            _cache_bundle(key, bundle, logger)
+            return bundle
+
+        pending = _bundle_builds.get(key)
+        building = pending is None
+        if building:
+            pending = _bundle_builds[key] = Future()
+    if not building:
+        return pending.result()
+
+    try:
+        start_time = time.perf_counter()
+        bundle = create_analysis_bundle(
+            entities, language, spacy_model,
+            nlp_engine=nlp_engine, en_nlp=en_nlp, thresholds=thresholds, profile=profile
         )
-        logger.info(f"Анализ Presidio завершен.")
-        log_results_list(presidio_analyzer_results, "Результаты Presidio Analyzer (до корректировки score)", text_to_anonymize_local, logger)
-
-        # --- 6.2 Анализ с помощью Natasha (ВЫНОСИМ В ПОТОК) ---
-        natasha_analyzer_results = []
-        natasha_entities_to_find = list(set(current_entities_to_process) & {"PERSON", "LOCATION", "ORG"})
-        if NATASHA_AVAILABLE and natasha_entities_to_find:
-            logger.info(f"Запуск анализа Natasha (в отдельном потоке) для сущностей: {natasha_entities_to_find}...")
-            natasha_analyzer_results = await asyncio.to_thread(
-                run_natasha_ner,
-                text_to_anonymize_local
-                # score_threshold теперь берется из config внутри run_natasha_ner
-            )
-            log_results_list(natasha_analyzer_results, "Результаты Natasha NER (до корректировки score)", text_to_anonymize_local, logger)
-        elif not NATASHA_AVAILABLE:
-             logger.info("Анализ Natasha пропущен (библиотека недоступна).")
+        if bundle is not None:
+            logger.info(f"Создан набор для анализа {entities} (профиль '{bundle['profile']}') за {time.perf_counter() - start_time:.2f} сек.")
+    except BaseException as e:
+        with _bundle_cache_lock:
+            del _bundle_builds[key]
+        pending.set_exception(e)
+        raise
+
+    with _bundle_cache_lock:
+        if bundle is not None:
+            _cache_bundle(key, bundle, logger)
+        del _bundle_builds[key]
+    pending.set_result(bundle)
+    return bundle
+
+
+def _cache_bundle(key: tuple, bundle: dict, logger: logging.Logger) -> None:
+    """Добавляет набор в кэш и вытесняет самые давно использованные (вызывается под _bundle_cache_lock)."""
+    _bundle_cache[key] = bundle
+    while len(_bundle_cache) > BUNDLE_CACHE_SIZE:
+        (evicted_key, _), _ = _bundle_cache.popitem(last=False)
+        logger.info(f"Набор для анализа {list(evicted_key[0])} (профиль '{evicted_key[3]}') вытеснен из кэша.")
+
+
+def _create_regex_only_analyzer(recognizers: list, language: str, spacy_model: str) -> AnalyzerEngine:
+    """
+    Создает Analyzer Engine только с Regex-распознавателями поверх пустого конвейера spaCy
+    (только токенизация, без NER). Усиление score по контексту в нем не работает,
+    т.к. у пустого конвейера нет лемм.
+    """
+    registry = RecognizerRegistry(supported_languages=[language])
+    for recognizer in recognizers:
+        registry.add_recognizer(recognizer)
+    blank_engine = SpacyNlpEngine(models=[{"lang_code": language, "model_name": spacy_model}])
+    blank_engine.nlp = {language: spacy.blank(language)}
+    return AnalyzerEngine(
+        nlp_engine=blank_engine,
+        registry=registry,
+        supported_languages=[language],
+        default_score_threshold=DEFAULT_SCORE_THRESHOLD
+    )
+
+
+# Сущности, которые SpacyRecognizer находит английской моделью spaCy
+EN_NER_SUPPORTED_ENTITIES = {"PERSON", "LOCATION", "ORG", "NRP", "DATE_TIME"}
+
+
+def _create_en_analyzer(entities: list[str], en_nlp=None) -> AnalyzerEngine | None:
+    """
+    Создает Analyzer Engine для английских фрагментов только с SpacyRecognizer модели SPACY_MODEL_EN
+    (Regex-распознаватели для этих фрагментов выполняет Regex-анализатор).
+    Возвращает None, если NER-сущности не запрошены или модель недоступна.
+    """
+    logger = logging.getLogger()
+    en_entities = list(set(entities) & EN_NER_SUPPORTED_ENTITIES)
+    if not en_entities:
+        return None
+    try:
+        if en_nlp is not None:
+            en_engine = SpacyNlpEngine(models=[{"lang_code": "en", "model_name": SPACY_MODEL_EN}])
+            en_engine.nlp = {"en": en_nlp}
         else:
-             logger.info("Анализ Natasha пропущен (сущности PERSON, LOCATION, ORG не запрошены).")
-
-        # --- 6.3 Корректировка score подозрительных NER результатов ---
-        logger.info("Корректировка score для подозрительных NER результатов (spaCy, Natasha)...")
-        presidio_adjusted_results = _adjust_ner_scores(presidio_analyzer_results, text_to_anonymize_local, logger)
-        natasha_adjusted_results = _adjust_ner_scores(natasha_analyzer_results, text_to_anonymize_local, logger)
-        log_results_list(presidio_adjusted_results, "Результаты Presidio Analyzer (ПОСЛЕ корректировки score)", text_to_anonymize_local, logger)
-        log_results_list(natasha_adjusted_results, "Результаты Natasha NER (ПОСЛЕ корректировки score)", text_to_anonymize_local, logger)
-
-
-        # --- 6.4 Объединение и фильтрация ---
-        logger.info("Объединение и фильтрация результатов (двухпроходный метод)...")
-        merged_results = merge_and_filter_results(
-            presidio_adjusted_results,
-            natasha_adjusted_results,
-            text_to_anonymize_local
-        )
-        log_results_list(merged_results, "Результаты после merge_and_filter_results (2-проходный)", text_to_anonymize_local, logger)
-
-        # --- 6.5 Фильтрация с приоритетом NER над Regex ---
-        logger.info("Применение фильтра приоритета NER...")
-        prioritized_results = filter_by_ner_priority(merged_results, text_to_anonymize_local)
-        logger.info("Фильтрация по приоритету NER завершена.")
-        log_results_list(prioritized_results, "Результаты после filter_by_ner_priority", text_to_anonymize_local, logger)
-
-        # --- 7. Фильтрация результатов с учетом исключений ---
-        analyzer_results_filtered_exceptions = []
-        if exceptions_list:
-            logger.info(f"Применение фильтра исключений ({len(exceptions_list)} шт.)...")
-            filtered_count_exc = 0
-            for result in prioritized_results:
-                identified_text = text_to_anonymize_local[result.start:result.end]
-                if identified_text.strip().lower() in exceptions_list:
-                    recognizer_name, _ = _get_recognizer_info(result)
-                    logger.debug(f"  Результат '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], score={result.score:.3f}, rec={recognizer_name}) пропущен из-за наличия в exceptions.txt.")
-                    filtered_count_exc += 1
-                else:
-                    analyzer_results_filtered_exceptions.append(result)
-            logger.info(f"Фильтрация исключений: {filtered_count_exc} результатов пропущено.")
+            from model_loader import load_spacy_engine
+            en_engine = load_spacy_engine("en", SPACY_MODEL_EN)
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить модель spaCy '{SPACY_MODEL_EN}' для английских фрагментов: {e}")
+        return None
+
+    registry = RecognizerRegistry(supported_languages=["en"])
+    registry.add_recognizer(SpacyRecognizer(supported_language="en", supported_entities=en_entities))
+    return AnalyzerEngine(
+        nlp_engine=en_engine,
+        registry=registry,
+        supported_languages=["en"],
+        default_score_threshold=DEFAULT_SCORE_THRESHOLD
+    )
+
+
+# --- Анализ части текста со смещением результатов ---
+def _analyze_region(
+    analyzer: AnalyzerEngine,
+    text: str,
+    start: int,
+    end: int,
+    entities: list[str],
+    language: str,
+    score_threshold: float | None = None
+) -> list[RecognizerResult]:
+    """
+    Анализирует text[start:end] и переводит границы результатов в координаты всего текста.
+    score_threshold=None означает порог, заданный при создании Analyzer Engine.
+    При микропакетах (set_micro_batching) конвейер spaCy выполняется в общем пакете с другими запросами.
+    """
+    region_text = text if (start, end) == (0, len(text)) else text[start:end]
+    nlp_artifacts = None
+    if _nlp_batcher is not None:
+        nlp_artifacts = _nlp_batcher.submit((analyzer.nlp_engine, language, region_text))
+    region_results = analyzer.analyze(
+        text=region_text,
+        entities=entities,
+        language=language,
+        score_threshold=score_threshold,
+        return_decision_process=True,
+        nlp_artifacts=nlp_artifacts
+    )
+    if start:
+        for result in region_results:
+            result.start += start
+            result.end += start
+    return region_results
+
+
+# --- Параллельный анализ частей документа ---
+_shard_executor = None
+_shard_executor_key = None
+_shard_executor_lock = threading.Lock()
+# Набор для анализа в рабочем процессе (ANALYSIS_EXECUTOR = "process")
+_process_bundle = None
+# Планировщик слотов анализа для сервиса (scheduler.AnalysisScheduler), None - без планирования
+_analysis_scheduler = None
+
+
+def set_analysis_scheduler(scheduler) -> None:
+    """
+    Включает (None - отключает) планирование анализа: части Presidio и группы предложений Natasha
+    выполняются последовательно, каждая в слоте планировщика, а документ режется на части
+    по scheduler.shard_chars символов (если не задан ANALYSIS_SHARD_CHARS). Пул частей не используется:
+    параллельность дают потоки запросов сервиса.
+    """
+    global _analysis_scheduler
+    _analysis_scheduler = scheduler
+
+
+def _scheduled_slot():
+    """Слот планировщика анализа (без планировщика - пустой контекст)."""
+    return _analysis_scheduler.slot() if _analysis_scheduler is not None else nullcontext()
+
+
+# --- Микропакеты NER для одновременных запросов (сервис) ---
+# MicroBatcher для конвейера spaCy (NLP-артефакты Presidio) и Natasha NER, None - без микропакетов
+_nlp_batcher = None
+_natasha_batcher = None
+
+
+def _process_nlp_batch(items: list[tuple]) -> list:
+    """NLP-артефакты для пакета (nlp_engine, язык, текст): один проход nlp.pipe на каждую пару движок/язык."""
+    artifacts = [None] * len(items)
+    groups = {}
+    for index, (nlp_engine, language, _) in enumerate(items):
+        groups.setdefault((id(nlp_engine), language), (nlp_engine, language, []))[2].append(index)
+    for nlp_engine, language, indexes in groups.values():
+        texts = [items[index][2] for index in indexes]
+        for index, (_, nlp_artifacts) in zip(indexes, nlp_engine.process_batch(texts, language, batch_size=len(texts))):
+            artifacts[index] = nlp_artifacts
+    return artifacts
+
+
+def _process_natasha_batch(items: list[list[str]]) -> list[list]:
+    """Natasha NER для пакета списков предложений: предложения всех запросов размечаются одним проходом."""
+    markups = list(ner_tagger.map([sentence for item in items for sentence in item]))
+    results, position = [], 0
+    for item in items:
+        results.append(markups[position:position + len(item)])
+        position += len(item)
+    return results
+
+
+def set_micro_batching(max_batch_size: int | None, max_delay: float = 0.0, expected_items=None) -> None:
+    """
+    Включает (max_batch_size=None - отключает) микропакеты: конвейер spaCy частей документов и
+    Natasha NER одновременно анализируемых запросов выполняются общими пакетами (microbatch.py) -
+    не больше max_batch_size элементов, сбор пакета не дольше max_delay сек. expected_items() - сколько
+    запросов анализируется сейчас (без него пакет всегда собирается max_delay). Результат NER может
+    незначительно отличаться от анализа по одному, как при любом изменении состава пакета.
+    """
+    global _nlp_batcher, _natasha_batcher
+    if max_batch_size is None:
+        _nlp_batcher, _natasha_batcher = None, None
+        return
+    _nlp_batcher = MicroBatcher("spacy", _process_nlp_batch, max_batch_size, max_delay, expected_items)
+    _natasha_batcher = MicroBatcher("natasha", _process_natasha_batch, max_batch_size, max_delay, expected_items)
+
+
+def micro_batch_stats() -> dict[str, dict[str, int]]:
+    """Число пакетов и элементов по каждому MicroBatcher (пустой словарь без микропакетов)."""
+    return {batcher.name: dict(batcher.stats) for batcher in (_nlp_batcher, _natasha_batcher) if batcher is not None}
+
+
+def _shard_chars() -> int | None:
+    """Размер части документа: ANALYSIS_SHARD_CHARS, а при планировании без него - размер части планировщика."""
+    if ANALYSIS_SHARD_CHARS is None and _analysis_scheduler is not None:
+        return _analysis_scheduler.shard_chars
+    return ANALYSIS_SHARD_CHARS
+
+
+def _init_shard_process(bundle_spec: dict) -> None:
+    """Инициализатор рабочего процесса: загружает модели и создает свой набор для анализа."""
+    global _process_bundle
+    _process_bundle = create_analysis_bundle(**bundle_spec)
+
+
+def _analyze_shard_in_process(analyzer_key: str, shard_text: str, language: str, score_threshold: float) -> list[RecognizerResult]:
+    return _analyze_region(_process_bundle[analyzer_key], shard_text, 0, len(shard_text), _process_bundle["entities"], language, score_threshold)
+
+
+def _natasha_shard_in_process(shard_text: str, thresholds: dict, sentences: list[tuple[int, int]]) -> list[RecognizerResult]:
+    return run_natasha_ner(shard_text, thresholds, sentences, tag_morph=False)
+
+
+def _get_shard_executor(bundle: dict) -> Executor | None:
+    """
+    Возвращает пул для анализа частей документа (создается при первом использовании)
+    или None, если ANALYSIS_WORKERS <= 1. Пул процессов пересоздается при изменении набора.
+    """
+    global _shard_executor, _shard_executor_key
+    if ANALYSIS_WORKERS <= 1 or _analysis_scheduler is not None:
+        return None
+    use_processes = ANALYSIS_EXECUTOR == "process"
+    key = (use_processes, ANALYSIS_WORKERS, repr(bundle["spec"]) if use_processes else None)
+    with _shard_executor_lock:
+        if _shard_executor_key != key:
+            if _shard_executor is not None:
+                _shard_executor.shutdown(wait=False)
+            if use_processes:
+                logging.getLogger().info(f"Создание пула из {ANALYSIS_WORKERS} процессов для анализа частей документа (каждый загружает модели)...")
+                _shard_executor = ProcessPoolExecutor(
+                    max_workers=ANALYSIS_WORKERS, initializer=_init_shard_process, initargs=(bundle["spec"],)
+                )
+            else:
+                _shard_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="shard")
+            _shard_executor_key = key
+        return _shard_executor
+
+
+def _shard(text: str, regions: list[tuple[int, int]], sentences: list[tuple[int, int]] | None) -> list[tuple[int, int]]:
+    """Разбивает регионы анализа на части _shard_chars() по границам предложений (None - без разбиения)."""
+    shard_chars = _shard_chars()
+    if shard_chars is None:
+        return regions
+    if sentences is None:
+        sentences = segment_sentences(text)
+    return shard_regions(regions, sentences, shard_chars)
+
+
+def _analyze_regions(
+    bundle: dict,
+    analyzer_key: str,
+    text: str,
+    regions: list[tuple[int, int]],
+    language: str
+) -> list[RecognizerResult]:
+    """
+    Анализирует регионы анализатором bundle[analyzer_key] (при ANALYSIS_WORKERS > 1 - параллельно)
+    и возвращает результаты в координатах всего текста.
+    Результаты собираются в порядке регионов, поэтому не зависят от числа потоков/процессов.
+    """
+    score_threshold = bundle["thresholds"]["DEFAULT_SCORE_THRESHOLD"]
+    executor = _get_shard_executor(bundle) if len(regions) > 1 else None
+    if executor is None:
+        results = []
+        for region_start, region_end in regions:
+            with _scheduled_slot():
+                results.extend(_analyze_region(bundle[analyzer_key], text, region_start, region_end, bundle["entities"], language, score_threshold))
+        return results
+
+    in_process = isinstance(executor, ProcessPoolExecutor)
+    if in_process:
+        futures = [
+            executor.submit(_analyze_shard_in_process, analyzer_key, text[region_start:region_end], language, score_threshold)
+            for region_start, region_end in regions
+        ]
+    else:
+        futures = [
+            executor.submit(_analyze_region, bundle[analyzer_key], text, region_start, region_end, bundle["entities"], language, score_threshold)
+            for region_start, region_end in regions
+        ]
+    results = []
+    for (region_start, _), future in zip(regions, futures):
+        region_results = future.result()
+        if in_process and region_start:
+            for result in region_results:
+                result.start += region_start
+                result.end += region_start
+        results.extend(region_results)
+    return results
+
+
+def _run_natasha_sharded(
+    text: str,
+    bundle: dict,
+    sentences: list[tuple[int, int]]
+) -> list[RecognizerResult]:
+    """
+    Natasha NER по группам предложений, параллельно (ANALYSIS_WORKERS > 1 и задан ANALYSIS_SHARD_CHARS)
+    или последовательно в слотах планировщика анализа (set_analysis_scheduler).
+    Группа содержит целое число пакетов NATASHA_BATCH_SIZE, поэтому результат совпадает с анализом целиком.
+    С морфологическим разбором (NATASHA_TAG_MORPH) текст анализируется целиком.
+    """
+    thresholds = bundle["thresholds"]
+    shard_chars = _shard_chars()
+    executor = _get_shard_executor(bundle) if shard_chars is not None and not NATASHA_TAG_MORPH else None
+    scheduled = _analysis_scheduler is not None and shard_chars is not None and not NATASHA_TAG_MORPH
+    if (executor is None and not scheduled) or len(sentences) <= NATASHA_BATCH_SIZE or not init_natasha():
+        with _scheduled_slot():
+            return run_natasha_ner(text, thresholds, sentences)
+
+    average_sentence_chars = max(1, sum(end - start for start, end in sentences) // len(sentences))
+    batches_per_shard = max(1, shard_chars // (average_sentence_chars * NATASHA_BATCH_SIZE))
+    shard_size = batches_per_shard * NATASHA_BATCH_SIZE
+    groups = [sentences[index:index + shard_size] for index in range(0, len(sentences), shard_size)]
+    if executor is None:
+        results = []
+        for group in groups:
+            with _scheduled_slot():
+                results.extend(run_natasha_ner(text, thresholds, group, False))
+        return results
+
+    in_process = isinstance(executor, ProcessPoolExecutor)
+    futures = []
+    for group in groups:
+        if in_process:
+            group_start, group_end = group[0][0], group[-1][1]
+            relative_sentences = [(start - group_start, end - group_start) for start, end in group]
+            futures.append(executor.submit(_natasha_shard_in_process, text[group_start:group_end], thresholds, relative_sentences))
+        else:
+            futures.append(executor.submit(run_natasha_ner, text, thresholds, group, False))
+    results = []
+    for group, future in zip(groups, futures):
+        group_results = future.result()
+        if in_process:
+            for result in group_results:
+                result.start += group[0][0]
+                result.end += group[0][0]
+        results.extend(group_results)
+    return results
+
+
+# --- Каскадный режим NER ---
+# Признаки возможной сущности в предложении: слово с заглавной буквы не в начале, кавычки, числа
+CASCADE_SIGNAL_PATTERN = re.compile(r'(?<=[\s(\[])[A-ZА-ЯЁ][\w-]*|[«»"“”„]|\d{2,}')
+
+
+def _select_cascade_regions(
+    text: str,
+    sentences: list[tuple[int, int]],
+    cheap_results: list[RecognizerResult],
+    thresholds: dict | None = None
+) -> list[tuple[int, int]]:
+    """
+    Выбирает предложения, для которых нужен полный NER, и объединяет соседние в регионы.
+    Предложение отправляется на NER, если в нем есть результат дешевых этапов со score
+    в диапазоне [NER_FILTER_LOW_SCORE_THRESHOLD, ANCHOR_SCORE_THRESHOLD) или признак сущности,
+    не покрытый уверенным (>= ANCHOR_SCORE_THRESHOLD) результатом.
+    Предложения без признаков пропускаются сразу.
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    low_score_threshold = thresholds["NER_FILTER_LOW_SCORE_THRESHOLD"]
+    anchor_score_threshold = thresholds["ANCHOR_SCORE_THRESHOLD"]
+    sorted_results = sorted(cheap_results, key=lambda r: r.start)
+    regions = []
+    result_index = 0
+    for sentence_start, sentence_end in sentences:
+        while result_index < len(sorted_results) and sorted_results[result_index].end <= sentence_start:
+            result_index += 1
+        sentence_results = []
+        for result in sorted_results[result_index:]:
+            if result.start >= sentence_end:
+                break
+            if result.end > sentence_start:
+                sentence_results.append(result)
+
+        escalate = any(low_score_threshold <= res.score < anchor_score_threshold for res in sentence_results)
+        if not escalate:
+            confident_spans = [(res.start, res.end) for res in sentence_results if res.score >= anchor_score_threshold]
+            for signal in CASCADE_SIGNAL_PATTERN.finditer(text[sentence_start:sentence_end]):
+                signal_start = sentence_start + signal.start()
+                signal_end = sentence_start + signal.end()
+                if not any(start <= signal_start and signal_end <= end for start, end in confident_spans):
+                    escalate = True
+                    break
+
+        if not escalate:
+            continue
+        if regions and not text[regions[-1][1]:sentence_start].strip():
+            regions[-1] = (regions[-1][0], sentence_end)
         else:
-            logger.info("Список исключений пуст или не загружен. Фильтрация исключений не применяется.")
-            analyzer_results_filtered_exceptions = prioritized_results
-        log_results_list(analyzer_results_filtered_exceptions, "Результаты после фильтрации исключений", text_to_anonymize_local, logger)
-
-        # --- 8. Фильтрация ложных срабатываний NER ---
-        analyzer_results_final_filtered = []
-        logger.info(f"Применение фильтра ложных срабатываний NER (по списку NER_FALSE_POSITIVE_FILTER)...")
-        filtered_count_ner = 0
-        ner_types_to_filter = {"PERSON", "LOCATION", "ORG"}
-        for result in analyzer_results_filtered_exceptions:
-            recognizer_name, _ = _get_recognizer_info(result)
-            apply_ner_filter = False
-            is_ner_res = is_ner_result(result)
-            is_target_type = result.entity_type in ner_types_to_filter
-
-            if is_ner_res and is_target_type:
-                identified_text = text_to_anonymize_local[result.start:result.end]
-                cleaned_text = identified_text.strip().lower()
-
-                if not cleaned_text or cleaned_text.isnumeric() or all(c in '.,!?;:()[]{}<>"\'`~@#$%^&*-_=+|\n\t ' for c in cleaned_text):
-                     logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен, т.к. содержит только пунктуацию/пробелы/цифры.")
-                     apply_ner_filter = True
-                elif cleaned_text in NER_FALSE_POSITIVE_FILTER:
-                    logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен из-за точного совпадения с фильтром NER_FALSE_POSITIVE_FILTER.")
+            regions.append((sentence_start, sentence_end))
+    return regions
+
+
+def _analyze_full_regions(
+    text: str,
+    bundle: dict,
+    regex_results: list[RecognizerResult],
+    regions: list[tuple[int, int]],
+    sentences: list[tuple[int, int]] | None = None
+) -> list[RecognizerResult]:
+    """
+    Выполняет полный анализ (spaCy/Stanza + Regex с контекстом) в регионах;
+    результаты Regex-анализатора внутри этих регионов заменяются результатами полного анализа.
+    regions - отсортированные непересекающиеся регионы.
+    sentences - предложения, по границам которых длинные регионы делятся на части (ANALYSIS_SHARD_CHARS).
+    """
+    full_results = _analyze_regions(bundle, "analyzer", text, _shard(text, regions, sentences), bundle["language"])
+
+    # Регион, который может содержать результат, - последний с началом не позже начала результата (поиск делением пополам)
+    region_starts = [start for start, _ in regions]
+
+    def inside_region(res: RecognizerResult) -> bool:
+        index = bisect_right(region_starts, res.start) - 1
+        return index >= 0 and res.end <= regions[index][1]
+
+    kept_regex_results = [res for res in regex_results if not inside_region(res)]
+    return kept_regex_results + full_results
+
+
+def _run_cascade_analysis(
+    text: str,
+    bundle: dict,
+    cheap_results: list[RecognizerResult],
+    logger: logging.Logger,
+    sentences: list[tuple[int, int]] | None = None
+) -> list[RecognizerResult]:
+    """
+    Каскадный анализ: Regex-распознаватели по всему тексту, затем полный анализ
+    (spaCy/Stanza + Regex с контекстом) только в регионах, где дешевые этапы не уверены.
+    sentences - уже найденные предложения текста (если None, текст сегментируется заново).
+    """
+    regex_results = _analyze_region(bundle["regex_analyzer"], text, 0, len(text), bundle["entities"], bundle["language"], bundle["thresholds"]["DEFAULT_SCORE_THRESHOLD"])
+
+    if sentences is None:
+        sentences = segment_sentences(text)
+    regions = _select_cascade_regions(text, sentences, regex_results + cheap_results, bundle["thresholds"])
+    results = _analyze_full_regions(text, bundle, regex_results, regions, sentences)
+
+    escalated_chars = sum(end - start for start, end in regions)
+    logger.info(
+        f"Каскадный анализ: полный NER выполнен в {len(regions)} регионах "
+        f"({escalated_chars} из {len(text)} символов, {len(sentences)} предложений всего)."
+    )
+    return results
+
+
+# --- Маршрутизация по письменности ---
+def _log_route_throughput(route_stats: dict[str, tuple[int, float]], logger: logging.Logger) -> None:
+    """Выводит объем и скорость обработки по маршрутам (символов в секунду)."""
+    for route_name, (chars, seconds) in route_stats.items():
+        speed = f"{chars / seconds:.0f} симв./сек." if seconds > 0 else "-"
+        logger.info(f"  Маршрут '{route_name}': {chars} символов за {seconds:.2f} сек. ({speed})")
+
+
+def _run_routed_analysis(
+    text: str,
+    bundle: dict,
+    routes: dict[str, list[tuple[int, int]]],
+    cheap_results: list[RecognizerResult],
+    logger: logging.Logger
+) -> list[RecognizerResult]:
+    """
+    Анализ с маршрутизацией по письменности: Regex-распознаватели по всему тексту,
+    полный ru анализ (или каскадный) только в кириллических предложениях,
+    английская модель spaCy - в латинских. Предложения без слов обрабатываются только Regex.
+    Все результаты возвращаются в координатах всего текста.
+    """
+    route_stats = {}
+
+    start_time = time.perf_counter()
+    regex_results = _analyze_region(bundle["regex_analyzer"], text, 0, len(text), bundle["entities"], bundle["language"], bundle["thresholds"]["DEFAULT_SCORE_THRESHOLD"])
+    route_stats["regex"] = (len(text), time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    cyrillic_sentences = routes[SCRIPT_CYRILLIC]
+    if bundle["analyzer"] is bundle["regex_analyzer"]:
+        ru_regions = [] # Профиль без NER: Regex-анализ уже выполнен по всему тексту
+    elif bundle["cascade"]:
+        ru_regions = _select_cascade_regions(text, cyrillic_sentences, regex_results + cheap_results, bundle["thresholds"])
+    else:
+        ru_regions = merge_adjacent_regions(text, cyrillic_sentences)
+    results = _analyze_full_regions(text, bundle, regex_results, ru_regions, cyrillic_sentences)
+    route_stats[bundle["language"]] = (sum(end - start for start, end in ru_regions), time.perf_counter() - start_time)
+
+    latin_regions = merge_adjacent_regions(text, routes[SCRIPT_LATIN])
+    if bundle["en_analyzer"] is not None and latin_regions:
+        start_time = time.perf_counter()
+        results.extend(_analyze_regions(bundle, "en_analyzer", text, _shard(text, latin_regions, routes[SCRIPT_LATIN]), "en"))
+        route_stats["en"] = (sum(end - start for start, end in latin_regions), time.perf_counter() - start_time)
+
+    logger.info(
+        f"Маршрутизация по письменности: предложений на кириллице {len(cyrillic_sentences)}, "
+        f"на латинице {len(routes[SCRIPT_LATIN])}, без слов {len(routes[SCRIPT_NONE])}."
+    )
+    _log_route_throughput(route_stats, logger)
+    return results
+
+
+def _run_presidio_analysis(
+    text: str,
+    bundle: dict,
+    cheap_results: list[RecognizerResult],
+    logger: logging.Logger,
+    routes: dict[str, list[tuple[int, int]]] | None = None,
+    sentences: list[tuple[int, int]] | None = None
+) -> list[RecognizerResult]:
+    """
+    Запускает анализ Presidio по всему тексту, с маршрутизацией по письменности или в каскадном режиме.
+    При заданном ANALYSIS_SHARD_CHARS текст анализируется частями по границам предложений.
+    """
+    if routes is not None:
+        return _run_routed_analysis(text, bundle, routes, cheap_results, logger)
+    if bundle["cascade"]:
+        return _run_cascade_analysis(text, bundle, cheap_results, logger, sentences)
+    shards = _shard(text, [(0, len(text))], sentences)
+    if len(shards) > 1:
+        logger.info(f"Анализ Presidio частями: {len(shards)} частей по ~{_shard_chars()} символов, параллельно: {max(1, ANALYSIS_WORKERS)}.")
+    return _analyze_regions(bundle, "analyzer", text, shards, bundle["language"])
+
+
+# --- Фильтрация результатов с учетом исключений ---
+def _filter_exceptions(
+    results: list[RecognizerResult],
+    text: str,
+    exceptions_list: set[str],
+    logger: logging.Logger
+) -> list[RecognizerResult]:
+    """Удаляет результаты, текст которых есть в списке исключений."""
+    analyzer_results_filtered_exceptions = []
+    if exceptions_list:
+        logger.info(f"Применение фильтра исключений ({len(exceptions_list)} шт.)...")
+        filtered_count_exc = 0
+        for result in results:
+            identified_text = text[result.start:result.end]
+            if identified_text.strip().lower() in exceptions_list:
+                recognizer_name, _ = _get_recognizer_info(result)
+                logger.debug(f"  Результат '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], score={result.score:.3f}, rec={recognizer_name}) пропущен из-за наличия в exceptions.txt.")
+                filtered_count_exc += 1
+            else:
+                analyzer_results_filtered_exceptions.append(result)
+        logger.info(f"Фильтрация исключений: {filtered_count_exc} результатов пропущено.")
+    else:
+        logger.info("Список исключений пуст или не загружен. Фильтрация исключений не применяется.")
+        analyzer_results_filtered_exceptions = results
+    log_results_list(analyzer_results_filtered_exceptions, "Результаты после фильтрации исключений", text, logger)
+    return analyzer_results_filtered_exceptions
+
+
+# --- Фильтрация ложных срабатываний NER ---
+def _filter_ner_false_positives(
+    results: list[RecognizerResult],
+    text: str,
+    logger: logging.Logger,
+    thresholds: dict | None = None
+) -> list[RecognizerResult]:
+    """Удаляет NER-результаты, совпадающие со словами из NER_FALSE_POSITIVE_FILTER."""
+    low_score_threshold = (thresholds or DEFAULT_THRESHOLDS)["NER_FILTER_LOW_SCORE_THRESHOLD"]
+    analyzer_results_final_filtered = []
+    logger.info(f"Применение фильтра ложных срабатываний NER (по списку NER_FALSE_POSITIVE_FILTER)...")
+    filtered_count_ner = 0
+    ner_types_to_filter = {"PERSON", "LOCATION", "ORG"}
+    for result in results:
+        recognizer_name, _ = _get_recognizer_info(result)
+        apply_ner_filter = False
+        is_ner_res = is_ner_result(result)
+        is_target_type = result.entity_type in ner_types_to_filter
+
+        if is_ner_res and is_target_type:
+            identified_text = text[result.start:result.end]
+            cleaned_text = identified_text.strip().lower()
+
+            if not cleaned_text or cleaned_text.isnumeric() or all(c in '.,!?;:()[]{}<>"\'`~@#$%^&*-_=+|\n\t ' for c in cleaned_text):
+                 logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен, т.к. содержит только пунктуацию/пробелы/цифры.")
+                 apply_ner_filter = True
+            elif cleaned_text in NER_FALSE_POSITIVE_FILTER:
+                logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен из-за точного совпадения с фильтром NER_FALSE_POSITIVE_FILTER.")
+                apply_ner_filter = True
+            elif ' ' not in cleaned_text and cleaned_text in NER_FALSE_POSITIVE_FILTER:
+                 logger.debug(f"  Результат NER (одно слово) '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен, т.к. слово есть в NER_FALSE_POSITIVE_FILTER.")
+                 apply_ner_filter = True
+            # Используем NER_FILTER_LOW_SCORE_THRESHOLD из config (или из снимка thresholds)
+            elif (cleaned_text and cleaned_text[0].islower() and not KNOWN_LOWERCASE_PREFIX_PATTERN.match(identified_text)) or result.score < low_score_threshold:
+                words_in_result = set(cleaned_text.split())
+                common_words = words_in_result.intersection(NER_FALSE_POSITIVE_FILTER)
+                if common_words:
+                    logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}, score={result.score:.3f}) пропущен (низкий score или строчная буква), т.к. содержит слова из фильтра: {common_words}.")
                     apply_ner_filter = True
-                elif ' ' not in cleaned_text and cleaned_text in NER_FALSE_POSITIVE_FILTER:
-                     logger.debug(f"  Результат NER (одно слово) '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}) пропущен, т.к. слово есть в NER_FALSE_POSITIVE_FILTER.")
-                     apply_ner_filter = True
-                # Используем NER_FILTER_LOW_SCORE_THRESHOLD из config
-                elif (cleaned_text and cleaned_text[0].islower() and not KNOWN_LOWERCASE_PREFIX_PATTERN.match(identified_text)) or result.score < NER_FILTER_LOW_SCORE_THRESHOLD:
-                    words_in_result = set(cleaned_text.split())
-                    common_words = words_in_result.intersection(NER_FALSE_POSITIVE_FILTER)
-                    if common_words:
-                        logger.debug(f"  Результат NER '{identified_text}' ({result.entity_type} [{result.start}:{result.end}], rec={recognizer_name}, score={result.score:.3f}) пропущен (низкий score или строчная буква), т.к. содержит слова из фильтра: {common_words}.")
-                        apply_ner_filter = True
-
-            if apply_ner_filter:
-                filtered_count_ner += 1
-                continue
-            analyzer_results_final_filtered.append(result)
-
-        logger.info(f"Фильтрация ложных срабатываний NER: {filtered_count_ner} результатов пропущено.")
-        log_results_list(analyzer_results_final_filtered, "Финальные результаты для анонимизации", text_to_anonymize_local, logger)
 
+        if apply_ner_filter:
+            filtered_count_ner += 1
+            continue
+        analyzer_results_final_filtered.append(result)
+
+    logger.info(f"Фильтрация ложных срабатываний NER: {filtered_count_ner} результатов пропущено.")
+    return analyzer_results_final_filtered
 
-        # --- 9. Анонимизация текста ---
-        processed_text = text_to_anonymize_local
-        if analyzer_results_final_filtered:
-            logger.info(f"Запуск анонимизации текста (в отдельном потоке)... Найдено {len(analyzer_results_final_filtered)} сущностей для замены.")
-            final_entities_in_results = list(set(res.entity_type for res in analyzer_results_final_filtered))
-            all_possible_entities = list(set(final_entities_in_results) | set(current_entities_to_process))
-            operators = get_anonymizer_operators(all_possible_entities)
-
-            presidio_anon_logger = logging.getLogger("presidio-anonymizer")
-            original_level = presidio_anon_logger.level
-            presidio_anon_logger.setLevel(logging.DEBUG)
-            logger.debug("Уровень логирования 'presidio-anonymizer' временно установлен на DEBUG для отслеживания конфликтов.")
-
-            anonymized_result = await asyncio.to_thread(
-                anonymizer.anonymize,
-                text=text_to_anonymize_local,
-                analyzer_results=analyzer_results_final_filtered,
-                operators=operators
+
+# --- Анализ документа (этапы 6-8) ---
+def analyze_text(
+    text: str,
+    bundle: dict,
+    exceptions_list: set[str],
+    sentences: list[tuple[int, int]] | None = None
+) -> tuple[list[RecognizerResult], list[RecognizerResult]]:
+    """
+    Выполняет анализ текста (Presidio + Natasha + словарь известных сущностей),
+    понижение score подозрительных NER, объединение результатов (с приоритетом Stanza),
+    фильтрацию и распространение найденных PERSON/ORG по документу. Возвращает финальные результаты и результаты словаря известных сущностей.
+    sentences - готовая сегментация текста (segment_sentences), если уже выполнена.
+    Эта функция является СИНХРОННОЙ и блокирующей.
+    """
+    logger = logging.getLogger()
+    current_entities_to_process = bundle["entities"]
+    thresholds = bundle["thresholds"]
+
+    # --- 6.0 Разметка известных сущностей (один проход, до NER) ---
+    known_entity_results = []
+    if USE_KNOWN_ENTITIES:
+        known_entity_results = get_known_entity_dictionary().find(text, current_entities_to_process)
+        log_results_list(known_entity_results, "Результаты словаря известных сущностей", text, logger)
+
+    # --- 6.0.1 Сегментация (одна на документ: Natasha, каскад, маршрутизация) и маршрутизация по письменности ---
+    if sentences is None:
+        sentences = segment_sentences(text)
+    routes = None
+    if bundle["routing"]:
+        routes = route_sentences(text, sentences, ROUTING_MIN_LATIN_WORDS)
+
+    # --- 6.1 Анализ с помощью Natasha ---
+    natasha_analyzer_results = []
+    natasha_entities_to_find = list(set(current_entities_to_process) & {"PERSON", "LOCATION", "ORG"})
+    if NATASHA_AVAILABLE and natasha_entities_to_find and bundle["natasha"]:
+        logger.info(f"Запуск анализа Natasha для сущностей: {natasha_entities_to_find}...")
+        # Natasha - русская модель: при маршрутизации латинские фрагменты и фрагменты без слов ей не передаются
+        natasha_sentences = sentences if routes is None else routes[SCRIPT_CYRILLIC]
+        natasha_analyzer_results = _run_natasha_sharded(text, bundle, natasha_sentences)
+        log_results_list(natasha_analyzer_results, "Результаты Natasha NER (до корректировки score)", text, logger)
+    elif not NATASHA_AVAILABLE:
+         logger.info("Анализ Natasha пропущен (библиотека недоступна).")
+    elif not bundle["natasha"]:
+         logger.info(f"Анализ Natasha пропущен (отключен профилем '{bundle['profile']}').")
+    else:
+         logger.info("Анализ Natasha пропущен (сущности PERSON, LOCATION, ORG не запрошены).")
+
+    # --- 6.2 Анализ с помощью Presidio ---
+    logger.info(f"Запуск анализа текста с помощью Presidio для поиска сущностей: {current_entities_to_process}...")
+    presidio_analyzer_results = _run_presidio_analysis(text, bundle, natasha_analyzer_results + known_entity_results, logger, routes, sentences)
+    logger.info(f"Анализ Presidio завершен.")
+    log_results_list(presidio_analyzer_results, "Результаты Presidio Analyzer (до корректировки score)", text, logger)
+
+    # --- 6.3 Корректировка score подозрительных NER результатов ---
+    logger.info("Корректировка score для подозрительных NER результатов (spaCy, Natasha)...")
+    presidio_adjusted_results = _adjust_ner_scores(presidio_analyzer_results, text, logger, thresholds)
+    natasha_adjusted_results = _adjust_ner_scores(natasha_analyzer_results, text, logger, thresholds)
+    log_results_list(presidio_adjusted_results, "Результаты Presidio Analyzer (ПОСЛЕ корректировки score)", text, logger)
+    log_results_list(natasha_adjusted_results, "Результаты Natasha NER (ПОСЛЕ корректировки score)", text, logger)
+
+    # --- 6.4 Объединение и фильтрация ---
+    logger.info("Объединение и фильтрация результатов (двухпроходный метод)...")
+    merged_results = merge_and_filter_results(
+        presidio_adjusted_results,
+        natasha_adjusted_results + known_entity_results,
+        text,
+        thresholds
+    )
+    log_results_list(merged_results, "Результаты после merge_and_filter_results (2-проходный)", text, logger)
+
+    # --- 6.5 Фильтрация с приоритетом NER над Regex ---
+    logger.info("Применение фильтра приоритета NER...")
+    prioritized_results = filter_by_ner_priority(merged_results, text)
+    logger.info("Фильтрация по приоритету NER завершена.")
+    log_results_list(prioritized_results, "Результаты после filter_by_ner_priority", text, logger)
+
+    # --- 7. Фильтрация результатов с учетом исключений ---
+    filtered_results = _filter_exceptions(prioritized_results, text, exceptions_list, logger)
+
+    # --- 8. Фильтрация ложных срабатываний NER ---
+    final_results = _filter_ner_false_positives(filtered_results, text, logger, thresholds)
+
+    # --- 9. Распространение подтвержденных PERSON/ORG по документу (падежные формы, инициалы) ---
+    if USE_ENTITY_PROPAGATION and init_natasha():
+        propagated_results = propagate_entities(
+            text, final_results, current_entities_to_process, morph_vocab,
+            PROPAGATION_SCORE, exceptions_list, PROPAGATION_MIN_SURNAME_LENGTH
+        )
+        log_results_list(propagated_results, "Результаты распространения сущностей", text, logger)
+        # Вхождения проходят тот же фильтр ложных срабатываний, что и найденные NER
+        propagated_results = _filter_ner_false_positives(propagated_results, text, logger, thresholds)
+        final_results = sorted(final_results + propagated_results, key=lambda r: r.start)
+    log_results_list(final_results, "Финальные результаты для анонимизации", text, logger)
+    return final_results, known_entity_results
+
+
+# --- Этапы обработки документа (синхронные; общие для anonymize_text_file и конвейера pipeline.py) ---
+def read_document(input_file: str) -> tuple[str, list[tuple[int, int]]]:
+    """Этап чтения: читает входной файл и сегментирует текст на предложения."""
+    text = read_text(input_file)
+    return text, segment_sentences(text)
+
+
+def analyze_document(
+    text: str,
+    sentences: list[tuple[int, int]] | None,
+    bundle: dict,
+    exceptions_list: set[str]
+) -> list[RecognizerResult]:
+    """
+    Этап анализа: analyze_text и пополнение словаря известных сущностей подтвержденными
+    результатами (до анализа следующего документа, как при последовательной обработке).
+    Словарь сохраняется в файл один раз в конце запуска (save_known_entity_dictionary).
+    """
+    final_results, known_entity_results = analyze_text(text, bundle, exceptions_list, sentences)
+    if USE_KNOWN_ENTITIES:
+        get_known_entity_dictionary().learn(text, final_results, known_entity_results)
+    return final_results
+
+
+def save_document_spans(output_file: str, text: str, final_results: list[RecognizerResult], entities: list[str]) -> None:
+    """Сохраняет финальные диапазоны документа рядом с выходным файлом (для render_from_spans)."""
+    spans = [
+        (result.start, result.end, result.entity_type, round(result.score, 4), _get_recognizer_info(result)[0])
+        for result in sorted(final_results, key=lambda r: (r.start, r.end))
+    ]
+    save_spans(standoff_filename(output_file, STANDOFF_SUFFIX), text, entities, spans)
+
+
+# --- Основная функция анонимизации (асинхронная) ---
+async def anonymize_text_file(
+    input_file: str,
+    output_file: str,
+    entities_to_process: list[str],
+    exceptions_list: set[str],
+    language: str,
+    spacy_model: str,
+    nlp_engine: SpacyNlpEngine | None = None,
+    en_nlp=None,
+    bundle: dict | None = None,
+    profile: str | None = None
+) -> bool:
+    """
+    Основная функция анонимизации текста из файла (асинхронная).
+    Оркестрирует загрузку моделей, настройку Presidio, анализ (Presidio + Natasha),
+    понижение score подозрительных NER, объединение результатов (с приоритетом Stanza),
+    фильтрацию и замену.
+    Блокирующие NLP операции выполняются в отдельных потоках.
+    nlp_engine - заранее загруженный SpacyNlpEngine (при параллельной загрузке моделей в main.py).
+    en_nlp - заранее загруженная модель spaCy SPACY_MODEL_EN (для маршрутизации по письменности).
+    bundle - готовый результат create_analysis_bundle (снимок конфигурации в режиме наблюдения);
+    если передан, entities_to_process, language, spacy_model, модели и profile не используются.
+    profile - профиль скорость/полнота для этого запуска (None - PIPELINE_PROFILE из config.py).
+    Возвращает True, если результат записан в output_file, иначе False (ошибка уже залогирована).
+    """
+    logger = logging.getLogger()
+
+    try:
+        # --- 0-3. Распознаватели, реестр и Analyzer Engine ---
+        if bundle is None:
+            bundle = await asyncio.to_thread(
+                get_analysis_bundle, entities_to_process, language, spacy_model,
+                nlp_engine=nlp_engine, en_nlp=en_nlp, profile=profile
             )
-            processed_text = anonymized_result.text
+        if bundle is None:
+            return False
+
+        # --- 4.0 Документ .docx: потоковая обработка абзацев с сохранением форматирования ---
+        from docx_processor import is_docx, anonymize_docx_file
+        if is_docx(input_file):
+            if not is_docx(output_file):
+                logger.warning(f"Входной файл '{input_file}' - документ .docx, результат '{output_file}' также будет .docx.")
+            try:
+                await asyncio.to_thread(anonymize_docx_file, input_file, output_file, bundle, exceptions_list)
+                logger.info(f"Результат успешно записан в '{output_file}'.")
+                return True
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                logger.error(f"Ошибка при обработке документа '{input_file}': {e}")
+                return False
 
-            presidio_anon_logger.setLevel(original_level)
-            logger.debug(f"Уровень логирования 'presidio-anonymizer' возвращен на {logging.getLevelName(original_level)}.")
+        # --- 4. Настройка движка замены ---
+        replacement_engine = SpanReplacementEngine()
+        logger.info("Движок замены диапазонов успешно инициализирован.")
 
-            logger.info("Анонимизация завершена.")
-        else:
-            logger.info("Сущности для замены (после всех фильтраций) не найдены. Анонимизация не выполняется.")
+        # --- 5. Чтение входного файла ---
+        logger.info(f"Чтение входного файла: {input_file}")
+        try:
+            text, sentences = await asyncio.to_thread(read_document, input_file)
+            logger.info(f"Файл '{input_file}' успешно прочитан (длина: {len(text)} символов).")
+        except FileNotFoundError:
+            logger.error(f"Входной файл '{input_file}' не найден.")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при чтении файла '{input_file}': {e}")
+            return False
 
-        # --- 10. Пост-обработка текста ---
-        logger.info("Выполнение пост-обработки текста...")
-        final_text = post_process_text(processed_text)
-        logger.info("Пост-обработка завершена.")
+        # --- 6-8.1 Анализ, фильтрация и пополнение словаря известных сущностей (ВЫНОСИМ В ПОТОК) ---
+        final_results = await asyncio.to_thread(analyze_document, text, sentences, bundle, exceptions_list)
+
+        # --- 9. Анонимизация текста ---
+        # Результат собирается потоково: неизмененные участки и плейсхолдеры между
+        # отсортированными диапазонами сразу идут в пост-обработку и в файл.
+        replacement_pieces = await asyncio.to_thread(resolve_replacements, text, final_results, bundle["entities"], replacement_engine, bundle["operators"])
 
-        # --- 11. Запись результата в выходной файл ---
-        logger.info(f"Запись результата в файл: {output_file}")
+        # --- 10-11. Потоковая пост-обработка и запись результата в выходной файл ---
+        logger.info(f"Пост-обработка и запись результата в файл: {output_file}")
         try:
-            async with aiofiles.open(output_file, mode='w', encoding='utf-8') as f_out:
-                await f_out.write(final_text)
+            await asyncio.to_thread(write_document, output_file, replacement_pieces)
+            logger.info("Анонимизация и пост-обработка завершены.")
             logger.info(f"Результат успешно записан в '{output_file}'.")
+            if SAVE_STANDOFF_SPANS:
+                await asyncio.to_thread(save_document_spans, output_file, text, final_results, bundle["entities"])
+                logger.info(f"Диапазоны сохранены в '{standoff_filename(output_file, STANDOFF_SUFFIX)}'.")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при записи в файл '{output_file}': {e}")
+            return False
 
     except ImportError as e:
          if 'natasha' in str(e).lower() and not NATASHA_AVAILABLE:
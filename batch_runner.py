@@ -0,0 +1,286 @@
+# batch_runner.py
+"""
+Пакетная обработка каталога с возобновлением после сбоя.
+Состояние каждого файла хранится в манифесте SQLite: путь, хэш содержимого, статус,
+выходной файл, число попыток, последняя ошибка и время обработки.
+При перезапуске готовые файлы пропускаются без чтения (совпадают размер и время изменения;
+при их изменении сравнивается хэш), прерванные и ошибочные обрабатываются заново,
+пока не исчерпан бюджет попыток. Файл отмечается готовым только после атомарной
+записи результата, поэтому сбой в любой момент не оставляет "готовых" файлов без результата.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+from anonymizer_logic import get_analysis_bundle
+from pipeline import anonymize_files_pipelined
+
+# Статусы заданий в манифесте
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+COMPRESSION_SUFFIXES = (".gz", ".xz", ".zst")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(filename: str) -> str:
+    """Возвращает хэш содержимого файла (blake2b, читается кусками)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, mode='rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_input_files(input_dir: str, suffixes: tuple[str, ...]) -> list[str]:
+    """Рекурсивно находит входные файлы каталога (пути относительно input_dir, в стабильном порядке)."""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(suffixes):
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return found
+
+
+def output_path_for(relative_path: str, output_dir: str) -> str:
+    """Путь выходного файла: та же структура каталогов, без суффикса сжатия."""
+    for suffix in COMPRESSION_SUFFIXES:
+        if relative_path.lower().endswith(suffix):
+            relative_path = relative_path[:-len(suffix)]
+            break
+    return os.path.join(output_dir, relative_path)
+
+
+class JobManifest:
+    """
+    Манифест заданий в SQLite. Одна строка на входной файл:
+    (input_path, size, mtime_ns, content_hash, status, output_path, attempts, error, started_at, duration).
+    Каждое изменение статуса фиксируется сразу отдельной транзакцией.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "input_path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT, "
+            "status TEXT NOT NULL, output_path TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, started_at REAL, duration REAL)"
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def load(self) -> dict[str, dict]:
+        """Возвращает все задания: input_path -> {size, mtime_ns, content_hash, status, attempts}."""
+        rows = self.connection.execute("SELECT input_path, size, mtime_ns, content_hash, status, attempts FROM jobs")
+        return {
+            row[0]: {"size": row[1], "mtime_ns": row[2], "content_hash": row[3], "status": row[4], "attempts": row[5]}
+            for row in rows
+        }
+
+    def add_pending(self, jobs: list[tuple[str, str, int, int]]) -> None:
+        """Добавляет (или сбрасывает в pending) задания: (input_path, output_path, size, mtime_ns)."""
+        self.connection.executemany(
+            "INSERT INTO jobs (input_path, output_path, size, mtime_ns, status, attempts) VALUES (?, ?, ?, ?, ?, 0) "
+            "ON CONFLICT(input_path) DO UPDATE SET output_path=excluded.output_path, size=excluded.size, "
+            "mtime_ns=excluded.mtime_ns, content_hash=NULL, status=excluded.status, attempts=0, error=NULL",
+            [(input_path, output_path, size, mtime_ns, STATUS_PENDING) for input_path, output_path, size, mtime_ns in jobs]
+        )
+        self.connection.commit()
+
+    def update_state(self, input_path: str, size: int, mtime_ns: int) -> None:
+        """Обновляет размер и время изменения файла без изменения статуса (содержимое не изменилось)."""
+        self.connection.execute("UPDATE jobs SET size=?, mtime_ns=? WHERE input_path=?", (size, mtime_ns, input_path))
+        self.connection.commit()
+
+    def mark_running(self, input_path: str) -> None:
+        """Отмечает начало попытки (попытка засчитывается до обработки, чтобы учесть и падения процесса)."""
+        self.connection.execute(
+            "UPDATE jobs SET status=?, attempts=attempts+1, started_at=? WHERE input_path=?",
+            (STATUS_RUNNING, time.time(), input_path)
+        )
+        self.connection.commit()
+
+    def mark_finished(self, input_path: str, status: str, content_hash: str | None, duration: float, error: str | None = None) -> None:
+        self.connection.execute(
+            "UPDATE jobs SET status=?, content_hash=?, duration=?, error=? WHERE input_path=?",
+            (status, content_hash, duration, error, input_path)
+        )
+        self.connection.commit()
+
+    def counts(self) -> dict[str, int]:
+        """Число заданий по статусам."""
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class ProgressReporter:
+    """Выводит прогресс и оценку оставшегося времени через logger.progress не чаще раза в interval сек."""
+
+    def __init__(self, total: int, interval: float):
+        self.total = total
+        self.interval = interval
+        self.processed = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+    def update(self, succeeded: bool) -> None:
+        self.processed += 1
+        if not succeeded:
+            self.failed += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.processed == self.total:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now: float | None = None) -> None:
+        elapsed = (now or time.perf_counter()) - self.start_time
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.processed, 0)
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining / rate)) if rate > 0 else "--:--:--"
+        percent = self.processed / self.total if self.total else 1.0
+        logging.getLogger().progress(
+            f"Пакет: обработано {self.processed}/{self.total} ({percent:.1%}), ошибок {self.failed}, "
+            f"{rate:.2f} файл/с, осталось ~{eta}"
+        )
+
+
+def plan_jobs(manifest: JobManifest, input_dir: str, output_dir: str, suffixes: tuple[str, ...], max_attempts: int) -> list[str]:
+    """
+    Сверяет каталог с манифестом и возвращает входные файлы, которые нужно обработать.
+    Готовые файлы с неизменными размером и временем изменения не читаются; при изменении
+    метаданных сравнивается хэш содержимого. Ошибочные файлы с исчерпанным бюджетом попыток
+    пропускаются, пока не изменятся.
+    """
+    logger = logging.getLogger()
+    known_jobs = manifest.load()
+    to_process, new_jobs, exhausted = [], [], 0
+    for relative_path in find_input_files(input_dir, suffixes):
+        input_path = os.path.join(input_dir, relative_path)
+        stat = os.stat(input_path)
+        job = known_jobs.get(input_path)
+        if job is None:
+            new_jobs.append((input_path, output_path_for(relative_path, output_dir), stat.st_size, stat.st_mtime_ns))
+            to_process.append(input_path)
+            continue
+
+        if job["status"] == STATUS_DONE:
+            if (job["size"], job["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            if job["content_hash"] == file_hash(input_path):
+                manifest.update_state(input_path, stat.st_size, stat.st_mtime_ns)
+                continue
+            # Содержимое изменилось - файл обрабатывается заново с полным бюджетом попыток
+            new_jobs.append((input_path, output_path_for(relative_path, output_dir), stat.st_size, stat.st_mtime_ns))
+            to_process.append(input_path)
+        elif job["attempts"] < max_attempts:
+            to_process.append(input_path)
+        elif (job["size"], job["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            # Файл с исчерпанным бюджетом изменен (например, исправлен) - бюджет попыток восстанавливается
+            new_jobs.append((input_path, output_path_for(relative_path, output_dir), stat.st_size, stat.st_mtime_ns))
+            to_process.append(input_path)
+        else:
+            exhausted += 1
+
+    if new_jobs:
+        manifest.add_pending(new_jobs)
+    if exhausted:
+        logger.warning(f"Пропущено файлов с исчерпанным бюджетом попыток ({max_attempts}): {exhausted}.")
+    return to_process
+
+
+async def run_batch(
+    input_dir: str,
+    output_dir: str,
+    manifest_filename: str,
+    entities_to_process: list[str],
+    exceptions_list: set[str],
+    language: str,
+    spacy_model: str,
+    suffixes: tuple[str, ...],
+    max_attempts: int,
+    progress_interval: float,
+    queue_size: int,
+    nlp_engine=None,
+    en_nlp=None,
+    profile: str | None = None
+) -> dict[str, int]:
+    """
+    Обрабатывает все входные файлы каталога, ведя манифест заданий.
+    Документы проходят через конвейер pipeline.py (очереди размером queue_size).
+    Файлы с ошибкой повторяются в следующих проходах, пока не исчерпан бюджет max_attempts.
+    Возвращает число заданий по статусам.
+    """
+    logger = logging.getLogger()
+    bundle = await asyncio.to_thread(
+        get_analysis_bundle, entities_to_process, language, spacy_model,
+        nlp_engine=nlp_engine, en_nlp=en_nlp, profile=profile
+    )
+    if bundle is None:
+        raise RuntimeError("Analysis bundle could not be created")
+
+    manifest = JobManifest(manifest_filename)
+    try:
+        to_process = plan_jobs(manifest, input_dir, output_dir, suffixes, max_attempts)
+        jobs = manifest.load()
+        logger.progress(
+            f"Пакет '{input_dir}': к обработке {len(to_process)} файлов, "
+            f"уже готово {sum(1 for job in jobs.values() if job['status'] == STATUS_DONE)} (манифест '{manifest_filename}')."
+        )
+        output_paths = dict(manifest.connection.execute("SELECT input_path, output_path FROM jobs"))
+        attempts = {input_path: jobs[input_path]["attempts"] for input_path in to_process}
+        progress = ProgressReporter(len(to_process), progress_interval)
+
+        start_times, content_hashes = {}, {}
+
+        async def on_start(input_path: str) -> None:
+            os.makedirs(os.path.dirname(os.path.abspath(output_paths[input_path])), exist_ok=True)
+            manifest.mark_running(input_path)
+            attempts[input_path] += 1
+            start_times[input_path] = time.perf_counter()
+            try:
+                content_hashes[input_path] = await asyncio.to_thread(file_hash, input_path)
+            except OSError:
+                # Ошибку чтения зафиксирует этап чтения конвейера
+                content_hashes[input_path] = None
+
+        async def on_finish(input_path: str, succeeded: bool, error: str | None) -> None:
+            # Длительность - время документа в конвейере (включая ожидание в очередях)
+            duration = time.perf_counter() - start_times.pop(input_path)
+            content_hash = content_hashes.pop(input_path)
+            manifest.mark_finished(input_path, STATUS_DONE if succeeded else STATUS_FAILED, content_hash, duration, error)
+            if succeeded:
+                progress.update(True)
+            elif attempts[input_path] < max_attempts:
+                retry.append(input_path)
+            else:
+                logger.error(f"Файл '{input_path}' не обработан за {max_attempts} попыток: {error}")
+                progress.update(False)
+
+        pending = to_process
+        while pending:
+            retry = []
+            await anonymize_files_pipelined(
+                [(input_path, output_paths[input_path]) for input_path in pending],
+                bundle, exceptions_list, queue_size,
+                on_start=on_start, on_finish=on_finish
+            )
+            if retry:
+                logger.warning(f"Повторная обработка файлов с ошибками: {len(retry)}.")
+            pending = retry
+
+        counts = manifest.counts()
+        logger.progress(f"Пакет завершен: {counts}.")
+        return counts
+    finally:
+        manifest.close()
@@ -0,0 +1,698 @@
+# bench.py
+"""
+Замеры производительности отдельных этапов анонимизации на файлах input*.txt.
+Запуск: python bench.py <команда> [опции]
+Результаты выводятся в консоль; модели не загружаются, если команда их не требует.
+"""
+import argparse
+import glob
+import logging
+import os
+import time
+from collections import defaultdict
+
+from presidio_analyzer import RecognizerResult
+
+from config import ENTITY_PLACEHOLDERS, ENTITIES_FILENAME, EXCEPTIONS_FILENAME, LANGUAGE_CODE, SPACY_MODEL_RU
+from file_utils import read_text
+
+INPUT_GLOB = "input*.txt"
+# Эталонная разметка входного файла (для команды recognizers): input.txt -> input.txt.gold.json
+GOLD_SUFFIX = ".gold.json"
+
+
+def _load_inputs(pattern: str = INPUT_GLOB) -> dict[str, str]:
+    """Читает все файлы по маске (имя файла -> текст)."""
+    return {path: read_text(path) for path in sorted(glob.glob(pattern))}
+
+
+def _best_time(func, repeat: int) -> float:
+    """Возвращает лучшее время выполнения func из repeat запусков (сек)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _regex_spans(text: str) -> list[RecognizerResult]:
+    """Находит непересекающиеся диапазоны только пользовательскими Regex-распознавателями (без NLP моделей)."""
+    from custom_recognizers import create_custom_recognizers
+
+    results = []
+    for recognizer in create_custom_recognizers():
+        results.extend(recognizer.analyze(text=text, entities=recognizer.supported_entities, nlp_artifacts=None))
+    results.sort(key=lambda r: (r.start, -r.end))
+    non_overlapping = []
+    for result in results:
+        if not non_overlapping or result.start >= non_overlapping[-1].end:
+            non_overlapping.append(result)
+    return non_overlapping
+
+
+# Фрагмент с соседними диапазонами одного типа через пробел (AnonymizerEngine объединяет их в один)
+# и плейсхолдером с пробелом внутри, который post_process_text не склеивает
+ADJACENT_SPANS_SAMPLE = ("\nIP 10.0.0.1 10.0.0.2 конец\n", "IP_ADDRESS", [(4, 12), (13, 21)])
+
+
+def _with_adjacent_spans(text: str, spans: list[RecognizerResult]) -> tuple[str, list[RecognizerResult]]:
+    """Дописывает к тексту ADJACENT_SPANS_SAMPLE и добавляет его диапазоны."""
+    sample, entity_type, sample_spans = ADJACENT_SPANS_SAMPLE
+    offset = len(text)
+    extra = [RecognizerResult(entity_type=entity_type, start=offset + start, end=offset + end, score=1.0) for start, end in sample_spans]
+    return text + sample, spans + extra
+
+
+def bench_replacement(args: argparse.Namespace) -> None:
+    """Сравнивает AnonymizerEngine Presidio и SpanReplacementEngine по времени и результату."""
+    from presidio_anonymizer import AnonymizerEngine
+    from anonymizer_logic import get_anonymizer_operators
+    from replacement_engine import SpanReplacementEngine
+
+    presidio_engine = AnonymizerEngine()
+    native_engine = SpanReplacementEngine()
+    operators = get_anonymizer_operators([e for e in ENTITY_PLACEHOLDERS if e != "DEFAULT"])
+
+    print(f"{'Файл':<16} {'Символов':>10} {'Диапазонов':>10} {'Presidio, мс':>13} {'Native, мс':>11} {'Ускорение':>10}")
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        text, spans = _with_adjacent_spans(text, _regex_spans(text))
+        presidio_text = presidio_engine.anonymize(text=text, analyzer_results=spans, operators=operators).text
+        native_text = native_engine.anonymize(text, spans, operators)
+        if presidio_text != native_text:
+            raise AssertionError(f"Результаты движков замены различаются для '{path}'")
+
+        presidio_time = _best_time(lambda: presidio_engine.anonymize(text=text, analyzer_results=spans, operators=operators), args.repeat)
+        native_time = _best_time(lambda: native_engine.anonymize(text, spans, operators), args.repeat)
+        print(f"{path:<16} {len(text):>10} {len(spans):>10} {presidio_time * 1000:>13.2f} {native_time * 1000:>11.2f} {presidio_time / native_time:>9.1f}x")
+
+
+def _load_entities_and_exceptions() -> tuple[list[str], set[str]]:
+    """Загружает списки сущностей и исключений так же, как main.py."""
+    import asyncio
+    from file_utils import load_entities_to_process, load_exceptions
+
+    entities = asyncio.run(load_entities_to_process(ENTITIES_FILENAME))
+    exceptions = asyncio.run(load_exceptions(EXCEPTIONS_FILENAME))
+    return entities, exceptions
+
+
+def _span_keys(results: list[RecognizerResult]) -> set[tuple[int, int, str]]:
+    return {(res.start, res.end, res.entity_type) for res in results}
+
+
+def _overlap_recall(reference: list[RecognizerResult], candidate: list[RecognizerResult]) -> float:
+    """Доля эталонных диапазонов, пересекающихся с диапазоном того же типа из candidate."""
+    if not reference:
+        return 1.0
+    found = 0
+    for ref in reference:
+        if any(res.entity_type == ref.entity_type and res.start < ref.end and ref.start < res.end for res in candidate):
+            found += 1
+    return found / len(reference)
+
+
+def bench_cascade(args: argparse.Namespace) -> None:
+    """Сравнивает полный конвейер и каскадный режим NER по времени и полноте (полный конвейер - эталон)."""
+    from anonymizer_logic import create_analysis_bundle, analyze_text
+
+    entities, exceptions = _load_entities_and_exceptions()
+    full_bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, cascade_mode=False)
+    cascade_bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, cascade_mode=True)
+
+    print(f"{'Файл':<16} {'Полный, с':>10} {'Каскад, с':>10} {'Эталон':>7} {'Recall (точн.)':>15} {'Recall (пересеч.)':>18}")
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        full_results, _ = analyze_text(text, full_bundle, exceptions)
+        cascade_results, _ = analyze_text(text, cascade_bundle, exceptions)
+        full_time = _best_time(lambda: analyze_text(text, full_bundle, exceptions), args.repeat)
+        cascade_time = _best_time(lambda: analyze_text(text, cascade_bundle, exceptions), args.repeat)
+
+        reference = _span_keys(full_results)
+        exact_recall = len(reference & _span_keys(cascade_results)) / len(reference) if reference else 1.0
+        print(
+            f"{path:<16} {full_time:>10.2f} {cascade_time:>10.2f} {len(reference):>7} "
+            f"{exact_recall:>15.1%} {_overlap_recall(full_results, cascade_results):>18.1%}"
+        )
+
+
+def bench_routing(args: argparse.Namespace) -> None:
+    """
+    Сравнивает анализ без маршрутизации и с маршрутизацией по письменности:
+    скорость (символов в секунду), доля предложений по маршрутам и полнота (без маршрутизации - эталон).
+    """
+    from anonymizer_logic import create_analysis_bundle, analyze_text
+    from config import ROUTING_MIN_LATIN_WORDS
+    from text_utils import route_sentences, segment_sentences, SCRIPT_CYRILLIC, SCRIPT_LATIN, SCRIPT_NONE
+
+    entities, exceptions = _load_entities_and_exceptions()
+    plain_bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, routing=False)
+    routed_bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, routing=True)
+
+    print(
+        f"{'Файл':<16} {'Кир/Лат/Нет':>14} {'Без маршр., симв/с':>19} {'С маршр., симв/с':>17} "
+        f"{'Эталон':>7} {'Recall (точн.)':>15} {'Recall (пересеч.)':>18}"
+    )
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        routes = route_sentences(text, segment_sentences(text), ROUTING_MIN_LATIN_WORDS)
+        route_counts = "/".join(str(len(routes[script])) for script in (SCRIPT_CYRILLIC, SCRIPT_LATIN, SCRIPT_NONE))
+
+        plain_results, _ = analyze_text(text, plain_bundle, exceptions)
+        routed_results, _ = analyze_text(text, routed_bundle, exceptions)
+        plain_time = _best_time(lambda: analyze_text(text, plain_bundle, exceptions), args.repeat)
+        routed_time = _best_time(lambda: analyze_text(text, routed_bundle, exceptions), args.repeat)
+
+        reference = _span_keys(plain_results)
+        exact_recall = len(reference & _span_keys(routed_results)) / len(reference) if reference else 1.0
+        print(
+            f"{path:<16} {route_counts:>14} {len(text) / plain_time:>19.0f} {len(text) / routed_time:>17.0f} "
+            f"{len(reference):>7} {exact_recall:>15.1%} {_overlap_recall(plain_results, routed_results):>18.1%}"
+        )
+
+
+def bench_io(args: argparse.Namespace) -> None:
+    """Замеряет загрузку конфигурации и чтение входных файлов (несжатых и сжатых .gz/.xz)."""
+    import gzip
+    import lzma
+    import os
+    import tempfile
+
+    print(f"{'Конфигурация':<28} {'мс':>8}")
+    config_time = _best_time(_load_entities_and_exceptions, args.repeat)
+    print(f"{'entities + exceptions':<28} {config_time * 1000:>8.2f}")
+
+    print(f"\n{'Файл':<28} {'Символов':>10} {'Чтение, мс':>11}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for path, text in _load_inputs(args.inputs).items():
+            data = (text * args.scale).encode("utf-8")
+            variants = {"": lambda f: open(f, "wb"), ".gz": lambda f: gzip.open(f, "wb"), ".xz": lambda f: lzma.open(f, "wb")}
+            for suffix, opener in variants.items():
+                temp_path = os.path.join(temp_dir, os.path.basename(path) + suffix)
+                with opener(temp_path) as f:
+                    f.write(data)
+                read_time = _best_time(lambda: read_text(temp_path), args.repeat)
+                print(f"{os.path.basename(temp_path):<28} {len(text) * args.scale:>10} {read_time * 1000:>11.2f}")
+
+
+def bench_profiles(args: argparse.Namespace) -> None:
+    """
+    Строит таблицу профилей конвейера (Markdown): документов в секунду и полнота
+    относительно профиля 'thorough' на файлах input*.txt. С --output таблица сохраняется в файл.
+    """
+    from anonymizer_logic import create_analysis_bundle, analyze_text
+    from config import PIPELINE_PROFILES
+
+    entities, exceptions = _load_entities_and_exceptions()
+    texts = [text * args.scale for text in _load_inputs(args.inputs).values()]
+    bundles = {profile: create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, profile=profile) for profile in PIPELINE_PROFILES}
+    reference = [analyze_text(text, bundles["thorough"], exceptions)[0] for text in texts]
+    total_chars = sum(len(text) for text in texts)
+
+    lines = [
+        f"Профили конвейера: {len(texts)} документов ({args.inputs}, x{args.scale}), {total_chars} символов.",
+        "",
+        "| Профиль | Документов/с | Символов/с | Recall (точн.) | Recall (пересеч.) |",
+        "|---|---:|---:|---:|---:|",
+    ]
+    for profile, bundle in bundles.items():
+        results = [analyze_text(text, bundle, exceptions)[0] for text in texts]
+        elapsed = _best_time(lambda: [analyze_text(text, bundle, exceptions) for text in texts], args.repeat)
+
+        found_keys = set()
+        overlap_found = 0
+        for doc_index, (ref_results, doc_results) in enumerate(zip(reference, results)):
+            found_keys |= {(doc_index,) + key for key in _span_keys(ref_results) & _span_keys(doc_results)}
+            overlap_found += _overlap_recall(ref_results, doc_results) * len(ref_results)
+        reference_count = sum(len(res) for res in reference)
+        exact_recall = len(found_keys) / reference_count if reference_count else 1.0
+        overlap_recall = overlap_found / reference_count if reference_count else 1.0
+        lines.append(
+            f"| {profile} | {len(texts) / elapsed:.2f} | {total_chars / elapsed:.0f} | {exact_recall:.1%} | {overlap_recall:.1%} |"
+        )
+
+    table = "\n".join(lines)
+    print(table)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(table + "\n")
+
+
+def bench_natasha(args: argparse.Namespace) -> None:
+    """Сравнивает Natasha с морфологическим разбором и только NER (пакетами предложений): сек./МБ и совпадение результатов."""
+    from anonymizer_logic import init_natasha, run_natasha_ner
+    from text_utils import segment_sentences
+
+    if not init_natasha():
+        raise SystemExit("Natasha недоступна.")
+
+    print(f"{'Файл':<16} {'МБ':>7} {'Морф.+NER, с/МБ':>16} {'NER, с/МБ':>10} {'Ускорение':>10} {'Совпадение':>11}")
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        megabytes = len(text.encode("utf-8")) / (1024 * 1024)
+        sentences = segment_sentences(text)
+        morph_results = run_natasha_ner(text, sentences=sentences, tag_morph=True)
+        ner_results = run_natasha_ner(text, sentences=sentences, tag_morph=False)
+        morph_time = _best_time(lambda: run_natasha_ner(text, sentences=sentences, tag_morph=True), args.repeat)
+        ner_time = _best_time(lambda: run_natasha_ner(text, sentences=sentences, tag_morph=False), args.repeat)
+
+        morph_keys, ner_keys = _span_keys(morph_results), _span_keys(ner_results)
+        agreement = len(morph_keys & ner_keys) / len(morph_keys | ner_keys) if morph_keys | ner_keys else 1.0
+        print(
+            f"{path:<16} {megabytes:>7.2f} {morph_time / megabytes:>16.2f} {ner_time / megabytes:>10.2f} "
+            f"{morph_time / ner_time:>9.1f}x {agreement:>11.1%}"
+        )
+
+
+def bench_context(args: argparse.Namespace) -> None:
+    """
+    Сравнивает усиление score по контексту LemmaContextAwareEnhancer Presidio и
+    IndexedContextAwareEnhancer на одних и тех же результатах Regex и NLP-артефактах:
+    время этапа и совпадение score.
+    """
+    from presidio_analyzer.context_aware_enhancers import LemmaContextAwareEnhancer
+    from anonymizer_logic import create_analysis_bundle
+    from context_enhancer import IndexedContextAwareEnhancer
+
+    entities, _ = _load_entities_and_exceptions()
+    bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, cascade_mode=False)
+    analyzer = bundle["analyzer"]
+    recognizers = analyzer.registry.get_recognizers(language=LANGUAGE_CODE, entities=bundle["entities"])
+    default_enhancer, indexed_enhancer = LemmaContextAwareEnhancer(), IndexedContextAwareEnhancer()
+
+    print(f"{'Файл':<16} {'Результатов':>12} {'Presidio, с':>12} {'Индекс, с':>10} {'Ускорение':>10} {'Score совпадают':>16}")
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        nlp_artifacts = analyzer.nlp_engine.process_text(text, LANGUAGE_CODE)
+        raw_results = []
+        for recognizer in recognizers:
+            raw_results.extend(recognizer.analyze(text, bundle["entities"], nlp_artifacts) or [])
+
+        def run_indexed():
+            # Индекс строится заново, как для нового документа
+            vars(nlp_artifacts).pop(IndexedContextAwareEnhancer.INDEX_ATTRIBUTE, None)
+            return indexed_enhancer.enhance_using_context(text, raw_results, nlp_artifacts, recognizers)
+
+        default_scores = [r.score for r in default_enhancer.enhance_using_context(text, raw_results, nlp_artifacts, recognizers)]
+        indexed_scores = [r.score for r in run_indexed()]
+        default_time = _best_time(lambda: default_enhancer.enhance_using_context(text, raw_results, nlp_artifacts, recognizers), args.repeat)
+        indexed_time = _best_time(run_indexed, args.repeat)
+        print(
+            f"{path:<16} {len(raw_results):>12} {default_time:>12.3f} {indexed_time:>10.3f} "
+            f"{default_time / indexed_time if indexed_time else float('inf'):>9.1f}x {'да' if default_scores == indexed_scores else 'НЕТ':>16}"
+        )
+
+
+def bench_pipeline(args: argparse.Namespace) -> None:
+    """
+    Сравнивает последовательную обработку файлов (anonymize_text_file по очереди) и
+    конвейерную (pipeline.py) на одном наборе документов: общее время пакета и совпадение результатов.
+    При USE_KNOWN_ENTITIES словарь известных сущностей пополняется между прогонами,
+    поэтому для сравнения результатов его лучше отключить.
+    """
+    import asyncio
+    import os
+    import tempfile
+    from anonymizer_logic import create_analysis_bundle, anonymize_text_file
+    from config import PIPELINE_QUEUE_SIZE
+    from pipeline import anonymize_files_pipelined
+
+    entities, exceptions = _load_entities_and_exceptions()
+    bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU)
+    inputs = sorted(glob.glob(args.inputs)) * args.scale
+
+    with tempfile.TemporaryDirectory() as directory:
+        sequential_jobs = [(path, os.path.join(directory, f"seq_{i}.txt")) for i, path in enumerate(inputs)]
+        pipelined_jobs = [(path, os.path.join(directory, f"pipe_{i}.txt")) for i, path in enumerate(inputs)]
+
+        async def run_sequential():
+            for input_file, output_file in sequential_jobs:
+                await anonymize_text_file(input_file, output_file, entities, exceptions, LANGUAGE_CODE, SPACY_MODEL_RU, bundle=bundle)
+
+        async def run_pipelined():
+            await anonymize_files_pipelined(pipelined_jobs, bundle, exceptions, args.queue_size or PIPELINE_QUEUE_SIZE)
+
+        sequential_time = _best_time(lambda: asyncio.run(run_sequential()), args.repeat)
+        pipelined_time = _best_time(lambda: asyncio.run(run_pipelined()), args.repeat)
+        identical = all(
+            read_text(sequential_output) == read_text(pipelined_output)
+            for (_, sequential_output), (_, pipelined_output) in zip(sequential_jobs, pipelined_jobs)
+        )
+
+    print(f"{'Документов':>10} {'Последоват., с':>15} {'Конвейер, с':>12} {'Ускорение':>10} {'Результаты совпадают':>21}")
+    print(
+        f"{len(inputs):>10} {sequential_time:>15.2f} {pipelined_time:>12.2f} "
+        f"{sequential_time / pipelined_time:>9.2f}x {'да' if identical else 'НЕТ':>21}"
+    )
+
+
+def bench_shards(args: argparse.Namespace) -> None:
+    """
+    Анализ документа частями (ANALYSIS_SHARD_CHARS) при разном числе потоков/процессов:
+    ускорение относительно анализа целиком, совпадение с последовательным анализом частей
+    (должно быть 100%) и полнота относительно анализа целиком.
+    """
+    import anonymizer_logic
+    from anonymizer_logic import create_analysis_bundle, analyze_text
+    from config import ANALYSIS_EXECUTOR
+
+    entities, exceptions = _load_entities_and_exceptions()
+    bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU)
+    shard_chars = args.shard_chars or 20000
+    worker_counts = [int(value) for value in args.workers.split(",")] if args.workers else [1, 2, 4]
+
+    def run(shards: int | None, workers: int) -> tuple[list[RecognizerResult], float]:
+        # Настройки читаются модулем при каждом анализе, поэтому меняются на время замера
+        anonymizer_logic.ANALYSIS_SHARD_CHARS, anonymizer_logic.ANALYSIS_WORKERS = shards, workers
+        results, _ = analyze_text(text, bundle, exceptions)
+        return results, _best_time(lambda: analyze_text(text, bundle, exceptions), args.repeat)
+
+    print(f"Пул: {ANALYSIS_EXECUTOR}, размер части: {shard_chars} символов")
+    print(f"{'Файл':<16} {'Потоки':>7} {'Целиком, с':>11} {'Частями, с':>11} {'Ускорение':>10} {'= послед.':>10} {'Recall':>8}")
+    for path, text in _load_inputs(args.inputs).items():
+        text = text * args.scale
+        whole_results, whole_time = run(None, 1)
+        sequential_keys = None
+        for workers in worker_counts:
+            shard_results, shard_time = run(shard_chars, workers)
+            keys = _span_keys(shard_results)
+            if sequential_keys is None:
+                sequential_keys = keys
+            identical = "да" if keys == sequential_keys else "НЕТ"
+            print(
+                f"{path:<16} {workers:>7} {whole_time:>11.2f} {shard_time:>11.2f} {whole_time / shard_time:>9.2f}x "
+                f"{identical:>10} {_overlap_recall(whole_results, shard_results):>8.1%}"
+            )
+
+
+def _adversarial_inputs(size: int) -> dict[str, str]:
+    """Тексты размером около size символов, на которых паттерны с неоднозначными повторами работают сверхлинейно."""
+    return {
+        "кавычки без пары": "ООО «а " * (size // 7),
+        "пробелы после сокр.": ("д" + " " * 2000 + "!") * (size // 2002),
+        "пробелы после даты": ("12" + " " * 2000 + "!") * (size // 2003),
+        "длинные слова": ("Ивановааааа" * 100 + " И.") * (size // 1103),
+        "дефисы в названии": ("ИП а" + "-а" * 2000 + "!") * (size // 4005),
+        "цифры и двоеточия": "11:22:" * (size // 6) + "3a",
+    }
+
+
+def bench_regex(args: argparse.Namespace) -> None:
+    """
+    Время пользовательских распознавателей на враждебных входах при увеличении объема вдвое:
+    при линейной сложности время растет не более чем примерно вдвое.
+    """
+    from custom_recognizers import create_custom_recognizers
+
+    recognizers = create_custom_recognizers()
+    sizes = [100000 * args.scale * 2 ** step for step in range(3)]
+    print(f"{'Вход':<22} " + " ".join(f"{size:>10}" for size in sizes) + f" {'Рост x4':>8}  Самый медленный распознаватель")
+    for name in _adversarial_inputs(sizes[0]):
+        timings = []
+        slowest = None
+        for size in sizes:
+            text = _adversarial_inputs(size)[name]
+            per_recognizer = {
+                recognizer.name: _best_time(lambda: recognizer.analyze(text, recognizer.supported_entities), args.repeat)
+                for recognizer in recognizers
+            }
+            timings.append(sum(per_recognizer.values()))
+            slowest = max(per_recognizer, key=per_recognizer.get)
+        growth = timings[-1] / timings[0] if timings[0] > 0 else 0.0
+        print(f"{name:<22} " + " ".join(f"{seconds:>10.3f}" for seconds in timings) + f" {growth:>7.1f}x  {slowest}")
+
+
+# --- Оценка вклада распознавателей по эталонной разметке ---
+def _result_recognizer(result: RecognizerResult) -> str:
+    """Имя распознавателя результата: из recognition_metadata (Presidio), иначе из объяснения."""
+    from anonymizer_logic import _get_recognizer_info
+
+    name = (result.recognition_metadata or {}).get(RecognizerResult.RECOGNIZER_NAME_KEY)
+    return name or _get_recognizer_info(result)[0]
+
+
+def _load_gold(texts: dict[str, str], init_gold_bundle: dict | None, exceptions: set[str]) -> dict[str, list[RecognizerResult]]:
+    """
+    Читает эталонную разметку <файл>GOLD_SUFFIX (формат standoff.py) для каждого входного файла.
+    Если файла нет и передан init_gold_bundle, черновик эталона создается текущим анализом
+    (его нужно проверить и исправить вручную); иначе файл пропускается.
+    """
+    from anonymizer_logic import analyze_text
+    from standoff import standoff_filename, save_spans, load_spans, check_text, spans_to_results
+
+    gold = {}
+    for path, text in texts.items():
+        gold_file = standoff_filename(path, GOLD_SUFFIX)
+        if not os.path.exists(gold_file):
+            if init_gold_bundle is None:
+                print(f"{path}: нет эталонной разметки {gold_file} (создать черновик: --init-gold), файл пропущен.")
+                continue
+            results, _ = analyze_text(text, init_gold_bundle, exceptions)
+            spans = [
+                (res.start, res.end, res.entity_type, round(res.score, 4), _result_recognizer(res))
+                for res in sorted(results, key=lambda r: (r.start, r.end))
+            ]
+            save_spans(gold_file, text, init_gold_bundle["entities"], spans)
+            print(f"{path}: черновик эталона сохранен в {gold_file} ({len(spans)} диапазонов), проверьте его вручную.")
+        data = load_spans(gold_file)
+        check_text(data, text, gold_file)
+        gold[path] = spans_to_results(data)
+    return gold
+
+
+def _overlaps(result: RecognizerResult, others: list[RecognizerResult]) -> bool:
+    """Пересекается ли result с диапазоном того же типа из others."""
+    return any(res.entity_type == result.entity_type and res.start < result.end and result.start < res.end for res in others)
+
+
+def _quality(gold: list[list[RecognizerResult]], found: list[list[RecognizerResult]]) -> tuple[float, float, float]:
+    """Precision, recall и F1 по пересечению диапазонов одного типа (суммарно по документам)."""
+    found_count = sum(len(results) for results in found)
+    gold_count = sum(len(results) for results in gold)
+    correct = sum(_overlaps(res, doc_gold) for doc_gold, doc_found in zip(gold, found) for res in doc_found)
+    detected = sum(_overlaps(ref, doc_found) for doc_gold, doc_found in zip(gold, found) for ref in doc_gold)
+    precision = correct / found_count if found_count else 1.0
+    recall = detected / gold_count if gold_count else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+class _RecognizerProbe:
+    """
+    Подменяет на время оценки вызовы распознавателей (Presidio, Natasha, словарь известных
+    сущностей, распространение сущностей) обертками, которые замеряют время, запоминают найденные
+    диапазоны и позволяют отключить распознаватель (вместо его результатов возвращается пустой список).
+    """
+
+    def __init__(self) -> None:
+        self.disabled = set()
+        self.document = 0
+        self.seconds = defaultdict(float)
+        self.produced = defaultdict(list) # имя -> [(номер документа, результат)]
+        self._originals = {}
+
+    def wrap(self, owner, attribute: str, name: str, returns_results: bool = True) -> None:
+        key = (id(owner), attribute)
+        if key in self._originals: # Распознаватели Regex общие для основного и Regex-анализатора
+            return
+        original = getattr(owner, attribute)
+        self._originals[key] = (owner, attribute, original, attribute in vars(owner))
+
+        def timed(*args, **kwargs):
+            if returns_results and name in self.disabled:
+                return []
+            start = time.perf_counter()
+            result = original(*args, **kwargs)
+            self.seconds[name] += time.perf_counter() - start
+            if returns_results:
+                self.produced[name].extend((self.document, res) for res in result)
+            return result
+
+        setattr(owner, attribute, timed)
+
+    def wrap_bundle(self, bundle: dict) -> None:
+        """Оборачивает распознаватели и NLP Engine всех анализаторов набора."""
+        for key in ("analyzer", "regex_analyzer", "en_analyzer"):
+            analyzer = bundle[key]
+            if analyzer is None:
+                continue
+            for recognizer in analyzer.registry.recognizers:
+                self.wrap(recognizer, "analyze", recognizer.name)
+            self.wrap(analyzer.nlp_engine, "process_text", f"NLP Engine ({key})", returns_results=False)
+
+    def reset(self) -> None:
+        self.seconds.clear()
+        self.produced.clear()
+
+    def restore(self) -> None:
+        for owner, attribute, original, own_attribute in self._originals.values():
+            if own_attribute:
+                setattr(owner, attribute, original)
+            else:
+                delattr(owner, attribute)
+        self._originals.clear()
+
+
+def bench_recognizers(args: argparse.Namespace) -> None:
+    """
+    Затраты и вклад каждого распознавателя на файлах input*.txt с эталонной разметкой
+    (<файл>.gold.json в формате standoff.py; черновик создается с --init-gold).
+    Для каждого распознавателя: время, найдено диапазонов, сколько дошло до итогового результата,
+    сколько из них верных и сколько эталонных диапазонов найдено только им. Затем - исключение
+    по одному (leave-one-out): время и precision/recall/F1 анализа без распознавателя.
+    Совпадение - пересечение диапазонов одного типа. --scale не применяется (эталон привязан к тексту).
+    """
+    import anonymizer_logic
+    from anonymizer_logic import create_analysis_bundle, analyze_text, NATASHA_RECOGNIZER_NAME
+    from config import PIPELINE_PROFILES
+    from entity_propagation import PROPAGATION_RECOGNIZER_NAME
+    from known_entities import KNOWN_ENTITY_RECOGNIZER_NAME
+
+    entities, exceptions = _load_entities_and_exceptions()
+    bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU)
+    texts = _load_inputs(args.inputs)
+    gold = _load_gold(texts, bundle if args.init_gold else None, exceptions)
+    if not gold:
+        raise SystemExit("Нет файлов с эталонной разметкой.")
+    texts = {path: texts[path] for path in gold}
+    gold_lists = list(gold.values())
+
+    # Обертки работают в этом процессе, поэтому части документа анализируются последовательно
+    anonymizer_logic.ANALYSIS_WORKERS = 1
+    probe = _RecognizerProbe()
+    probe.wrap_bundle(bundle)
+    probe.wrap(anonymizer_logic, "_run_natasha_sharded", NATASHA_RECOGNIZER_NAME)
+    probe.wrap(anonymizer_logic, "propagate_entities", PROPAGATION_RECOGNIZER_NAME)
+    probe.wrap(anonymizer_logic.get_known_entity_dictionary(), "find", KNOWN_ENTITY_RECOGNIZER_NAME)
+
+    def run_all(run_bundle: dict) -> list[list[RecognizerResult]]:
+        found = []
+        for doc_index, text in enumerate(texts.values()):
+            probe.document = doc_index
+            found.append(analyze_text(text, run_bundle, exceptions)[0])
+        return found
+
+    try:
+        # --- Базовый прогон: время распознавателей - лучшее из repeat прогонов ---
+        seconds = {}
+        base_time = float("inf")
+        for _ in range(max(1, args.repeat)):
+            probe.reset()
+            start = time.perf_counter()
+            found = run_all(bundle)
+            base_time = min(base_time, time.perf_counter() - start)
+            seconds = {name: min(value, seconds.get(name, value)) for name, value in probe.seconds.items()}
+        produced = dict(probe.produced)
+        base_quality = _quality(gold_lists, found)
+
+        # Какие эталонные диапазоны покрывает каждый распознаватель (по найденным им до слияния)
+        covering = defaultdict(set)
+        for name, doc_results in produced.items():
+            for doc_index, res in doc_results:
+                for gold_index, ref in enumerate(gold_lists[doc_index]):
+                    if ref.entity_type == res.entity_type and ref.start < res.end and res.start < ref.end:
+                        covering[(doc_index, gold_index)].add(name)
+        detected = {
+            (doc_index, gold_index)
+            for doc_index, (doc_gold, doc_found) in enumerate(zip(gold_lists, found))
+            for gold_index, ref in enumerate(doc_gold) if _overlaps(ref, doc_found)
+        }
+
+        gold_count = sum(len(doc_gold) for doc_gold in gold_lists)
+        lines = [
+            f"Распознаватели: {len(texts)} документов ({args.inputs}), эталонных диапазонов: {gold_count}, "
+            f"профиль '{bundle['profile']}', анализ {base_time:.2f} с.",
+            f"Все включены: precision {base_quality[0]:.1%}, recall {base_quality[1]:.1%}, F1 {base_quality[2]:.1%}.",
+            "",
+            "| Распознаватель | Время, с | Доля времени | Найдено | В итоге | Верных в итоге | Только им |",
+            "|---|---:|---:|---:|---:|---:|---:|",
+        ]
+        names = sorted(set(seconds) | set(produced), key=lambda name: -seconds.get(name, 0.0))
+        for name in names:
+            if name not in produced: # NLP Engine: только время, диапазоны находят распознаватели
+                lines.append(f"| {name} | {seconds[name]:.3f} | {seconds[name] / base_time:.1%} | - | - | - | - |")
+                continue
+            final = [
+                (doc_index, res) for doc_index, doc_found in enumerate(found)
+                for res in doc_found if _result_recognizer(res) == name
+            ]
+            correct = sum(_overlaps(res, gold_lists[doc_index]) for doc_index, res in final)
+            unique = sum(1 for key in detected if covering[key] == {name})
+            lines.append(
+                f"| {name} | {seconds.get(name, 0.0):.3f} | {seconds.get(name, 0.0) / base_time:.1%} | "
+                f"{len(produced[name])} | {len(final)} | {correct} | {unique} |"
+            )
+        other_time = base_time - sum(seconds.values())
+        lines.append(f"| Прочее (сегментация, контекст, слияние, фильтры) | {other_time:.3f} | {other_time / base_time:.1%} | - | - | - | - |")
+
+        # --- Исключение по одному ---
+        lines += [
+            "",
+            "| Без распознавателя | Время, с | Экономия, с | Precision | Recall | F1 | ΔF1 |",
+            "|---|---:|---:|---:|---:|---:|---:|",
+        ]
+        ablations = [(name, bundle, {name}) for name in names if name in produced]
+        no_ner_profile = next(
+            (profile for profile, settings in PIPELINE_PROFILES.items()
+             if not settings["ner"] and settings["natasha"] == bundle["natasha"]), None
+        )
+        if PIPELINE_PROFILES[bundle["profile"]]["ner"] and no_ner_profile is not None:
+            # Отключение SpacyRecognizer/StanzaRecognizer не убирает работу NER-модели в NLP Engine
+            no_ner_bundle = create_analysis_bundle(entities, LANGUAGE_CODE, SPACY_MODEL_RU, profile=no_ner_profile)
+            probe.wrap_bundle(no_ner_bundle)
+            ablations.append((f"NER spaCy/Stanza (профиль '{no_ner_profile}')", no_ner_bundle, set()))
+        for label, run_bundle, disabled in ablations:
+            probe.disabled = disabled
+            ablation_found = run_all(run_bundle)
+            ablation_time = _best_time(lambda: run_all(run_bundle), args.repeat)
+            precision, recall, f1 = _quality(gold_lists, ablation_found)
+            lines.append(
+                f"| {label} | {ablation_time:.2f} | {base_time - ablation_time:+.2f} | "
+                f"{precision:.1%} | {recall:.1%} | {f1:.1%} | {f1 - base_quality[2]:+.1%} |"
+            )
+        probe.disabled = set()
+    finally:
+        probe.restore()
+
+    table = "\n".join(lines)
+    print(table)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(table + "\n")
+
+
+COMMANDS = {
+    "context": bench_context,
+    "io": bench_io,
+    "natasha": bench_natasha,
+    "pipeline": bench_pipeline,
+    "profiles": bench_profiles,
+    "recognizers": bench_recognizers,
+    "regex": bench_regex,
+    "replacement": bench_replacement,
+    "cascade": bench_cascade,
+    "routing": bench_routing,
+    "shards": bench_shards,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замеры производительности анонимизатора.")
+    parser.add_argument("command", choices=sorted(COMMANDS), help="Какой замер выполнить.")
+    parser.add_argument("--inputs", default=INPUT_GLOB, help="Маска входных файлов (по умолчанию input*.txt).")
+    parser.add_argument("--repeat", type=int, default=5, help="Число повторов замера (берется лучшее время).")
+    parser.add_argument("--scale", type=int, default=1, help="Во сколько раз размножить текст каждого файла.")
+    parser.add_argument("--output", help="Файл для сохранения таблицы результатов (для команд profiles и recognizers).")
+    parser.add_argument("--queue-size", type=int, help="Размер очередей конвейера (для команды pipeline).")
+    parser.add_argument("--workers", help="Числа параллельных частей через запятую (для команды shards, по умолчанию 1,2,4).")
+    parser.add_argument("--shard-chars", type=int, help="Размер части в символах (для команды shards, по умолчанию 20000).")
+    parser.add_argument("--init-gold", action="store_true", help="Создать черновик эталонной разметки для файлов без нее (для команды recognizers).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,9 @@ SPACY_MODEL_EN = "en_core_web_sm"
 
 # --- Настройки Presidio ---
 DEFAULT_SCORE_THRESHOLD = 0.55 # Минимальный score для учета результата анализатором
+# Ограничение времени поиска одного паттерна пользовательских распознавателей (секунд на миллион
+# символов анализируемого текста). При превышении поиск по паттерну прерывается, фрагмент текста пишется в журнал
+REGEX_TIME_LIMIT_SECONDS = 2.0
 
 # --- НОВЫЕ Настройки логики Score и Фильтрации ---
 # Порог score для определения "якорного" результата (Stanza или высокий score)
@@ -27,11 +30,149 @@ NER_FILTER_LOW_SCORE_THRESHOLD = 0.75
 NER_LOW_CONFIDENCE_SCORE_MULTIPLIER = 0.5
 # Базовый score, присваиваемый результатам Natasha NER (т.к. Natasha сама score не дает)
 NATASHA_DEFAULT_SCORE = 0.85
+# Морфологический разбор Natasha перед NER (отдельный проход нейросети). Для NER он не нужен;
+# включайте, только если морфология используется дальше
+NATASHA_TAG_MORPH = False
+# Число предложений в одном пакете Natasha NER
+NATASHA_BATCH_SIZE = 32
+# Каскадный режим NER: Regex и Natasha по всему тексту, полный NER (spaCy/Stanza) только
+# в предложениях с кандидатами или результатами со score между NER_FILTER_LOW_SCORE_THRESHOLD и ANCHOR_SCORE_THRESHOLD
+NER_CASCADE_MODE = False
+# Маршрутизация по письменности: предложения на кириллице - в ru конвейер (spaCy/Stanza/Natasha),
+# на латинице - в легкий en конвейер (SPACY_MODEL_EN), без слов (числа, символы, email) - только в Regex
+USE_LANGUAGE_ROUTING = False
+# Минимальное число латинских слов в предложении, чтобы направить его в en конвейер
+ROUTING_MIN_LATIN_WORDS = 3
+# -------------------------------------------------
+
+# --- Профили скорость/полнота ---
+# ner - NER-модель spaCy/Stanza в реестре Presidio (без нее Regex работает без усиления score по контексту),
+# natasha - этап Natasha NER, cascade - полный NER только в предложениях, где дешевые этапы не уверены
+PIPELINE_PROFILES = {
+    "fast": {"ner": False, "natasha": True, "cascade": False},     # Regex + Natasha
+    "balanced": {"ner": True, "natasha": True, "cascade": True},   # + spaCy/Stanza в каскадном режиме
+    "thorough": {"ner": True, "natasha": True, "cascade": False},  # Полный конвейер
+}
+# Профиль по умолчанию (может быть переопределен для отдельного запуска/запроса)
+PIPELINE_PROFILE = "thorough"
+# Сколько наборов для анализа (реестр распознавателей, анализаторы, операторы замены) хранить для разных
+# списков сущностей, профилей и порогов (например, для клиентов сервера). Наборы используют общие модели
+BUNDLE_CACHE_SIZE = 8
+# -------------------------------------------------
+
+# --- Словарь известных сущностей (между документами) ---
+# Размечать ранее подтвержденные PERSON/ORG/LOCATION до запуска NER. Выключено по умолчанию:
+# результат анонимизации документа начинает зависеть от ранее обработанных, не связанных с ним документов
+USE_KNOWN_ENTITIES = False
+# ВНИМАНИЕ: файл содержит найденные имена, организации и адреса в открытом виде (исходные персональные данные).
+# Храните его так же, как исходные документы; сохраняется один раз в конце запуска
+KNOWN_ENTITIES_FILENAME = "known_entities.json"
+# Максимальное число форм в словаре (редкие формы вытесняются)
+KNOWN_ENTITIES_MAX_SIZE = 50000
+# Сколько раз форма должна быть подтверждена, чтобы использоваться для разметки
+KNOWN_ENTITY_MIN_COUNT = 2
+# Score результатов словаря
+KNOWN_ENTITY_SCORE = 0.9
+# -------------------------------------------------
+
+# --- Распространение сущностей внутри документа ---
+# Подтвержденные PERSON/ORG склоняются (MorphVocab Natasha) и ищутся по всему документу:
+# все падежи, для PERSON - также фамилия с инициалами, фамилия без имени, имя с отчеством
+USE_ENTITY_PROPAGATION = True
+# Score добавленных вхождений
+PROPAGATION_SCORE = 0.85
+# Минимальная длина фамилии для поиска без имени и инициалов (короткие чаще совпадают с обычными словами)
+PROPAGATION_MIN_SURNAME_LENGTH = 4
+# -------------------------------------------------
+
+# --- Настройки записи результата ---
+# Размер куска (в символах), которым результат пост-обработки сбрасывается в выходной файл
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Сохранять финальные диапазоны (смещения, тип, score, распознаватель) рядом с выходным файлом,
+# чтобы менять плейсхолдеры без повторного анализа: python render.py
+SAVE_STANDOFF_SPANS = True
+STANDOFF_SUFFIX = ".spans.json"
+# Документы .docx (INPUT_FILENAME или файлы пакета с расширением .docx) анонимизируются напрямую,
+# с сохранением форматирования. Абзацы анализируются пакетами примерно такого объема (в символах)
+DOCX_BATCH_CHARS = 100000
+# -------------------------------------------------
+
+# --- Режим наблюдения (долгоживущий процесс) ---
+# Обрабатывать INPUT_FILENAME при каждом его изменении и перезагружать entities.txt,
+# exceptions.txt и пороги score из config.py без перезагрузки моделей
+WATCH_MODE = False
+# Интервал опроса файлов (сек)
+WATCH_POLL_INTERVAL = 1.0
+# -------------------------------------------------
+
+# --- Сервер с pre-fork рабочими процессами (python prefork_server.py) ---
+# Родительский процесс загружает модели один раз, рабочие процессы создаются fork() и используют
+# память моделей совместно (copy-on-write). Только Linux/Unix
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_WORKERS = 4
+# Максимальный размер тела запроса (байт)
+SERVER_MAX_REQUEST_BYTES = 50 * 1024 * 1024
+# Каталог, из которого массивы эмбеддингов Natasha отображаются в память (None - обычная загрузка)
+NATASHA_MMAP_DIR = "natasha_mmap"
+# Число потоков PyTorch в рабочем процессе (параллельность дают сами процессы)
+SERVER_WORKER_TORCH_THREADS = 1
+# Интервал вывода отчета о памяти рабочих процессов (сек)
+SERVER_MEMORY_REPORT_INTERVAL = 300.0
+# Планировщик (scheduler.py): рабочий процесс принимает запросы в потоках, а части документов анализируются
+# в SERVER_SCHEDULER_SLOTS слотах, короткие документы - раньше длинных. False - запросы по одному
+SERVER_SCHEDULER = True
+SERVER_SCHEDULER_SLOTS = 1
+# Сколько слотов одновременно может занимать один клиент (заголовок X-Client-Id, иначе IP-адрес)
+SERVER_SCHEDULER_MAX_SLOTS_PER_CLIENT = 4
+# Размер части документа (в символах), если не задан ANALYSIS_SHARD_CHARS: столько максимум ждет
+# короткий документ, пришедший во время анализа длинного
+SERVER_SCHEDULER_SHARD_CHARS = 20000
+# Оценка скорости анализа (символов в секунду), по которой длина текста переводится в стоимость
+SERVER_SCHEDULER_CHARS_PER_SECOND = 20000
+# Микропакеты (microbatch.py, только с планировщиком): конвейер spaCy и Natasha NER частей одновременных
+# запросов выполняются общим пакетом до SERVER_MICRO_BATCH_SIZE частей; число слотов планировщика
+# увеличивается до размера пакета. Пакет собирается не дольше SERVER_MICRO_BATCH_DELAY сек.
+# и не ждет, если все занятые слоты уже передали свои части
+SERVER_MICRO_BATCHING = True
+SERVER_MICRO_BATCH_SIZE = 8
+SERVER_MICRO_BATCH_DELAY = 0.005
+# -------------------------------------------------
+
+# --- Пакетная обработка с возобновлением ---
+# Каталог с входными файлами. Если задан, обрабатываются все файлы каталога (рекурсивно)
+# вместо INPUT_FILENAME; результаты пишутся в BATCH_OUTPUT_DIR с той же структурой каталогов
+BATCH_INPUT_DIR = None
+BATCH_OUTPUT_DIR = "output"
+# Какие файлы считать входными (сжатые файлы распаковываются при чтении)
+BATCH_INPUT_SUFFIXES = (".txt", ".txt.gz", ".txt.xz", ".txt.zst", ".docx")
+# Манифест заданий (SQLite): при перезапуске готовые файлы пропускаются, ошибочные повторяются
+BATCH_MANIFEST_FILENAME = "batch_manifest.sqlite"
+# Сколько всего попыток дается одному файлу (с учетом прошлых запусков)
+BATCH_MAX_ATTEMPTS = 3
+# Интервал вывода прогресса и оценки оставшегося времени (сек)
+BATCH_PROGRESS_INTERVAL = 10.0
+# Размер очередей между этапами конвейера (чтение -> анализ -> диапазоны -> запись).
+# Больше - лучше сглаживаются различия в размерах документов, но больше документов в памяти
+PIPELINE_QUEUE_SIZE = 2
+# Размер части текста (в символах) при потоковой обработке stdin/файла: python anonymize.py.
+# Части режутся по границам абзацев и анализируются независимо (как отдельные документы)
+CLI_CHUNK_CHARS = 1024 * 1024
 # -------------------------------------------------
 
 # --- Настройки Оборудования ---
 # Установите True для попытки использования GPU (CUDA), False для использования CPU
 USE_GPU = False
+# Анализ одного большого документа частями: документ (или регионы каскада/маршрутизации)
+# режется по границам предложений на части примерно такого размера (в символах).
+# None - документ анализируется Presidio целиком. Контекст распознавателей не выходит за границу части
+ANALYSIS_SHARD_CHARS = None
+# Сколько частей анализируется параллельно (1 - последовательно). Результат зависит только
+# от ANALYSIS_SHARD_CHARS, но не от числа потоков/процессов и типа пула
+ANALYSIS_WORKERS = 1
+# "thread" - пул потоков с общими моделями (spaCy/PyTorch освобождают GIL в тяжелых операциях),
+# "process" - пул процессов, каждый загружает свои модели (больше памяти, без конкуренции за GIL)
+ANALYSIS_EXECUTOR = "thread"
 
 # --- Плейсхолдеры для замены ---
 ENTITY_PLACEHOLDERS = {
@@ -0,0 +1,205 @@
+# config_watcher.py
+"""
+Горячая перезагрузка конфигурации без перезагрузки моделей.
+Файлы entities.txt, exceptions.txt и config.py опрашиваются по времени изменения;
+при изменении пересобираются только затронутые структуры:
+  - сущности -> реестр распознавателей и Analyzer Engine (модели переиспользуются),
+  - исключения -> множество исключений,
+  - config.py -> пороги и множители score.
+Текущая конфигурация публикуется как снимок (snapshot): документ, начатый на
+старом снимке, дообрабатывается на нем.
+Отсутствующий или пустой файл применяется, только если он остается таким на следующей
+проверке: редакторы сохраняют файл удалением и переименованием, и промежуточное
+состояние не должно заменять рабочую конфигурацию.
+"""
+import asyncio
+import logging
+import os
+import runpy
+import time
+
+from anonymizer_logic import get_analysis_bundle, THRESHOLD_NAMES, DEFAULT_THRESHOLDS
+from file_utils import load_entities_to_process, load_exceptions, read_entities_file, read_exceptions_file, default_entities
+
+
+# Состояние, не совпадающее ни с одним состоянием файла: файл будет обработан на следующей проверке
+RECHECK_STATE = (-1, -1)
+
+
+def file_state(filename: str) -> tuple[int, int] | None:
+    """Возвращает (время изменения в нс, размер) файла или None, если файла нет."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_thresholds(config_filename: str) -> dict:
+    """Читает пороги и множители score из файла config.py (без повторного импорта модуля config)."""
+    config_values = runpy.run_path(config_filename)
+    return {name: config_values.get(name, DEFAULT_THRESHOLDS[name]) for name in THRESHOLD_NAMES}
+
+
+class ConfigWatcher:
+    """
+    Отслеживает файлы конфигурации и поддерживает актуальный снимок:
+    {"version", "entities", "exceptions", "thresholds", "bundle"}.
+    Снимок заменяется целиком и не изменяется после публикации.
+    """
+
+    def __init__(
+        self,
+        entities_filename: str,
+        exceptions_filename: str,
+        config_filename: str,
+        language: str,
+        spacy_model: str,
+        nlp_engine=None,
+        en_nlp=None
+    ):
+        self.entities_filename = entities_filename
+        self.exceptions_filename = exceptions_filename
+        self.config_filename = config_filename
+        self.bundle_kwargs = {"language": language, "spacy_model": spacy_model, "nlp_engine": nlp_engine, "en_nlp": en_nlp}
+        self.snapshot = None
+        self._file_states = {}
+        self._unstable_states = {} # Отсутствующий/пустой файл, ожидающий подтверждения на следующей проверке
+
+    def _changed_files(self) -> set[str]:
+        """
+        Возвращает имена файлов, изменившихся с прошлой проверки.
+        Отсутствующий или пустой файл считается изменившимся, только если его состояние
+        не изменилось за один интервал опроса.
+        """
+        changed = set()
+        for filename in (self.entities_filename, self.exceptions_filename, self.config_filename):
+            state = file_state(filename)
+            if self._file_states.get(filename) == state:
+                self._unstable_states.pop(filename, None)
+                continue
+            if filename in self._file_states and (state is None or state[1] == 0):
+                if filename not in self._unstable_states or self._unstable_states[filename] != state:
+                    self._unstable_states[filename] = state
+                    continue
+            self._unstable_states.pop(filename, None)
+            self._file_states[filename] = state
+            changed.add(filename)
+        return changed
+
+    def _recheck(self, filename: str) -> None:
+        """Файл не удалось прочитать (например, он заменялся во время чтения): проверить его снова."""
+        self._file_states[filename] = RECHECK_STATE
+
+    def _build_bundle(self, entities: list[str], thresholds: dict) -> dict | None:
+        return get_analysis_bundle(entities, thresholds=thresholds, **self.bundle_kwargs)
+
+    async def load(self) -> dict | None:
+        """Загружает начальный снимок конфигурации. Возвращает None, если анализ невозможен."""
+        self._changed_files()
+        entities = await load_entities_to_process(self.entities_filename)
+        exceptions = await load_exceptions(self.exceptions_filename)
+        thresholds = dict(DEFAULT_THRESHOLDS)
+        bundle = await asyncio.to_thread(self._build_bundle, entities, thresholds)
+        if bundle is None:
+            return None
+        self.snapshot = {"version": 1, "entities": entities, "exceptions": exceptions, "thresholds": thresholds, "bundle": bundle}
+        return self.snapshot
+
+    async def check(self) -> bool:
+        """
+        Проверяет файлы и при изменениях публикует новый снимок.
+        Ошибочная конфигурация не применяется (остается прежний снимок): файл, который не удалось
+        прочитать, и пустой список сущностей оставляют прежние значения. Удаленный файл сущностей
+        заменяется стандартным списком, удаленный файл исключений - пустым множеством (как при запуске).
+        Возвращает True, если снимок обновлен.
+        """
+        logger = logging.getLogger()
+        changed = self._changed_files()
+        if not changed or self.snapshot is None:
+            return False
+
+        start_time = time.perf_counter()
+        snapshot = self.snapshot
+        entities, exceptions, thresholds, bundle = snapshot["entities"], snapshot["exceptions"], snapshot["thresholds"], snapshot["bundle"]
+        reloaded = []
+
+        if self.config_filename in changed:
+            try:
+                new_thresholds = await asyncio.to_thread(load_thresholds, self.config_filename)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении '{self.config_filename}', пороги не изменены: {e}")
+                self._recheck(self.config_filename)
+                new_thresholds = thresholds
+            if new_thresholds != thresholds:
+                # Через кэш наборов: пороги обновляются и в bundle["spec"] (ключ кэшей и исполнителей)
+                new_bundle = await asyncio.to_thread(self._build_bundle, entities, new_thresholds)
+                if new_bundle is None:
+                    logger.error("Новые пороги не применены: не удалось создать набор для анализа.")
+                else:
+                    thresholds, bundle = new_thresholds, new_bundle
+                    reloaded.append("пороги")
+            logger.info("Изменения config.py, кроме порогов score, применяются только после перезапуска.")
+
+        if self.exceptions_filename in changed:
+            try:
+                exceptions = await read_exceptions_file(self.exceptions_filename)
+                reloaded.append("исключения")
+            except FileNotFoundError:
+                if self._file_states[self.exceptions_filename] is None:
+                    logger.info(f"Файл исключений '{self.exceptions_filename}' удален. Исключения не используются.")
+                    exceptions = set()
+                    reloaded.append("исключения")
+                else:
+                    self._recheck(self.exceptions_filename)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении '{self.exceptions_filename}', исключения не изменены: {e}")
+                self._recheck(self.exceptions_filename)
+
+        if self.entities_filename in changed:
+            try:
+                new_entities = await read_entities_file(self.entities_filename)
+            except FileNotFoundError:
+                if self._file_states[self.entities_filename] is None:
+                    new_entities = default_entities()
+                    logger.warning(f"Файл сущностей '{self.entities_filename}' удален. Используется стандартный список: {new_entities}")
+                else:
+                    self._recheck(self.entities_filename)
+                    new_entities = entities
+            except Exception as e:
+                logger.error(f"Ошибка при чтении '{self.entities_filename}', сущности не изменены: {e}")
+                self._recheck(self.entities_filename)
+                new_entities = entities
+            if not new_entities:
+                logger.error(f"Файл сущностей '{self.entities_filename}' пуст, сущности не изменены.")
+            elif new_entities != entities:
+                new_bundle = await asyncio.to_thread(self._build_bundle, new_entities, thresholds)
+                if new_bundle is None:
+                    logger.error("Новый список сущностей не применен: анализ с ним невозможен.")
+                else:
+                    entities, bundle = new_entities, new_bundle
+                    reloaded.append("сущности")
+
+        if not reloaded:
+            return False
+        self.snapshot = {
+            "version": snapshot["version"] + 1,
+            "entities": entities,
+            "exceptions": exceptions,
+            "thresholds": thresholds,
+            "bundle": bundle
+        }
+        logger.info(
+            f"Конфигурация перезагружена ({', '.join(reloaded)}) за {(time.perf_counter() - start_time) * 1000:.1f} мс, "
+            f"версия {self.snapshot['version']}."
+        )
+        return True
+
+    async def run(self, poll_interval: float) -> None:
+        """Опрашивает файлы конфигурации с интервалом poll_interval (сек) до отмены задачи."""
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logging.getLogger().error(f"Ошибка при перезагрузке конфигурации: {e}", exc_info=True)
@@ -0,0 +1,107 @@
+# context_enhancer.py
+"""
+Ускоренное усиление score по контексту для PatternRecognizer.
+LemmaContextAwareEnhancer Presidio для каждого совпадения заново ищет токен совпадения
+линейным проходом, обходит окно лемм с проверкой по списку ключевых слов и сравнивает
+каждую лемму окна со всеми контекстными словами распознавателя.
+Здесь для документа один раз строится индекс (концы токенов, позиции ключевых лемм),
+окно контекста берется срезом по индексу, а первое подходящее контекстное слово
+для леммы кэшируется. Результаты (score и объяснения) совпадают с Presidio.
+"""
+from bisect import bisect_left, bisect_right
+
+from presidio_analyzer.context_aware_enhancers import LemmaContextAwareEnhancer
+from presidio_analyzer.nlp_engine import NlpArtifacts
+
+
+class _DocumentContextIndex:
+    """Индекс документа: концы токенов и позиции лемм, входящих в ключевые слова."""
+
+    def __init__(self, nlp_artifacts: NlpArtifacts):
+        tokens = nlp_artifacts.tokens
+        self.token_ends = [index + len(token) for index, token in zip(nlp_artifacts.tokens_indices, tokens)]
+        # Поиск по концам токенов корректен, только если нет токенов нулевой длины
+        self.bisect_safe = all(len(token) for token in tokens)
+        self.lower_lemmas = [lemma.lower() for lemma in nlp_artifacts.lemmas]
+        keywords = set(nlp_artifacts.keywords)
+        self.keyword_positions = [i for i, lemma in enumerate(self.lower_lemmas) if lemma in keywords]
+
+
+class IndexedContextAwareEnhancer(LemmaContextAwareEnhancer):
+    """LemmaContextAwareEnhancer с индексом контекста, построенным один раз на документ."""
+
+    INDEX_ATTRIBUTE = "_context_index"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # id(список контекста) -> (список, {лемма: индекс первого подходящего слова или None})
+        self._supportive_word_cache = {}
+
+    def _get_index(self, nlp_artifacts: NlpArtifacts) -> _DocumentContextIndex:
+        index = getattr(nlp_artifacts, self.INDEX_ATTRIBUTE, None)
+        if index is None:
+            index = _DocumentContextIndex(nlp_artifacts)
+            setattr(nlp_artifacts, self.INDEX_ATTRIBUTE, index)
+        return index
+
+    def _extract_surrounding_words(self, nlp_artifacts: NlpArtifacts, word: str, start: int) -> list[str]:
+        """То же окно лемм, что у LemmaContextAwareEnhancer, но срезами по индексу документа."""
+        if not nlp_artifacts.tokens:
+            return [""]
+
+        index = self._get_index(nlp_artifacts)
+        if index.bisect_safe:
+            token_index = bisect_right(index.token_ends, start)
+            if token_index == len(index.token_ends):
+                raise ValueError(
+                    "Did not find word '" + word + "' "
+                    "in the list of tokens although it "
+                    "is expected to be found"
+                )
+        else:
+            token_index = self._find_index_of_match_token(word, start, nlp_artifacts.tokens, nlp_artifacts.tokens_indices)
+
+        # Как в _add_n_words: n ключевых лемм плюс сама позиция совпадения
+        positions = index.keyword_positions
+        backward_end = bisect_right(positions, token_index)
+        backward = positions[max(0, backward_end - self.context_prefix_count - 1):backward_end]
+        forward_start = bisect_left(positions, token_index)
+        forward = positions[forward_start:forward_start + self.context_suffix_count + 1]
+
+        return list({index.lower_lemmas[i] for i in backward} | {index.lower_lemmas[i] for i in forward})
+
+    def _find_supportive_word_in_context(
+        self,
+        context_list: list[str],
+        recognizer_context_list: list[str],
+        matching_mode: str = "substring",
+    ) -> str:
+        """
+        Возвращает первое (в порядке recognizer_context_list) контекстное слово, найденное
+        в одной из лемм окна. Для каждой леммы ответ вычисляется один раз и кэшируется.
+        """
+        if context_list is None or recognizer_context_list is None:
+            return ""
+
+        cache_key = (id(recognizer_context_list), matching_mode)
+        cached = self._supportive_word_cache.get(cache_key)
+        if cached is None or cached[0] is not recognizer_context_list:
+            cached = (recognizer_context_list, [word.lower() for word in recognizer_context_list], {})
+            self._supportive_word_cache[cache_key] = cached
+        _, lowered_context, first_match_by_keyword = cached
+
+        best_index = None
+        for keyword in context_list:
+            if keyword not in first_match_by_keyword:
+                lower_keyword = keyword.lower()
+                first_match_by_keyword[keyword] = next(
+                    (
+                        i for i, context_word in enumerate(lowered_context)
+                        if (context_word in lower_keyword if matching_mode == "substring" else context_word == lower_keyword)
+                    ),
+                    None
+                )
+            match_index = first_match_by_keyword[keyword]
+            if match_index is not None and (best_index is None or match_index < best_index):
+                best_index = match_index
+        return recognizer_context_list[best_index] if best_index is not None else ""
@@ -3,10 +3,19 @@
 Содержит функцию для создания списка пользовательских распознавателей Presidio
 на основе регулярных выражений (PatternRecognizer).
 ИЗМЕНЕНО: Добавлен распознаватель для кадастровых номеров.
+Паттерны записаны без неоднозначных повторов (разделители - притяжательными квантификаторами
+модуля regex), поэтому время поиска линейно по длине текста. Каждый паттерн выполняется
+с ограничением времени (TimeLimitedPatternRecognizer).
 """
+import hashlib
 import logging
-from presidio_analyzer import Pattern, PatternRecognizer
-from config import LANGUAGE_CODE # Импортируем код языка
+from bisect import bisect_right
+from itertools import accumulate
+
+import regex
+from presidio_analyzer import EntityRecognizer, Pattern, PatternRecognizer, RecognizerResult
+
+from config import LANGUAGE_CODE, REGEX_TIME_LIMIT_SECONDS # Импортируем код языка
 
 # Контекстные слова для различных типов сущностей
 ID_CONTEXT = ["инн", "кпп", "огрн", "бик", "р/с", "к/с", "счет", "реквизиты", "банк", "номер"]
@@ -28,6 +37,99 @@ PERSON_CONTEXT = [
 ]
 # Контекст для кадастрового номера
 CADASTRAL_CONTEXT = ["кадастровый", "кадастровый номер", "номер участка", "кадастровым номером"]
+# Длина фрагмента текста с места остановки поиска, который пишется в журнал при превышении времени
+TIMEOUT_EXCERPT_CHARS = 200
+
+
+class TimeLimitedPatternRecognizer(PatternRecognizer):
+    """
+    PatternRecognizer с ограничением времени поиска каждого паттерна: time_limit секунд
+    на миллион символов текста (но не меньше time_limit). При превышении поиск по паттерну
+    прекращается, найденные до этого совпадения сохраняются, а в журнал пишутся длина, хэш
+    и фрагмент текста с места остановки - по ним находится документ, на котором паттерн "застрял".
+    Обработка совпадений (validate_result, invalidate_result, объяснение) такая же, как в PatternRecognizer;
+    дубликаты удаляются за O(n log n) вместо попарного сравнения EntityRecognizer.remove_duplicates.
+    """
+
+    def __init__(self, *args, time_limit: float = REGEX_TIME_LIMIT_SECONDS, **kwargs):
+        self.time_limit = time_limit
+        super().__init__(*args, **kwargs)
+
+    def analyze(self, text: str, entities: list[str], nlp_artifacts=None, regex_flags: int | None = None) -> list[RecognizerResult]:
+        flags = regex_flags or self.global_regex_flags
+        timeout = self.time_limit * max(1.0, len(text) / 1_000_000)
+        results = []
+        for pattern in self.patterns:
+            if not pattern.compiled_regex or pattern.compiled_with_flags != flags:
+                pattern.compiled_with_flags = flags
+                pattern.compiled_regex = regex.compile(pattern.regex, flags=flags)
+            spans = []
+            try:
+                for match in pattern.compiled_regex.finditer(text, timeout=timeout):
+                    if match.end() > match.start():
+                        spans.append(match.span())
+            except TimeoutError:
+                self._log_timeout(pattern, text, spans, timeout)
+            for start, end in spans:
+                result = self._create_result(pattern, text[start:end], start, end, flags)
+                if result.score > EntityRecognizer.MIN_SCORE:
+                    results.append(result)
+        return self._remove_duplicates(results)
+
+    @staticmethod
+    def _remove_duplicates(results: list[RecognizerResult]) -> list[RecognizerResult]:
+        """
+        То же, что EntityRecognizer.remove_duplicates для результатов одного типа: в порядке убывания score
+        (затем по началу, длинные раньше) результат отбрасывается, если он содержится в уже оставленном.
+        Оставленные результаты с большим score хранятся отсортированными по началу с максимумом концов
+        на префиксе, для текущего score достаточно максимума концов (их начала не больше текущего).
+        """
+        ordered = sorted(dict.fromkeys(results), key=lambda r: (-r.score, r.start, -(r.end - r.start)))
+        kept = []
+        previous_starts, previous_max_ends = [], []
+        current_score, current_max_end = None, -1
+        for result in ordered:
+            if result.score != current_score:
+                spans = sorted((kept_result.start, kept_result.end) for kept_result in kept)
+                previous_starts = [start for start, _ in spans]
+                previous_max_ends = list(accumulate((end for _, end in spans), max))
+                current_score, current_max_end = result.score, -1
+            index = bisect_right(previous_starts, result.start)
+            if current_max_end >= result.end or (index and previous_max_ends[index - 1] >= result.end):
+                continue
+            kept.append(result)
+            current_max_end = max(current_max_end, result.end)
+        return kept
+
+    def _create_result(self, pattern: Pattern, matched_text: str, start: int, end: int, flags: int) -> RecognizerResult:
+        validation_result = self.validate_result(matched_text)
+        description = self.build_regex_explanation(self.name, pattern.name, pattern.regex, pattern.score, validation_result, flags)
+        result = RecognizerResult(
+            entity_type=self.supported_entities[0],
+            start=start,
+            end=end,
+            score=pattern.score,
+            analysis_explanation=description,
+            recognition_metadata={
+                RecognizerResult.RECOGNIZER_NAME_KEY: self.name,
+                RecognizerResult.RECOGNIZER_IDENTIFIER_KEY: self.id,
+            }
+        )
+        if validation_result is not None:
+            result.score = EntityRecognizer.MAX_SCORE if validation_result else EntityRecognizer.MIN_SCORE
+        if self.invalidate_result(matched_text):
+            result.score = EntityRecognizer.MIN_SCORE
+        description.score = result.score
+        return result
+
+    def _log_timeout(self, pattern: Pattern, text: str, spans: list[tuple[int, int]], timeout: float) -> None:
+        position = spans[-1][1] if spans else 0
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+        logging.warning(
+            f"Паттерн '{pattern.name}' ({self.name}) превысил ограничение времени {timeout:.2f} сек. "
+            f"на тексте длиной {len(text)} (хэш {digest}); поиск прерван после {len(spans)} совпадений. "
+            f"Фрагмент с позиции {position}: {text[position:position + TIMEOUT_EXCERPT_CHARS]!r}"
+        )
 
 
 def create_custom_recognizers() -> list[PatternRecognizer]:
@@ -37,10 +139,10 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
     # 1. Дата в кавычках (RU_QUOTED_DATE)
     ru_quoted_date_pattern = Pattern(
         name="Russian Quoted Date Pattern",
-        regex=r'«?\d{1,2}»?\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+\d{4}г?\.?',
+        regex=r'«?\d{1,2}»?\s++(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s++\d{4}г?\.?',
         score=0.8
     )
-    ru_quoted_date_recognizer = PatternRecognizer(
+    ru_quoted_date_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="RU_QUOTED_DATE",
         name="Russian Quoted Date Recognizer",
         patterns=[ru_quoted_date_pattern],
@@ -51,12 +153,15 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
 
 
     # 2. Части адреса (RU_ADDRESS_PART)
+    # Пробелы после сокращения не делятся между [ \t]+ и классом текста (он тоже содержит пробел):
+    # первый пробел обязателен, остальные забираются целиком, а если после них нет текста адреса,
+    # совпадение заканчивается на пробелах (так же, как при переборе исходного "[ \t]+[...]{1,120}")
     ru_address_part_pattern = Pattern(
         name="Russian Address Part Pattern v2",
-        regex=r'(?i)\b(?:ул|улица|просп|проспект|пер|переулок|пл|площадь|ш|шоссе|б[- ]р|бульвар|наб|набережная|г|город|д|дом|кв|квартира|корп|корпус|стр|строение|пом|помещ|помещение|обл|область|р[- ]н|район|край|респ|республика|пос|поселок|днп|снт|тер|территория)\.?[ \t]+[\w\d \t\-«»"\'./А-Яа-я()№,]{1,120}(?=\b|[,\n;]|\d{6}|$)',
+        regex=r'(?i)\b(?:ул|улица|просп|проспект|пер|переулок|пл|площадь|ш|шоссе|б[- ]р|бульвар|наб|набережная|г|город|д|дом|кв|квартира|корп|корпус|стр|строение|пом|помещ|помещение|обл|область|р[- ]н|район|край|респ|республика|пос|поселок|днп|снт|тер|территория)\.?[ \t](?:[ \t]*+[\w\d \t\-«»"\'./А-Яа-я()№,]{1,120}|[ \t]++)(?=\b|[,\n;]|\d{6}|$)',
         score=0.7
     )
-    ru_address_part_recognizer = PatternRecognizer(
+    ru_address_part_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="RU_ADDRESS_PART",
         name="Russian Address Part Recognizer v2",
         patterns=[ru_address_part_pattern],
@@ -72,7 +177,7 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
         regex=r'\b(\d{6})\b', # 6 цифр на границе слова
         score=0.7
     )
-    ru_postal_code_recognizer = PatternRecognizer(
+    ru_postal_code_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="RU_POSTAL_CODE",
         name="Russian Postal Code Recognizer",
         patterns=[ru_postal_code_pattern],
@@ -84,10 +189,12 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
 
     # 4. Организации (ORG) - Regex
     org_keywords = r'(?:ООО|ЗАО|ОАО|ПАО|ИП|АО|ГКУ|МУП|ГУП|ФГУП|Фонд|Компания|Фирма|Банк|УФК|Министерство|Отделение|Общество|Учреждение|Акционерное общество)'
-    org_name_part = r'(?:["«“](?:[^"»”])+["»”]|[\w\d][\w\d \t\-\.\(\)/]*[\w\d])'
+    # Название в кавычках ограничено 200 символами: без ограничения каждая открывающая кавычка
+    # без закрывающей просматривала текст до конца (квадратичное время)
+    org_name_part = r'(?:["«“][^"»”]{1,200}+["»”]|[\w\d][\w\d \t\-\.\(\)/]*[\w\d])'
     ru_org_pattern = Pattern(
         name="Russian Organization Pattern v3",
-        regex=rf'(?i)\b{org_keywords}[ \t]+{org_name_part}(?=\s|[,;\(\)\.]|$|\n)',
+        regex=rf'(?i)\b{org_keywords}[ \t]++{org_name_part}(?=\s|[,;\(\)\.]|$|\n)',
         score=0.85
     )
     ru_org_simple_pattern = Pattern(
@@ -95,7 +202,7 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
         regex=r'\b(АО|ПАО|ООО|ЗАО)[ \t]+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)*\b',
         score=0.75
     )
-    ru_org_recognizer = PatternRecognizer(
+    ru_org_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="ORG",
         name="Russian Organization Recognizer v3",
         patterns=[ru_org_pattern, ru_org_simple_pattern],
@@ -106,19 +213,19 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
 
     # 5. Идентификаторы (RU_IDENTIFIER)
     ru_inn_pattern = Pattern(name="Russian INN Pattern", regex=r'\b(\d{10}|\d{12})\b', score=0.9)
-    ru_inn_recognizer = PatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian INN Recognizer", patterns=[ru_inn_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT)
+    ru_inn_recognizer = TimeLimitedPatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian INN Recognizer", patterns=[ru_inn_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT)
     recognizers.append(ru_inn_recognizer)
     ru_kpp_pattern = Pattern(name="Russian KPP Pattern", regex=r'\b(\d{9})\b', score=0.9)
-    ru_kpp_recognizer = PatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian KPP Recognizer", patterns=[ru_kpp_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["кпп"])
+    ru_kpp_recognizer = TimeLimitedPatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian KPP Recognizer", patterns=[ru_kpp_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["кпп"])
     recognizers.append(ru_kpp_recognizer)
     ru_ogrn_pattern = Pattern(name="Russian OGRN Pattern", regex=r'\b(\d{13}|\d{15})\b', score=0.9)
-    ru_ogrn_recognizer = PatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian OGRN Recognizer", patterns=[ru_ogrn_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["огрн"])
+    ru_ogrn_recognizer = TimeLimitedPatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian OGRN Recognizer", patterns=[ru_ogrn_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["огрн"])
     recognizers.append(ru_ogrn_recognizer)
     ru_bik_pattern = Pattern(name="Russian BIK Pattern", regex=r'\b(\d{9})\b', score=0.9)
-    ru_bik_recognizer = PatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian BIK Recognizer", patterns=[ru_bik_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["бик", "банк"])
+    ru_bik_recognizer = TimeLimitedPatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian BIK Recognizer", patterns=[ru_bik_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["бик", "банк"])
     recognizers.append(ru_bik_recognizer)
     ru_account_pattern = Pattern(name="Russian Account Pattern", regex=r'\b(\d{20})\b', score=0.9)
-    ru_account_recognizer = PatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian Account Recognizer", patterns=[ru_account_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["р/с", "к/с", "счет", "расч/сч", "корр/сч"])
+    ru_account_recognizer = TimeLimitedPatternRecognizer(supported_entity="RU_IDENTIFIER", name="Russian Account Recognizer", patterns=[ru_account_pattern], supported_language=LANGUAGE_CODE, context=ID_CONTEXT + ["р/с", "к/с", "счет", "расч/сч", "корр/сч"])
     recognizers.append(ru_account_recognizer)
     logging.debug(f"Созданы пользовательские распознаватели для RU_IDENTIFIER")
 
@@ -128,7 +235,7 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
     phone_pattern_2 = Pattern(name="Russian Phone Pattern (8 XXX)", regex=r'\b8[ \t]?\(?\d{3}\)?[ \t]?\d{3}[- \t]?\d{2}[- \t]?\d{2}\b', score=0.85)
     phone_pattern_3 = Pattern(name="Russian Phone Pattern (10 digits - low confidence)", regex=r'\b\d{10}\b', score=0.4)
     phone_pattern_4 = Pattern(name="Russian Phone Pattern (+7 XXX XXX XX XX)", regex=r'\+7[ \t]?\d{3}[ \t]?\d{3}[ \t]?\d{2}[ \t]?\d{2}\b', score=0.9)
-    ru_phone_recognizer = PatternRecognizer(
+    ru_phone_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="PHONE_NUMBER",
         name="Custom Russian Phone Recognizer v2",
         patterns=[phone_pattern_1, phone_pattern_2, phone_pattern_4, phone_pattern_3],
@@ -165,7 +272,7 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
     )
 
     # Создаем распознаватель PERSON только с высокоточными паттернами
-    ru_person_recognizer = PatternRecognizer(
+    ru_person_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="PERSON",
         name="Custom Russian Person Recognizer v4 (High Confidence Only)", # Новое имя
         patterns=[
@@ -186,7 +293,7 @@ def create_custom_recognizers() -> list[PatternRecognizer]:
         regex=r'\b\d{2}:\d{2}:\d+:\d+\b',
         score=0.95 # Высокая уверенность из-за специфичности формата
     )
-    ru_cadastral_recognizer = PatternRecognizer(
+    ru_cadastral_recognizer = TimeLimitedPatternRecognizer(
         supported_entity="RU_CADASTRAL_NUMBER",
         name="Russian Cadastral Number Recognizer",
         patterns=[ru_cadastral_pattern],
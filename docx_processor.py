@@ -0,0 +1,273 @@
+# docx_processor.py
+"""
+Анонимизация документов .docx без промежуточных текстовых файлов.
+Текстовые части документа (word/document.xml, колонтитулы, сноски, примечания)
+читаются потоково и разбираются на теги и текст; для каждого абзаца (w:p) собирается
+текст из узлов w:t / w:delText с их смещениями. Абзацы анализируются пакетами
+(analyze_text) общим объемом около DOCX_BATCH_CHARS символов, плейсхолдеры
+вставляются обратно в узлы w:t на месте найденных диапазонов.
+Теги и неизмененные узлы переносятся в результат байт в байт, поэтому форматирование
+сохраняется; в памяти находится только текущий пакет абзацев. Остальные части
+архива (стили, изображения и т.д.) копируются без изменений.
+Из правил пост-обработки применяется только слияние одинаковых соседних плейсхолдеров:
+пробелы и переносы в .docx являются частью форматирования.
+"""
+import codecs
+import html
+import logging
+import re
+import shutil
+import zipfile
+from bisect import bisect_right
+from typing import IO, Iterator
+from xml.sax.saxutils import escape
+
+from presidio_analyzer import RecognizerResult
+
+from anonymizer_logic import analyze_text, get_anonymizer_operators, get_known_entity_dictionary
+from config import USE_KNOWN_ENTITIES, DOCX_BATCH_CHARS
+from file_utils import open_atomic
+from replacement_engine import SpanReplacementEngine
+
+DOCX_SUFFIX = ".docx"
+# Части документа, содержащие текст
+TEXT_PART_PATTERN = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes|comments)\.xml')
+# Токены XML: тег (атрибуты могут содержать '>' в кавычках) или текст между тегами
+TOKEN_PATTERN = re.compile(r'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>|[^<]+')
+TAG_NAME_PATTERN = re.compile(r'<(/?)([\w:.-]+)')
+# Теги, текст которых входит в текст абзаца
+TEXT_NODE_TAGS = {"w:t", "w:delText"}
+# Теги, которые в тексте абзаца соответствуют разделителю
+SEPARATOR_TAGS = {"w:tab": "\t", "w:br": "\n", "w:cr": "\n"}
+# Плейсхолдеры, которые сливаются при соседстве (как первое правило POST_PROCESS_RULES)
+MERGEABLE_PLACEHOLDER_PATTERN = re.compile(r'<[\w_]+>')
+READ_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+def is_docx(filename: str) -> bool:
+    return filename.lower().endswith(DOCX_SUFFIX)
+
+
+def _iter_xml_tokens(stream: IO[bytes]) -> Iterator[str]:
+    """Потоково разбирает XML (utf-8) на теги и текстовые фрагменты; текст между тегами выдается целиком."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        data = tail + decoder.decode(chunk, final=not chunk)
+        position = 0
+        for match in TOKEN_PATTERN.finditer(data):
+            # Незавершенный тег или фрагмент на конце буфера дочитывается со следующим куском
+            if match.start() != position or (chunk and match.end() == len(data)):
+                break
+            yield match.group()
+            position = match.end()
+        tail = data[position:]
+        if not chunk:
+            if tail:
+                raise ValueError("Некорректный XML: незавершенный тег в конце части документа.")
+            return
+
+
+class _BufferedWriter:
+    """Буферизует запись строк в бинарный поток (части архива пишутся множеством мелких токенов)."""
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.parts:
+            self.stream.write("".join(self.parts).encode("utf-8"))
+            self.parts, self.size = [], 0
+
+
+class _PartAnonymizer:
+    """
+    Анонимизирует одну текстовую часть документа.
+    Токены от начала первого незавершенного абзаца пакета до его обработки держатся в pending.
+    """
+
+    def __init__(self, writer: _BufferedWriter, bundle: dict, exceptions_list: set[str], stats: dict):
+        self.writer = writer
+        self.bundle = bundle
+        self.exceptions_list = exceptions_list
+        self.stats = stats
+        self.replacement_engine = SpanReplacementEngine()
+        self.pending: list[str] = []
+        self.open_paragraphs: list[dict] = [] # Стек (абзацы могут быть вложены, например в надписях)
+        self.paragraphs: list[dict] = []      # Завершенные абзацы текущего пакета
+        self.batch_chars = 0
+        self.in_text_node = False
+
+    def feed(self, token: str) -> None:
+        if token[0] != "<":
+            if self.in_text_node and self.open_paragraphs:
+                paragraph = self.open_paragraphs[-1]
+                text = html.unescape(token)
+                paragraph["nodes"].append((len(self.pending), paragraph["length"], text))
+                paragraph["parts"].append(text)
+                paragraph["length"] += len(text)
+            self._emit(token)
+            return
+
+        match = TAG_NAME_PATTERN.match(token)
+        if match is None: # Объявление XML, комментарий и т.п.
+            self._emit(token)
+            return
+        is_closing, name = bool(match.group(1)), match.group(2)
+        self_closing = token.endswith("/>")
+
+        if name == "w:p" and not self_closing:
+            if is_closing:
+                self._emit(token)
+                self._close_paragraph()
+                return
+            self.open_paragraphs.append({"nodes": [], "parts": [], "length": 0})
+        elif name in TEXT_NODE_TAGS:
+            self.in_text_node = not is_closing and not self_closing
+        elif name in SEPARATOR_TAGS and self.open_paragraphs and not is_closing:
+            paragraph = self.open_paragraphs[-1]
+            paragraph["parts"].append(SEPARATOR_TAGS[name])
+            paragraph["length"] += 1
+        self._emit(token)
+
+    def _emit(self, token: str) -> None:
+        if self.pending or self.open_paragraphs:
+            self.pending.append(token)
+        else:
+            self.writer.write(token)
+
+    def _close_paragraph(self) -> None:
+        if not self.open_paragraphs:
+            return
+        paragraph = self.open_paragraphs.pop()
+        paragraph["text"] = "".join(paragraph.pop("parts"))
+        if paragraph["nodes"]:
+            self.paragraphs.append(paragraph)
+            self.batch_chars += paragraph["length"] + 1
+        if not self.open_paragraphs and self.batch_chars >= DOCX_BATCH_CHARS:
+            self.flush()
+
+    def finish(self) -> None:
+        # Незакрытые абзацы (некорректный документ) обрабатываются как есть
+        while self.open_paragraphs:
+            self._close_paragraph()
+        self.flush()
+
+    def flush(self) -> None:
+        """Анализирует накопленные абзацы, вставляет плейсхолдеры и выводит pending."""
+        if self.paragraphs:
+            self._anonymize_paragraphs()
+        for token in self.pending:
+            self.writer.write(token)
+        self.pending, self.paragraphs, self.batch_chars = [], [], 0
+
+    def _anonymize_paragraphs(self) -> None:
+        # Абзацы анализируются одним текстом, по строке на абзац
+        starts, position = [], 0
+        for paragraph in self.paragraphs:
+            starts.append(position)
+            position += paragraph["length"] + 1
+        batch_text = "\n".join(paragraph["text"] for paragraph in self.paragraphs)
+        final_results, known_entity_results = analyze_text(batch_text, self.bundle, self.exceptions_list)
+        if USE_KNOWN_ENTITIES:
+            get_known_entity_dictionary().learn(batch_text, final_results, known_entity_results)
+        if not final_results:
+            return
+
+        found_entities = set(result.entity_type for result in final_results)
+        operators = self.bundle["operators"]
+        if not found_entities <= operators.keys():
+            operators = get_anonymizer_operators(list(found_entities | set(self.bundle["entities"])))
+        spans_by_paragraph: dict[int, list[list]] = {}
+        last_end = 0
+        for result in sorted(final_results, key=lambda r: (r.start, -r.end)):
+            if result.start < last_end: # Пересекающиеся диапазоны: остается первый
+                continue
+            last_end = result.end
+            index = bisect_right(starts, result.start) - 1
+            paragraph, base = self.paragraphs[index], starts[index]
+            start, end = result.start - base, min(result.end - base, paragraph["length"])
+            if start >= end:
+                continue
+            local_result = RecognizerResult(result.entity_type, start, end, result.score)
+            replacement = self.replacement_engine.replacement_for(paragraph["text"], local_result, operators)
+            spans = spans_by_paragraph.setdefault(index, [])
+            # Слияние одинаковых соседних плейсхолдеров, разделенных только пробелами
+            if (
+                spans and spans[-1][2] == replacement and MERGEABLE_PLACEHOLDER_PATTERN.fullmatch(replacement)
+                and not paragraph["text"][spans[-1][1]:start].strip()
+            ):
+                spans[-1][1] = end
+            else:
+                spans.append([start, end, replacement])
+
+        for index, spans in spans_by_paragraph.items():
+            self._splice(self.paragraphs[index], spans)
+            self.stats["spans"] += len(spans)
+
+    def _splice(self, paragraph: dict, spans: list[list]) -> None:
+        """Вставляет замены в узлы w:t абзаца. Замена ставится в первый узел, пересекающийся с диапазоном."""
+        placed = [False] * len(spans)
+        for token_index, node_start, node_text in paragraph["nodes"]:
+            node_end = node_start + len(node_text)
+            pieces, position, changed = [], node_start, False
+            for span_index, (start, end, replacement) in enumerate(spans):
+                if end <= node_start or start >= node_end:
+                    continue
+                changed = True
+                if start > position:
+                    pieces.append(node_text[position - node_start:start - node_start])
+                if not placed[span_index]:
+                    pieces.append(replacement)
+                    placed[span_index] = True
+                position = max(position, min(end, node_end))
+            if not changed:
+                continue
+            if position < node_end:
+                pieces.append(node_text[position - node_start:])
+            self.pending[token_index] = escape("".join(pieces))
+            # Сохранение пробелов на краях нового текста узла
+            open_tag = self.pending[token_index - 1]
+            if "xml:space" not in open_tag:
+                self.pending[token_index - 1] = open_tag[:-1] + ' xml:space="preserve">'
+
+
+def anonymize_docx_file(input_file: str, output_file: str, bundle: dict, exceptions_list: set[str]) -> dict:
+    """
+    Анонимизирует .docx: текстовые части обрабатываются потоково, остальные копируются.
+    Результат записывается атомарно (временный файл и переименование).
+    Возвращает статистику {"parts", "spans"}. Эта функция является СИНХРОННОЙ.
+    """
+    logger = logging.getLogger()
+    stats = {"parts": 0, "spans": 0}
+    with zipfile.ZipFile(input_file) as source, open_atomic(output_file, mode="wb") as output, zipfile.ZipFile(output, mode="w") as target:
+        for info in source.infolist():
+            target_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            target_info.compress_type = info.compress_type
+            target_info.external_attr = info.external_attr
+            force_zip64 = info.file_size >= zipfile.ZIP64_LIMIT
+            with source.open(info) as source_part, target.open(target_info, mode="w", force_zip64=force_zip64) as target_part:
+                if not TEXT_PART_PATTERN.fullmatch(info.filename):
+                    shutil.copyfileobj(source_part, target_part, READ_CHUNK_SIZE)
+                    continue
+                logger.info(f"Анонимизация части '{info.filename}'...")
+                writer = _BufferedWriter(target_part)
+                part_anonymizer = _PartAnonymizer(writer, bundle, exceptions_list, stats)
+                for token in _iter_xml_tokens(source_part):
+                    part_anonymizer.feed(token)
+                part_anonymizer.finish()
+                writer.flush()
+                stats["parts"] += 1
+
+    logger.info(f"Документ '{input_file}' анонимизирован: частей с текстом {stats['parts']}, замен {stats['spans']}.")
+    return stats
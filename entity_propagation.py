@@ -0,0 +1,208 @@
+# entity_propagation.py
+"""
+Распространение подтвержденных PERSON/ORG по документу с учетом склонения.
+Финальные результаты PERSON/ORG (прошедшие все фильтры) раскладываются на слова, слова
+разбираются MorphVocab Natasha (pymorphy2) и склоняются по падежам:
+  PERSON - полная форма, фамилия с инициалами («Ложкина А.Н.», «А. Н. Ложкина»),
+           фамилия без имени и имя с отчеством;
+  ORG    - начальная группа слов в одном падеже («Министерство финансов» -> «Министерству финансов»)
+           и название в кавычках без организационно-правовой формы.
+Все варианты ищутся одним многошаблонным проходом (compile_phrase_matcher); вхождения,
+не пересекающиеся с уже найденными результатами, добавляются с распознавателем
+PROPAGATION_RECOGNIZER_NAME. Так сущность, найденная NER один раз, размечается во всем документе.
+"""
+import logging
+import re
+from bisect import bisect_left
+from itertools import accumulate
+
+from presidio_analyzer import RecognizerResult
+
+from text_utils import compile_phrase_matcher
+
+PROPAGATION_RECOGNIZER_NAME = "EntityPropagation"
+PROPAGATION_ENTITY_TYPES = {"PERSON", "ORG"}
+# Падежи в обозначениях UD (MorphForm.inflect Natasha принимает граммемы UD)
+CASES = ("Nom", "Gen", "Dat", "Acc", "Ins", "Loc")
+PERSON_ROLES = ("Surn", "Name", "Patr")
+# Слово (в т.ч. через дефис) или инициал
+WORD_PATTERN = re.compile(r'[А-ЯЁа-яё]+(?:-[А-ЯЁа-яё]+)*\.?')
+QUOTED_NAME_PATTERN = re.compile(r'[«"“][^«»"“”]+[»"”]')
+# Части речи, которые склоняются в начальной группе слов названия организации
+ORG_INFLECTED_POS = {"NOUN", "ADJF"}
+MIN_VARIANT_LENGTH = 3
+
+
+def _match_case(template: str, word: str) -> str:
+    """Переносит регистр исходного слова на склоненную форму (pymorphy2 возвращает строчные)."""
+    if len(template) > 1 and template.isupper():
+        return word.upper()
+    if template[:1].isupper():
+        return "-".join(part[:1].upper() + part[1:] for part in word.split("-"))
+    return word
+
+
+def _inflect(form, word: str, case: str) -> str:
+    inflected = form.inflect({case}) if form is not None else None
+    if inflected is None:
+        return word
+    inflected_word = inflected.word if "ё" in word.lower() else inflected.word.replace("ё", "е")
+    return _match_case(word, inflected_word)
+
+
+def _person_parse(morph_vocab, word: str, gender: str | None):
+    """Выбирает разбор слова как части ФИО (фамилия, имя, отчество), согласованный по роду."""
+    for form in morph_vocab.parse(word):
+        if any(role in form.tag for role in PERSON_ROLES) and (gender is None or form.tag.gender in (gender, None)):
+            return form
+    return None
+
+
+def _person_gender(morph_vocab, words: list[str]) -> str | None:
+    """
+    Род по отчеству, а без него - по самому вероятному разбору имени
+    (у фамилий разбор по роду неоднозначен). None - род не определен.
+    """
+    for role in ("Patr", "Name"):
+        candidates = [
+            form for word in words for form in morph_vocab.parse(word)
+            if role in form.tag and form.tag.gender in ("masc", "femn")
+        ]
+        if candidates:
+            return max(candidates, key=lambda form: form.score).tag.gender
+    return None
+
+
+def _person_variants(morph_vocab, surface: str, min_surname_length: int) -> set[str]:
+    words = WORD_PATTERN.findall(surface)
+    full_words = [word for word in words if not word.endswith(".")]
+    initials = [word for word in words if word.endswith(".") and len(word) == 2]
+    if not full_words:
+        return set()
+
+    gender = _person_gender(morph_vocab, full_words)
+    variants = set()
+    # Без имени и отчества род неизвестен («Ложкину»): строятся формы обоих родов
+    for current_gender in [gender] if gender else ["masc", "femn"]:
+        parsed = []
+        for word in full_words:
+            form = _person_parse(morph_vocab, word, current_gender)
+            role = next((role for role in PERSON_ROLES if form is not None and role in form.tag), None)
+            parsed.append((word, form, role))
+        surname = next(((word, form) for word, form, role in parsed if role == "Surn"), None)
+        if surname is None and initials and len(parsed) == 1:
+            surname = parsed[0][:2] # «Смит Дж.»: единственное полное слово при инициалах - фамилия
+        first_name = next(((word, form) for word, form, role in parsed if role == "Name"), None)
+        patronymic = next(((word, form) for word, form, role in parsed if role == "Patr"), None)
+        person_initials = initials
+        if first_name is not None:
+            person_initials = [first_name[0][0] + "."] + ([patronymic[0][0] + "."] if patronymic is not None else [])
+
+        for case in CASES:
+            if len(parsed) > 1 or not initials:
+                variants.add(" ".join(_inflect(form, word, case) for word, form, _ in parsed))
+            if surname is not None:
+                surname_form = _inflect(surname[1], surname[0], case)
+                if person_initials:
+                    joined, spaced = "".join(person_initials), " ".join(person_initials)
+                    variants.update({
+                        f"{surname_form} {joined}", f"{surname_form} {spaced}",
+                        f"{joined} {surname_form}", f"{spaced} {surname_form}",
+                    })
+                if len(surname[0]) >= min_surname_length:
+                    variants.add(surname_form)
+            if first_name is not None and patronymic is not None:
+                variants.add(f"{_inflect(first_name[1], first_name[0], case)} {_inflect(patronymic[1], patronymic[0], case)}")
+    return variants
+
+
+def _org_variants(morph_vocab, surface: str) -> set[str]:
+    variants = set()
+    quoted = QUOTED_NAME_PATTERN.search(surface)
+    if quoted:
+        variants.add(quoted.group())
+        if quoted.start() > 0: # Организационно-правовая форма с названием в кавычках не склоняется
+            return variants
+
+    words = surface.split()
+    head = []
+    head_case = None
+    for word in words:
+        form = morph_vocab.parse(word)[0]
+        if form.tag.POS not in ORG_INFLECTED_POS or (head_case is not None and form.tag.case != head_case):
+            break
+        head_case = form.tag.case
+        head.append((word, form))
+    if not head:
+        return variants
+    tail = " ".join(words[len(head):])
+    for case in CASES:
+        inflected_head = " ".join(_inflect(form, word, case) for word, form in head)
+        variants.add(f"{inflected_head} {tail}" if tail else inflected_head)
+    return variants
+
+
+def propagate_entities(
+    text: str,
+    results: list[RecognizerResult],
+    entities: list[str],
+    morph_vocab,
+    score: float,
+    exceptions_list: set[str],
+    min_surname_length: int
+) -> list[RecognizerResult]:
+    """
+    Ищет по всему тексту падежные и сокращенные формы подтвержденных PERSON/ORG из results.
+    Возвращает только новые результаты (не пересекающиеся с results и не из списка исключений).
+    morph_vocab - MorphVocab Natasha.
+    """
+    logger = logging.getLogger()
+    allowed_types = set(entities) & PROPAGATION_ENTITY_TYPES
+    sources = {}
+    for result in results:
+        if result.entity_type in allowed_types:
+            sources.setdefault(text[result.start:result.end].strip(), result.entity_type)
+
+    variant_types = {}
+    for surface, entity_type in sources.items():
+        try:
+            if entity_type == "PERSON":
+                variants = _person_variants(morph_vocab, surface, min_surname_length)
+            else:
+                variants = _org_variants(morph_vocab, surface)
+        except Exception as e:
+            logger.debug(f"Не удалось построить формы для '{surface}': {e}")
+            variants = set()
+        variants.add(surface)
+        for variant in variants:
+            if len(variant) >= MIN_VARIANT_LENGTH and variant.lower() not in exceptions_list:
+                variant_types.setdefault(variant, entity_type)
+
+    matcher = compile_phrase_matcher(variant_types)
+    if matcher is None:
+        return []
+
+    spans = sorted((result.start, result.end) for result in results)
+    starts = [start for start, _ in spans]
+    max_ends = list(accumulate((end for _, end in spans), max))
+    propagated = []
+    for match in matcher.finditer(text):
+        index = bisect_left(starts, match.end())
+        if index and max_ends[index - 1] > match.start():
+            continue # Пересекается с уже найденным результатом
+        propagated.append(RecognizerResult(
+            entity_type=variant_types[match.group()],
+            start=match.start(),
+            end=match.end(),
+            score=score,
+            analysis_explanation={
+                "recognizer_name": PROPAGATION_RECOGNIZER_NAME,
+                "original_score": score,
+                "text": match.group()
+            }
+        ))
+    logger.info(
+        f"Распространение сущностей: {len(sources)} подтвержденных форм PERSON/ORG, "
+        f"{len(variant_types)} вариантов склонения, добавлено {len(propagated)} вхождений."
+    )
+    return propagated
@@ -1,53 +1,336 @@
 # file_utils.py
 """
-Содержит функции для загрузки конфигурации из файлов (сущности, исключения).
-ИЗМЕНЕНО: Функции сделаны асинхронными с использованием aiofiles.
+Содержит функции ввода-вывода: загрузка конфигурации из файлов (сущности, исключения),
+чтение входных текстов и атомарная запись результатов.
+Файлы читаются целиком (одним вызовом), сжатые файлы (.gz, .xz, .zst) распаковываются
+прозрачно, стандартный ввод и файлы в режиме фильтра (anonymize.py) - потоково частями
+по границам абзацев. Архивы (.tar, .zip) не поддерживаются: их нужно распаковать заранее.
+Кодировка определяется автоматически (utf-8 или cp1251).
 """
-import logging
 import asyncio
-import aiofiles # <-- Добавлено
+import codecs
+import contextlib
+import gzip
+import logging
+import lzma
+import mmap
+import os
+import re
+import stat
+import sys
+import tempfile
+from typing import IO, Iterable, Iterator, TextIO
+
 from config import ENTITY_PLACEHOLDERS # Импортируем для fallback в load_entities
 
-async def load_entities_to_process(filename: str) -> list[str]: # <-- async def
-    """Загружает список сущностей для обработки из файла (асинхронно)."""
-    entities = []
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Кодировка, используемая, если текст не является корректным utf-8
+FALLBACK_ENCODING = "cp1251"
+
+# Потоковое чтение: сколько байт читать за раз и по скольким первым байтам определять кодировку
+STREAM_READ_BYTES = 65536
+STREAM_SNIFF_BYTES = 65536
+# Граница абзаца (пустая строка) - предпочтительное место разреза потока на части
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[ \t]*\n')
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".tar.zst")
+ZIP_SUFFIXES = (".zip",)
+
+
+# --- Определение кодировки ---
+def _decode(data, encoding: str | None) -> str:
+    if encoding:
+        return str(data, encoding)
+    if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+        return str(data, "utf-8-sig")
+    try:
+        return str(data, "utf-8")
+    except UnicodeDecodeError:
+        logging.debug(f"Текст не является корректным utf-8, используется {FALLBACK_ENCODING}.")
+        return str(data, FALLBACK_ENCODING, errors="replace")
+
+
+def decode_text(data, encoding: str | None = None) -> str:
+    """
+    Декодирует bytes (или mmap) в строку.
+    Если encoding не указан: utf-8 (с BOM или без), при ошибке - cp1251.
+    Переводы строк '\r\n' и '\r' приводятся к '\n', как при чтении в текстовом режиме.
+    """
+    text = _decode(data, encoding)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# --- Чтение файлов ---
+def _open_zstd(filename: str):
+    if not ZSTD_AVAILABLE:
+        raise ImportError("Для чтения файлов .zst установите библиотеку: pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(open(filename, mode='rb'), closefd=True)
+
+
+def _open_decompressed(filename: str):
+    """Открывает сжатый файл на чтение распакованных байтов или возвращает None для несжатого файла."""
+    lower_name = filename.lower()
+    if lower_name.endswith(".gz"):
+        return gzip.open(filename, mode='rb')
+    if lower_name.endswith(".xz"):
+        return lzma.open(filename, mode='rb')
+    if lower_name.endswith(".zst"):
+        return _open_zstd(filename)
+    return None
+
+
+def is_archive(filename: str) -> bool:
+    """Проверяет, является ли файл архивом (.tar, .zip и сжатые tar)."""
+    return filename.lower().endswith(TAR_SUFFIXES + ZIP_SUFFIXES)
+
+
+def read_text_mmap(filename: str, encoding: str | None = None) -> str:
+    """
+    Читает несжатый текстовый файл через mmap (синхронно).
+    Декодирование выполняется напрямую из отображенной памяти, без
+    промежуточной копии bytes, поэтому в памяти процесса остается одна копия текста.
+    """
+    with open(filename, mode='rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            return ""
+        with mapped:
+            return decode_text(mapped, encoding)
+
+
+def read_text(filename: str, encoding: str | None = None) -> str:
+    """Читает текстовый файл целиком (синхронно), распаковывая .gz/.xz/.zst."""
+    if is_archive(filename):
+        raise ValueError(f"Файл '{filename}' является архивом. Архивы не поддерживаются, распакуйте его.")
+    decompressed = _open_decompressed(filename)
+    if decompressed is None:
+        return read_text_mmap(filename, encoding)
+    with decompressed:
+        return decode_text(decompressed.read(), encoding)
+
+
+# --- Потоковое чтение частями (стандартный ввод, режим фильтра) ---
+def _detect_stream_encoding(head: bytes) -> str:
+    """Кодировка потока по первым байтам: utf-8 (с BOM или без), иначе cp1251."""
+    if head[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+        return "utf-8-sig"
     try:
-        # Используем async with и aiofiles.open
-        async with aiofiles.open(filename, mode='r', encoding='utf-8') as f:
-            # Используем async for
-            async for line in f:
-                cleaned_line = line.split('#')[0].strip()
-                if cleaned_line:
-                    entities.append(cleaned_line)
+        # final=False: начало потока может обрываться посреди многобайтного символа
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        logging.debug(f"Поток не является корректным utf-8, используется {FALLBACK_ENCODING}.")
+        return FALLBACK_ENCODING
+
+
+def _iter_decoded_blocks(stream, encoding: str | None) -> Iterator[str]:
+    """
+    Читает двоичный поток блоками по мере поступления данных и декодирует их.
+    Переводы строк '\r\n' и '\r' приводятся к '\n' (в т.ч. на стыке блоков).
+    """
+    read = getattr(stream, "read1", stream.read) # read1 не ждет заполнения всего блока
+    head = b""
+    while len(head) < STREAM_SNIFF_BYTES:
+        block = read(STREAM_READ_BYTES)
+        if not block:
+            break
+        head += block
+    decoder = codecs.getincrementaldecoder(encoding or _detect_stream_encoding(head))(errors="replace")
+    block = head
+    pending_cr = ""
+    while True:
+        is_final = not block
+        text = pending_cr + decoder.decode(block, final=is_final)
+        pending_cr = ""
+        if text.endswith("\r") and not is_final:
+            # '\r' в конце блока может оказаться началом '\r\n'
+            text, pending_cr = text[:-1], "\r"
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if text:
+            yield text
+        if is_final:
+            return
+        block = read(STREAM_READ_BYTES)
+
+
+def _find_chunk_cut(buffer: str, chunk_chars: int) -> int:
+    """
+    Место разреза буфера: граница абзаца, при ее отсутствии - строки или слова.
+    Предпочитается последняя граница в [chunk_chars // 2, chunk_chars], затем первая после chunk_chars.
+    Возвращает -1, если границы нет.
+    """
+    min_cut = chunk_chars // 2
+    cut = -1
+    for match in PARAGRAPH_BREAK_PATTERN.finditer(buffer, min_cut):
+        if match.end() > chunk_chars and cut != -1:
+            break
+        cut = match.end()
+        if cut > chunk_chars:
+            break
+    if cut != -1:
+        return cut
+    for separator in ("\n", " "):
+        cut = buffer.rfind(separator, min_cut, chunk_chars)
+        if cut == -1:
+            cut = buffer.find(separator, chunk_chars)
+        if cut != -1:
+            return cut + 1
+    return -1
+
+
+def iter_text_chunks(filename: str, chunk_chars: int, encoding: str | None = None) -> Iterator[str]:
+    """
+    Потоково читает текст из файла ('-' - стандартный ввод), распаковывая .gz/.xz/.zst,
+    и выдает части примерно по chunk_chars символов (синхронно).
+    Часть заканчивается на границе абзаца, при ее отсутствии - строки или слова; без пробелов
+    текст режется по 2 * chunk_chars. Конкатенация частей равна всему тексту.
+    Если encoding не указан, кодировка определяется по началу потока (utf-8 или cp1251),
+    некорректные байты далее заменяются символом '\ufffd'.
+    В памяти одновременно находится не больше 2 * chunk_chars символов.
+    """
+    if filename == "-":
+        stream = sys.stdin.buffer
+    else:
+        stream = _open_decompressed(filename) or open(filename, mode='rb')
+    try:
+        buffer = ""
+        for text in _iter_decoded_blocks(stream, encoding):
+            buffer += text
+            while len(buffer) >= chunk_chars:
+                cut = _find_chunk_cut(buffer, chunk_chars)
+                if cut == -1:
+                    if len(buffer) < 2 * chunk_chars:
+                        break # Ждем границу в следующих блоках
+                    cut = chunk_chars
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        if buffer:
+            yield buffer
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+# --- Запись файлов ---
+# umask процесса (читается один раз при импорте: os.umask меняет его для всех потоков)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _target_permissions(filename: str, permissions: int | None) -> int:
+    """Права результата: заданные, права заменяемого файла или 0o666 с учетом umask (как у open())."""
+    if permissions is not None:
+        return permissions
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+@contextlib.contextmanager
+def open_atomic(filename: str, mode: str = 'w', encoding: str | None = None, permissions: int | None = None) -> Iterator[IO]:
+    """
+    Открывает временный файл с уникальным именем рядом с целевым для записи (синхронно).
+    При выходе из блока без ошибки данные сбрасываются на диск (fsync), временному файлу
+    задаются права (permissions, иначе права прежнего файла или по umask, как у open())
+    и он переименовывается в filename. При ошибке целевой файл не изменяется, а временный удаляется.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode=mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_filename, _target_permissions(filename, permissions))
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+
+def open_text_atomic(filename: str, encoding: str = 'utf-8', permissions: int | None = None) -> contextlib.AbstractContextManager[TextIO]:
+    """Открывает временный файл для атомарной записи текста (см. open_atomic)."""
+    return open_atomic(filename, 'w', encoding, permissions)
+
+
+def write_text_atomic(filename: str, chunks: Iterable[str], encoding: str = 'utf-8') -> None:
+    """
+    Записывает текст по частям во временный файл рядом с целевым и переименовывает его (синхронно).
+    При ошибке целевой файл не изменяется, а временный удаляется.
+    """
+    with open_text_atomic(filename, encoding) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+# --- Загрузка конфигурации ---
+def parse_list_file(text: str) -> list[str]:
+    """Разбирает файл-список: одна запись в строке, комментарии после '#', пустые строки пропускаются."""
+    items = []
+    for line in text.split('\n'):
+        cleaned_line = line.split('#')[0].strip()
+        if cleaned_line:
+            items.append(cleaned_line)
+    return items
+
+
+def default_entities() -> list[str]:
+    """Стандартный список сущностей (все типы с плейсхолдерами), если файл сущностей не найден."""
+    entities = list(ENTITY_PLACEHOLDERS.keys())
+    if "DEFAULT" in entities:
+        entities.remove("DEFAULT")
+    return entities
+
+
+async def read_entities_file(filename: str) -> list[str]:
+    """Читает список сущностей из файла. Ошибки чтения (в том числе FileNotFoundError) пробрасываются."""
+    return parse_list_file(await asyncio.to_thread(read_text, filename))
+
+
+async def read_exceptions_file(filename: str) -> set[str]:
+    """Читает исключения из файла (в нижнем регистре). Ошибки чтения (в том числе FileNotFoundError) пробрасываются."""
+    return {item.lower() for item in parse_list_file(await asyncio.to_thread(read_text, filename))}
+
+
+async def load_entities_to_process(filename: str) -> list[str]:
+    """Загружает список сущностей для обработки из файла (асинхронно, одним чтением)."""
+    try:
+        entities = await read_entities_file(filename)
         if not entities:
              logging.warning(f"Файл сущностей '{filename}' пуст или содержит только комментарии.")
         logging.info(f"Загружены сущности для обработки из '{filename}': {entities}")
         return entities
     except FileNotFoundError:
         logging.warning(f"Файл со списком сущностей '{filename}' не найден.")
-        default_entities = list(ENTITY_PLACEHOLDERS.keys())
-        if "DEFAULT" in default_entities:
-            default_entities.remove("DEFAULT")
-        logging.warning(f"Используется стандартный список сущностей: {default_entities}")
-        return default_entities
+        entities = default_entities()
+        logging.warning(f"Используется стандартный список сущностей: {entities}")
+        return entities
     except Exception as e:
         logging.error(f"Ошибка при чтении файла сущностей '{filename}': {e}")
         return []
 
-async def load_exceptions(filename: str) -> set[str]: # <-- async def
-    """Загружает список исключений из файла (в нижнем регистре, асинхронно)."""
+async def load_exceptions(filename: str) -> set[str]:
+    """Загружает список исключений из файла (в нижнем регистре, асинхронно, одним чтением)."""
     exceptions = set()
     try:
-        # Используем async with и aiofiles.open
-        async with aiofiles.open(filename, mode='r', encoding='utf-8') as f:
-            # Используем async for
-            async for line in f:
-                cleaned_line = line.split('#')[0].strip()
-                if cleaned_line:
-                    exceptions.add(cleaned_line.lower())
+        exceptions = await read_exceptions_file(filename)
         logging.info(f"Загружены исключения из '{filename}' ({len(exceptions)} шт.): {exceptions if len(exceptions) < 10 else str(list(exceptions)[:10])+'...'}")
     except FileNotFoundError:
         logging.info(f"Файл исключений '{filename}' не найден. Исключения не используются.")
     except Exception as e:
         logging.error(f"Ошибка при чтении файла исключений '{filename}': {e}")
-    return exceptions
\ No newline at end of file
+    return exceptions
@@ -0,0 +1,206 @@
+# known_entities.py
+"""
+Словарь известных сущностей, накапливаемый между документами.
+Подтвержденные (прошедшие все фильтры) PERSON/ORG/LOCATION сохраняются вместе с
+типом и частотой, компилируются в один многошаблонный поиск и размечаются
+в новом документе до запуска NER-моделей.
+Словарь пополняется только результатами NER и regex-распознавателей: собственные
+результаты словаря и распространенные вхождения частоту не увеличивают, иначе
+ложное срабатывание подтверждало бы само себя в каждом документе.
+ВНИМАНИЕ: файл словаря содержит исходные формы найденных персональных данных в открытом виде.
+"""
+import json
+import logging
+import threading
+import time
+
+from presidio_analyzer import RecognizerResult
+
+from entity_propagation import PROPAGATION_RECOGNIZER_NAME
+from file_utils import open_text_atomic
+from text_utils import compile_phrase_matcher
+
+KNOWN_ENTITY_RECOGNIZER_NAME = "KnownEntityRecognizer"
+KNOWN_ENTITY_TYPES = {"PERSON", "ORG", "LOCATION"}
+MIN_SURFACE_LENGTH = 3
+# Права файла словаря: только владелец (в файле - исходные персональные данные)
+FILE_PERMISSIONS = 0o600
+# Результаты этих распознавателей не считаются независимым подтверждением формы
+NOT_LEARNED_RECOGNIZER_NAMES = {KNOWN_ENTITY_RECOGNIZER_NAME, PROPAGATION_RECOGNIZER_NAME}
+
+
+class KnownEntityDictionary:
+    """
+    Ограниченный по размеру словарь поверхностных форм сущностей.
+    Хранится в JSON-файле: {"entities": {форма: {"types": {тип: частота}, "count": частота, "last_seen": время}}, "stats": {...}}.
+    При переполнении вытесняются самые редкие формы, при равной частоте - давно не встречавшиеся.
+    """
+
+    def __init__(self, filename: str, max_size: int, min_count: int, score: float):
+        self.filename = filename
+        self.max_size = max_size
+        self.min_count = min_count
+        self.score = score
+        self.entities: dict[str, dict] = {}
+        self.stats = {"documents": 0, "matches": 0, "confirmed_matches": 0, "final_spans": 0, "evicted": 0}
+        self._matcher = None
+        self._matcher_dirty = True
+        self._unsaved = False
+        # Поиск и обучение могут выполняться из нескольких потоков (сервер с потоками запросов)
+        self._lock = threading.Lock()
+
+    # --- Хранение ---
+    def load(self) -> None:
+        """Загружает словарь из файла (отсутствующий файл - пустой словарь)."""
+        logger = logging.getLogger()
+        try:
+            with open(self.filename, mode='r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entities = data.get("entities", {})
+            self.stats.update(data.get("stats", {}))
+            logger.info(f"Загружен словарь известных сущностей из '{self.filename}' ({len(self.entities)} форм).")
+        except FileNotFoundError:
+            logger.info(f"Файл словаря известных сущностей '{self.filename}' не найден. Начинаем с пустого словаря.")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении словаря известных сущностей '{self.filename}': {e}")
+        self._matcher_dirty = True
+
+    def save(self) -> None:
+        """
+        Сохраняет словарь в файл атомарно (уникальный временный файл и переименование), если он изменился.
+        Файл содержит персональные данные, поэтому доступен только владельцу.
+        """
+        try:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                with open_text_atomic(self.filename, permissions=FILE_PERMISSIONS) as f:
+                    json.dump({"entities": self.entities, "stats": self.stats}, f, ensure_ascii=False)
+                self._unsaved = False
+        except Exception as e:
+            logging.getLogger().error(f"Ошибка при сохранении словаря известных сущностей '{self.filename}': {e}")
+
+    # --- Поиск ---
+    def _get_matcher(self):
+        """Возвращает скомпилированный поиск по формам с частотой не ниже min_count."""
+        with self._lock:
+            if self._matcher_dirty:
+                phrases = [surface for surface, entry in self.entities.items() if entry["count"] >= self.min_count]
+                self._matcher = compile_phrase_matcher(phrases)
+                self._matcher_dirty = False
+                logging.getLogger().debug(f"Словарь известных сущностей скомпилирован: {len(phrases)} форм.")
+            return self._matcher
+
+    @staticmethod
+    def _main_type(entry: dict) -> str:
+        return max(entry["types"].items(), key=lambda item: item[1])[0]
+
+    def find(self, text: str, entities: list[str]) -> list[RecognizerResult]:
+        """Размечает известные сущности запрошенных типов за один проход по тексту."""
+        matcher = self._get_matcher()
+        with self._lock:
+            self.stats["documents"] += 1
+            self._unsaved = True
+        if matcher is None:
+            return []
+
+        allowed_types = set(entities) & KNOWN_ENTITY_TYPES
+        results = []
+        for match in matcher.finditer(text):
+            entry = self.entities.get(match.group())
+            if entry is None:
+                continue
+            entity_type = self._main_type(entry)
+            if entity_type not in allowed_types:
+                continue
+            explanation = {
+                "recognizer_name": KNOWN_ENTITY_RECOGNIZER_NAME,
+                "original_score": self.score,
+                "text": match.group(),
+                "known_count": entry["count"]
+            }
+            results.append(RecognizerResult(
+                entity_type=entity_type,
+                start=match.start(),
+                end=match.end(),
+                score=self.score,
+                analysis_explanation=explanation
+            ))
+        with self._lock:
+            self.stats["matches"] += len(results)
+        return results
+
+    # --- Обучение ---
+    @staticmethod
+    def _is_learned_from(result: RecognizerResult) -> bool:
+        """Подтверждает ли результат форму: собственные и распространенные результаты не учитываются."""
+        explanation = result.analysis_explanation
+        if isinstance(explanation, dict):
+            return explanation.get("recognizer_name") not in NOT_LEARNED_RECOGNIZER_NAMES
+        return True
+
+    def learn(self, text: str, final_results: list[RecognizerResult], known_results: list[RecognizerResult]) -> None:
+        """
+        Добавляет подтвержденные формы из финальных результатов документа
+        (только найденные NER и regex-распознавателями) и обновляет метрики попаданий словаря.
+        """
+        logger = logging.getLogger()
+        known_spans = {(res.start, res.end) for res in known_results}
+        seen_in_document = set()
+        final_count = 0
+        confirmed_count = 0
+        now = time.time()
+
+        with self._lock:
+            for result in final_results:
+                if result.entity_type not in KNOWN_ENTITY_TYPES:
+                    continue
+                final_count += 1
+                if (result.start, result.end) in known_spans:
+                    confirmed_count += 1
+                if not self._is_learned_from(result):
+                    continue
+
+                surface = text[result.start:result.end].strip()
+                if len(surface) < MIN_SURFACE_LENGTH or "\n" in surface or (surface, result.entity_type) in seen_in_document:
+                    continue
+                seen_in_document.add((surface, result.entity_type))
+
+                entry = self.entities.setdefault(surface, {"types": {}, "count": 0})
+                entry["types"][result.entity_type] = entry["types"].get(result.entity_type, 0) + 1
+                entry["count"] += 1
+                entry["last_seen"] = now
+                if entry["count"] == self.min_count:
+                    self._matcher_dirty = True
+
+            self.stats["final_spans"] += final_count
+            self.stats["confirmed_matches"] += confirmed_count
+            self._unsaved = True
+            self._evict()
+
+        hit_rate = confirmed_count / final_count if final_count else 0.0
+        total_hit_rate = self.stats["confirmed_matches"] / self.stats["final_spans"] if self.stats["final_spans"] else 0.0
+        logger.info(
+            f"Словарь известных сущностей: {len(self.entities)} форм, попаданий в документе {confirmed_count}/{final_count} "
+            f"({hit_rate:.1%}), всего {total_hit_rate:.1%} за {self.stats['documents']} документов."
+        )
+
+    def _evict(self) -> None:
+        """
+        Вытесняет самые редкие формы, если размер словаря превышен (с запасом 10%).
+        При равной частоте вытесняются давно не встречавшиеся формы, чтобы новые формы
+        успевали набрать KNOWN_ENTITY_MIN_COUNT подтверждений.
+        """
+        if len(self.entities) <= self.max_size:
+            return
+        target_size = int(self.max_size * 0.9)
+        by_frequency = sorted(
+            self.entities.items(),
+            key=lambda item: (item[1]["count"], item[1].get("last_seen", 0.0)),
+            reverse=True
+        )
+        evicted = len(self.entities) - target_size
+        self.entities = dict(by_frequency[:target_size])
+        self.stats["evicted"] += evicted
+        self._matcher_dirty = True
+        logging.getLogger().info(f"Словарь известных сущностей: вытеснено {evicted} редких форм.")
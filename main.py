@@ -30,18 +30,23 @@ logger = logging.getLogger()
 # Импортируем остальные зависимости
 try:
     import spacy
-    import stanza
+    import config
     from config import (
         INPUT_FILENAME, OUTPUT_FILENAME, ENTITIES_FILENAME, EXCEPTIONS_FILENAME,
         LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN,
-        USE_GPU
+        USE_GPU, WATCH_MODE, WATCH_POLL_INTERVAL,
+        BATCH_INPUT_DIR, BATCH_OUTPUT_DIR, BATCH_INPUT_SUFFIXES, BATCH_MANIFEST_FILENAME,
+        BATCH_MAX_ATTEMPTS, BATCH_PROGRESS_INTERVAL, PIPELINE_QUEUE_SIZE
     )
     # Импортируем асинхронные версии функций
     from file_utils import load_entities_to_process, load_exceptions # <-- Теперь это async функции
-    from anonymizer_logic import anonymize_text_file # <-- Теперь это async функция
+    from anonymizer_logic import anonymize_text_file, save_known_entity_dictionary # <-- Теперь это async функция
+    from model_loader import load_models_parallel
+    from batch_runner import run_batch
+    from config_watcher import ConfigWatcher, file_state
 except ImportError as import_error:
     logger.critical(f"Ошибка импорта необходимой библиотеки: {import_error}")
-    logger.critical("Убедитесь, что установлены 'spacy', 'stanza', 'presidio-analyzer', 'presidio-anonymizer', 'aiofiles'.") # <-- Добавлено aiofiles
+    logger.critical("Убедитесь, что установлены 'spacy', 'stanza', 'presidio-analyzer', 'presidio-anonymizer'.")
     logger.critical("Пожалуйста, установите зависимости из файла requirements.txt: pip install -r requirements.txt")
     logger.critical("Убедитесь, что установлены модели spaCy и Stanza!")
     exit(1)
@@ -74,63 +79,49 @@ def setup_spacy_device():
         except Exception as e:
             logger.error(f"Не удалось явно указать CPU для spaCy: {e}")
 
-# --- Проверка моделей (остается синхронной) ---
-def check_models() -> bool:
-    """Проверяет наличие необходимых NLP моделей."""
-    stanza_ok = False
-    spacy_ru_ok = False
-    spacy_en_ok = False
+# --- Проверка моделей (загрузка выполняется параллельно в model_loader) ---
+def check_models(models: dict) -> bool:
+    """Проверяет результаты параллельной загрузки NLP моделей."""
+    errors = models["errors"]
 
-    logger.info("Проверка наличия NLP моделей...")
-    logger.info(f"Настройка USE_GPU в config.py: {USE_GPU}")
-
-    # Проверка Stanza (синхронно)
-    try:
-        logger.info(f"Проверка Stanza для языка '{LANGUAGE_CODE}'...")
-        stanza.Pipeline(lang=LANGUAGE_CODE, processors='tokenize,ner', logging_level='WARN', use_gpu=USE_GPU, download_method=None)
+    # Проверка Stanza
+    stanza_error = errors.get("stanza")
+    stanza_ok = stanza_error is None
+    if stanza_ok:
         logger.info(f"Модель Stanza (с NER) для языка '{LANGUAGE_CODE}' найдена и инициализирована.")
-        stanza_ok = True
-    except FileNotFoundError:
+    elif isinstance(stanza_error, FileNotFoundError):
          logger.error(f"Модель Stanza для языка '{LANGUAGE_CODE}' не найдена или не содержит NER.")
          logger.error(f"Пожалуйста, загрузите модель. Выполните в Python: import stanza; stanza.download('{LANGUAGE_CODE}')")
-         stanza_ok = False
-    except ImportError:
+    elif isinstance(stanza_error, ImportError):
          logger.error(f"Ошибка импорта при инициализации Stanza. Возможно, проблема с CUDA при USE_GPU=True.")
          logger.error("Попробуйте установить USE_GPU = False в config.py или проверьте установку CUDA.")
-         stanza_ok = False
-    except Exception as e:
-        logger.error(f"Не удалось проверить модель Stanza для языка '{LANGUAGE_CODE}'. Ошибка: {e}", exc_info=True)
-        stanza_ok = False
+    else:
+        logger.error(f"Не удалось проверить модель Stanza для языка '{LANGUAGE_CODE}'. Ошибка: {stanza_error}", exc_info=stanza_error)
 
-    # Проверка spaCy ru (синхронно)
-    try:
-        logger.info(f"Проверка spaCy модели '{SPACY_MODEL_RU}'...")
-        nlp = spacy.load(SPACY_MODEL_RU)
+    # Проверка spaCy ru
+    spacy_ru_error = errors.get("spacy_engine")
+    spacy_ru_ok = spacy_ru_error is None
+    if spacy_ru_ok:
         logger.info(f"Модель spaCy '{SPACY_MODEL_RU}' успешно загружена.")
-        spacy_ru_ok = True
-        del nlp
-    except OSError:
+    elif isinstance(spacy_ru_error, OSError):
         logger.error(f"Не удалось загрузить модель spaCy '{SPACY_MODEL_RU}'.")
         logger.error(f"Пожалуйста, загрузите модель. Выполните: python -m spacy download {SPACY_MODEL_RU}")
-        spacy_ru_ok = False
-    except Exception as e:
-         logger.error(f"Ошибка при проверке модели spaCy '{SPACY_MODEL_RU}': {e}", exc_info=True)
-         spacy_ru_ok = False
+    else:
+         logger.error(f"Ошибка при проверке модели spaCy '{SPACY_MODEL_RU}': {spacy_ru_error}", exc_info=spacy_ru_error)
 
-    # Проверка spaCy en (синхронно)
-    try:
-        logger.info(f"Проверка spaCy модели '{SPACY_MODEL_EN}'...")
-        nlp_en = spacy.load(SPACY_MODEL_EN)
+    # Проверка spaCy en (не критична)
+    spacy_en_error = errors.get("spacy_en")
+    if spacy_en_error is None:
         logger.info(f"Модель spaCy '{SPACY_MODEL_EN}' найдена.")
-        spacy_en_ok = True
-        del nlp_en
-    except OSError:
+    elif isinstance(spacy_en_error, OSError):
         logger.warning(f"Не удалось загрузить модель spaCy '{SPACY_MODEL_EN}'.")
         logger.warning(f"Для некоторых функций Presidio может потребоваться. Выполните: python -m spacy download {SPACY_MODEL_EN}")
-        spacy_en_ok = True
-    except Exception as e:
-         logger.warning(f"Ошибка при проверке модели spaCy '{SPACY_MODEL_EN}': {e}")
-         spacy_en_ok = True
+    else:
+         logger.warning(f"Ошибка при проверке модели spaCy '{SPACY_MODEL_EN}': {spacy_en_error}")
+
+    # Natasha (не критична: без нее этап Natasha NER пропускается)
+    if not models["natasha"]:
+        logger.warning("Компоненты Natasha не инициализированы. Этап Natasha NER будет пропущен.")
 
     if not (stanza_ok and spacy_ru_ok):
         logger.error("Отсутствуют или не удалось инициализировать критически важные NLP модели (Stanza ru или SpaCy ru).")
@@ -139,6 +130,53 @@ def check_models() -> bool:
     logger.info("Проверка моделей завершена.")
     return True
 
+# --- Режим наблюдения: обработка входного файла при изменении, горячая перезагрузка конфигурации ---
+async def watch_async(models: dict):
+    """
+    Долгоживущий режим: модели загружаются один раз, конфигурация перезагружается
+    при изменении файлов, INPUT_FILENAME обрабатывается при каждом изменении.
+    Завершается по Ctrl+C.
+    """
+    watcher = ConfigWatcher(
+        ENTITIES_FILENAME, EXCEPTIONS_FILENAME, os.path.abspath(config.__file__),
+        LANGUAGE_CODE, SPACY_MODEL_RU,
+        nlp_engine=models["spacy_engine"], en_nlp=models["spacy_en"]
+    )
+    if await watcher.load() is None:
+        raise RuntimeError("Empty entity list")
+    watcher_task = asyncio.create_task(watcher.run(WATCH_POLL_INTERVAL))
+
+    logger.progress(f"Режим наблюдения: ожидание изменений '{INPUT_FILENAME}' (опрос каждые {WATCH_POLL_INTERVAL} сек., Ctrl+C для выхода)...")
+    last_input_state = None
+    try:
+        while True:
+            input_state = file_state(INPUT_FILENAME)
+            if input_state is not None and input_state != last_input_state:
+                last_input_state = input_state
+                # Документ обрабатывается на снимке конфигурации, актуальном на момент начала
+                snapshot = watcher.snapshot
+                logger.progress(f"Обработка '{INPUT_FILENAME}' (конфигурация версии {snapshot['version']})...")
+                try:
+                    succeeded = await anonymize_text_file(
+                        input_file=INPUT_FILENAME,
+                        output_file=OUTPUT_FILENAME,
+                        entities_to_process=snapshot["entities"],
+                        exceptions_list=snapshot["exceptions"],
+                        language=LANGUAGE_CODE,
+                        spacy_model=SPACY_MODEL_RU,
+                        bundle=snapshot["bundle"]
+                    )
+                    if succeeded:
+                        logger.progress("Обработка завершена. Ожидание следующих изменений...")
+                    else:
+                        logger.error(f"Не удалось обработать '{INPUT_FILENAME}' (см. ошибки выше). Ожидание следующих изменений...")
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке '{INPUT_FILENAME}': {e}", exc_info=True)
+            await asyncio.sleep(WATCH_POLL_INTERVAL)
+    finally:
+        watcher_task.cancel()
+
+
 # --- Новая основная асинхронная функция ---
 async def main_async(): # <-- async def
     logger.progress("="*20 + " Запуск скрипта анонимизации " + "="*20)
@@ -146,12 +184,19 @@ async def main_async(): # <-- async def
     # Настраиваем устройство ДО проверки моделей (синхронно)
     setup_spacy_device()
 
-    # 1. Проверка наличия моделей (синхронно)
-    if not check_models():
+    # 1. Параллельная загрузка и проверка моделей
+    logger.info("Проверка наличия NLP моделей...")
+    logger.info(f"Настройка USE_GPU в config.py: {USE_GPU}")
+    models = await load_models_parallel(LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN, USE_GPU)
+    if not check_models(models):
         logger.critical("Не удалось загрузить или инициализировать необходимые NLP модели. Завершение работы.")
         # В асинхронной функции нельзя использовать sys.exit(1), лучше выбросить исключение
         raise RuntimeError("Model check failed")
 
+    if WATCH_MODE:
+        await watch_async(models)
+        return
+
     # 2. Загрузка конфигурации из файлов (асинхронно)
     logger.info("Загрузка конфигурации...")
     # Используем await для асинхронных функций
@@ -163,24 +208,47 @@ async def main_async(): # <-- async def
         logger.error("Список сущностей для обработки пуст. Анонимизация невозможна.")
         raise RuntimeError("Empty entity list")
 
-    # 4. Запуск основного процесса анонимизации (асинхронно)
+    # 4. Пакетная обработка каталога конвейером с манифестом заданий (если задан BATCH_INPUT_DIR)
+    if BATCH_INPUT_DIR:
+        counts = await run_batch(
+            BATCH_INPUT_DIR, BATCH_OUTPUT_DIR, BATCH_MANIFEST_FILENAME,
+            entities_to_process, exceptions_list, LANGUAGE_CODE, SPACY_MODEL_RU,
+            suffixes=BATCH_INPUT_SUFFIXES,
+            max_attempts=BATCH_MAX_ATTEMPTS,
+            progress_interval=BATCH_PROGRESS_INTERVAL,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            nlp_engine=models["spacy_engine"],
+            en_nlp=models["spacy_en"]
+        )
+        if counts.get("failed"):
+            logger.error(f"Файлов с ошибками после всех попыток: {counts['failed']} (см. манифест '{BATCH_MANIFEST_FILENAME}').")
+        logger.progress("="*20 + " Скрипт анонимизации завершил работу " + "="*20)
+        return
+
+    # 5. Запуск основного процесса анонимизации (асинхронно)
     logger.progress("Запуск основного процесса анонимизации...")
     try:
         # Используем await для асинхронной функции
-        await anonymize_text_file(
+        succeeded = await anonymize_text_file(
             input_file=INPUT_FILENAME,
             output_file=OUTPUT_FILENAME,
             entities_to_process=entities_to_process,
             exceptions_list=exceptions_list,
             language=LANGUAGE_CODE,
-            spacy_model=SPACY_MODEL_RU
+            spacy_model=SPACY_MODEL_RU,
+            nlp_engine=models["spacy_engine"], # Уже загруженная модель spaCy
+            en_nlp=models["spacy_en"] # Английская модель для маршрутизации по письменности (может быть None)
         )
-        logger.progress("Основной процесс анонимизации успешно завершен.")
     except Exception as e:
         # Логируем ошибку внутри асинхронной функции
         logger.critical(f"Критическая ошибка во время выполнения основного процесса анонимизации: {e}", exc_info=True)
         # Перевыбрасываем исключение, чтобы его поймал внешний обработчик
         raise e
+    if not succeeded:
+        # Ошибка уже залогирована в anonymize_text_file; код завершения 1 задает обработчик RuntimeError
+        logger.error(f"Анонимизация '{INPUT_FILENAME}' не выполнена, результат в '{OUTPUT_FILENAME}' не записан.")
+        raise RuntimeError("Anonymization failed")
+    logger.progress("Основной процесс анонимизации успешно завершен.")
 
     logger.progress("="*20 + " Скрипт анонимизации завершил работу " + "="*20)
 
@@ -200,7 +268,11 @@ if __name__ == "__main__":
          exit_code = 1
 
     finally:
-        print("\n-----------------------------------------------------")
-        input("Обработка завершена. Для закрытия окна нажмите Enter...")
-        print("-----------------------------------------------------")
+        # Словарь известных сущностей сохраняется один раз за запуск (в том числе после режима наблюдения)
+        save_known_entity_dictionary()
+        # Ожидание Enter только при запуске в окне консоли (не в скриптах и конвейерах; для них - anonymize.py)
+        if sys.stdin is not None and sys.stdin.isatty():
+            print("\n-----------------------------------------------------")
+            input("Обработка завершена. Для закрытия окна нажмите Enter...")
+            print("-----------------------------------------------------")
         sys.exit(exit_code) # Завершаем скрипт с соответствующим кодом
\ No newline at end of file
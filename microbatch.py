@@ -0,0 +1,89 @@
+# microbatch.py
+"""
+Микропакеты: объединение одновременных вызовов модели из разных потоков в один пакетный вызов.
+Поток, вызвавший submit(), ставит элемент в очередь и ждет результата. Фоновый поток пакетов
+берет первый элемент и добирает следующие, пока не наберется max_batch_size элементов,
+не истечет max_delay секунд или пока не пришли элементы от всех ожидаемых вызывающих
+(expected_items - например, число запросов, занятых анализом): одиночный запрос не ждет.
+Затем process_batch(список элементов) выполняется один раз, и результаты раздаются по вызывающим.
+Фоновый поток создается при первом вызове (в рабочем процессе после fork()).
+"""
+import logging
+import queue
+import threading
+import time
+
+
+class _PendingItem:
+    __slots__ = ("item", "result", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Собирает элементы одновременных вызовов в пакеты для process_batch (список -> список результатов)."""
+
+    def __init__(self, name: str, process_batch, max_batch_size: int, max_delay: float, expected_items=None):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.expected_items = expected_items
+        self.stats = {"batches": 0, "items": 0}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, item):
+        """Обрабатывает элемент в составе пакета и возвращает его результат (исключение пакета пробрасывается)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"microbatch-{self.name}", daemon=True)
+                self._thread.start()
+        pending = _PendingItem(item)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self) -> list[_PendingItem]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            expected = self.expected_items() if self.expected_items is not None else self.max_batch_size
+            remaining = deadline - time.monotonic()
+            if len(batch) >= expected or remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                results = self.process_batch([pending.item for pending in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Пакет '{self.name}': {len(results)} результатов для {len(batch)} элементов")
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                logging.getLogger().error(f"Ошибка обработки пакета '{self.name}' ({len(batch)} элементов): {e}")
+                for pending in batch:
+                    pending.error = e
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            for pending in batch:
+                pending.done.set()
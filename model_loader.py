@@ -0,0 +1,100 @@
+# model_loader.py
+"""
+Параллельная загрузка NLP моделей при старте.
+spaCy, Stanza и Natasha загружаются независимо друг от друга в рабочих потоках,
+поэтому время до обработки первого документа определяется самой медленной моделью,
+а не суммой времен загрузки.
+"""
+import asyncio
+import logging
+import time
+
+import spacy
+import stanza
+from presidio_analyzer.nlp_engine import SpacyNlpEngine
+
+
+def load_spacy_engine(language: str, spacy_model: str) -> SpacyNlpEngine:
+    """Создает SpacyNlpEngine Presidio и загружает в него модель spaCy."""
+    engine = SpacyNlpEngine(models=[{"lang_code": language, "model_name": spacy_model}])
+    if hasattr(engine, "is_loaded") and not engine.is_loaded():
+        engine.load()
+    return engine
+
+
+def check_stanza_model(language: str, use_gpu: bool) -> bool:
+    """
+    Проверяет, что модель Stanza с NER установлена (без скачивания моделей). Конвейер сразу
+    освобождается: в анализе он не используется (StanzaRecognizer читает сущности движка spaCy).
+    """
+    stanza.Pipeline(lang=language, processors='tokenize,ner', logging_level='WARN', use_gpu=use_gpu, download_method=None)
+    return True
+
+
+def load_spacy_model(spacy_model: str):
+    """Загружает модель spaCy по имени."""
+    return spacy.load(spacy_model)
+
+
+def load_natasha(mmap_dir: str | None = None) -> bool:
+    """Инициализирует компоненты Natasha (см. anonymizer_logic.init_natasha)."""
+    from anonymizer_logic import init_natasha
+    return init_natasha(mmap_dir)
+
+
+def _timed_call(func, *args) -> tuple[object, float]:
+    """Вызывает func(*args) и возвращает результат и время выполнения (сек)."""
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+async def load_models_parallel(
+    language: str,
+    spacy_model: str,
+    spacy_model_en: str | None,
+    use_gpu: bool,
+    natasha_mmap_dir: str | None = None
+) -> dict:
+    """
+    Загружает все модели одновременно в отдельных потоках.
+    natasha_mmap_dir - каталог для отображения эмбеддингов Natasha в память (None - обычная загрузка).
+    Возвращает словарь:
+      "spacy_engine", "spacy_en" - загруженные модели (None при ошибке),
+      "stanza", "natasha" - результат проверки Stanza и инициализации Natasha (False при ошибке),
+      "timings" - время загрузки каждой модели (сек),
+      "errors" - исключения по именам моделей.
+    """
+    logger = logging.getLogger()
+    loaders = {
+        "spacy_engine": (load_spacy_engine, language, spacy_model),
+        "stanza": (check_stanza_model, language, use_gpu),
+        "natasha": (load_natasha, natasha_mmap_dir),
+    }
+    if spacy_model_en:
+        loaders["spacy_en"] = (load_spacy_model, spacy_model_en)
+
+    logger.info(f"Параллельная загрузка моделей: {', '.join(loaders)}...")
+    start_time = time.perf_counter()
+    # asyncio.to_thread копирует контекст, поэтому настройка устройства spaCy (require_cpu/prefer_gpu) сохраняется в потоках
+    outcomes = await asyncio.gather(
+        *(asyncio.to_thread(_timed_call, *loader) for loader in loaders.values()),
+        return_exceptions=True
+    )
+    total_time = time.perf_counter() - start_time
+
+    models = {"spacy_engine": None, "stanza": False, "spacy_en": None, "natasha": False, "timings": {}, "errors": {}}
+    for name, outcome in zip(loaders, outcomes):
+        if isinstance(outcome, BaseException):
+            models["errors"][name] = outcome
+            logger.debug(f"Ошибка загрузки модели '{name}': {outcome!r}")
+            continue
+        models[name], models["timings"][name] = outcome
+
+    for name, seconds in sorted(models["timings"].items(), key=lambda item: item[1], reverse=True):
+        logger.info(f"  Загрузка '{name}': {seconds:.2f} сек.")
+    logger.info(
+        f"Модели загружены за {total_time:.2f} сек. "
+        f"(сумма последовательных загрузок: {sum(models['timings'].values()):.2f} сек.)."
+    )
+    return models
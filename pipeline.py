@@ -0,0 +1,235 @@
+# pipeline.py
+"""
+Конвейерная обработка нескольких документов.
+Этапы anonymize_text_file (чтение и сегментация, анализ, разрешение диапазонов, запись)
+выполняются отдельными задачами asyncio, связанными ограниченными очередями:
+документ N+1 читается и сегментируется, пока документ N находится в NER, а результат
+документа N-1 записывается на диск. Ограничение очередей (back-pressure) удерживает
+в памяти не более queue_size документов на каждом стыке этапов.
+Анализ выполняется одной задачей (по одному документу), поэтому модели не используются
+конкурентно, а словарь известных сущностей пополняется в том же порядке, что и при
+последовательной обработке.
+Тем же конвейером обрабатывается поток текста, разрезанный на части (anonymize.py):
+части проходят этапы как отдельные документы, а результат пишется в один выходной поток.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Awaitable, Callable, Iterator, TextIO
+
+from anonymizer_logic import read_document, analyze_document, resolve_replacements, write_document, save_document_spans
+from config import SAVE_STANDOFF_SPANS, STREAM_CHUNK_SIZE
+from docx_processor import is_docx, anonymize_docx_file
+from replacement_engine import SpanReplacementEngine
+from text_utils import iter_post_processed_text, segment_sentences
+
+# Признак конца потока документов в очереди
+_END = None
+
+
+async def _run_stage(
+    name: str,
+    func: Callable[[dict], None],
+    source: asyncio.Queue,
+    target: asyncio.Queue | None,
+    stage_times: dict[str, float],
+    on_item: Callable[[dict], Awaitable[None]] | None = None
+) -> None:
+    """
+    Берет документы из source, выполняет func(item) в рабочем потоке и передает их в target.
+    Документ с ошибкой проходит дальше без обработки, чтобы о нем узнал последний этап.
+    """
+    logger = logging.getLogger()
+    while True:
+        item = await source.get()
+        if item is _END:
+            if target is not None:
+                await target.put(_END)
+            return
+        if item["error"] is None:
+            start_time = time.perf_counter()
+            try:
+                await asyncio.to_thread(func, item)
+            except Exception as e:
+                item["error"] = f"{type(e).__name__}: {e}"
+                logger.error(f"Ошибка на этапе '{name}' для '{item['input_file']}': {e}")
+            stage_times[name] += time.perf_counter() - start_time
+        if on_item is not None:
+            await on_item(item)
+        if target is not None:
+            await target.put(item)
+
+
+async def anonymize_files_pipelined(
+    jobs: list[tuple[str, str]],
+    bundle: dict,
+    exceptions_list: set[str],
+    queue_size: int,
+    on_start: Callable[[str], Awaitable[None]] | None = None,
+    on_finish: Callable[[str, bool, str | None], Awaitable[None]] | None = None
+) -> dict[str, bool]:
+    """
+    Анонимизирует документы jobs [(входной файл, выходной файл)] конвейером.
+    on_start(input_file) вызывается перед чтением документа,
+    on_finish(input_file, succeeded, error) - после записи результата или ошибки.
+    Возвращает input_file -> True, если результат записан.
+    """
+    logger = logging.getLogger()
+    replacement_engine = SpanReplacementEngine()
+    stage_times = {"чтение": 0.0, "анализ": 0.0, "диапазоны": 0.0, "запись": 0.0}
+    outcomes = {}
+
+    # Документ .docx читается и записывается потоково по абзацам, поэтому целиком выполняется на этапе анализа
+    def read_stage(item: dict) -> None:
+        if not item["docx"]:
+            item["text"], item["sentences"] = read_document(item["input_file"])
+
+    def analyze_stage(item: dict) -> None:
+        if item["docx"]:
+            anonymize_docx_file(item["input_file"], item["output_file"], bundle, exceptions_list)
+            return
+        item["results"] = analyze_document(item["text"], item["sentences"], bundle, exceptions_list)
+        item["sentences"] = None
+
+    def resolve_stage(item: dict) -> None:
+        if not item["docx"]:
+            item["pieces"] = resolve_replacements(item["text"], item["results"], bundle["entities"], replacement_engine, bundle["operators"])
+
+    def write_stage(item: dict) -> None:
+        if item["docx"]:
+            return
+        write_document(item["output_file"], item["pieces"])
+        if SAVE_STANDOFF_SPANS:
+            save_document_spans(item["output_file"], item["text"], item["results"], bundle["entities"])
+        item["text"] = item["pieces"] = item["results"] = None
+
+    async def finish(item: dict) -> None:
+        succeeded = item["error"] is None
+        outcomes[item["input_file"]] = succeeded
+        if on_finish is not None:
+            await on_finish(item["input_file"], succeeded, item["error"])
+
+    async def produce(target: asyncio.Queue) -> None:
+        for input_file, output_file in jobs:
+            if on_start is not None:
+                await on_start(input_file)
+            await target.put({"input_file": input_file, "output_file": output_file, "docx": is_docx(input_file), "error": None})
+        await target.put(_END)
+
+    read_queue, analyze_queue, resolve_queue, write_queue = (asyncio.Queue(maxsize=queue_size) for _ in range(4))
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        produce(read_queue),
+        _run_stage("чтение", read_stage, read_queue, analyze_queue, stage_times),
+        _run_stage("анализ", analyze_stage, analyze_queue, resolve_queue, stage_times),
+        _run_stage("диапазоны", resolve_stage, resolve_queue, write_queue, stage_times),
+        _run_stage("запись", write_stage, write_queue, None, stage_times, on_item=finish)
+    )
+    total_time = time.perf_counter() - start_time
+    logger.info(
+        f"Конвейер: {len(jobs)} документов за {total_time:.2f} сек. (суммарно по этапам: "
+        + ", ".join(f"{name} {seconds:.2f}" for name, seconds in stage_times.items()) + " сек.)"
+    )
+    return outcomes
+
+
+async def anonymize_chunks_pipelined(
+    chunks: Iterator[str],
+    output: TextIO,
+    bundle: dict,
+    exceptions_list: set[str],
+    queue_size: int
+) -> dict[str, int]:
+    """
+    Анонимизирует поток частей текста chunks (см. file_utils.iter_text_chunks) конвейером
+    и пишет результат в output по мере готовности, в порядке частей.
+    Пост-обработка выполняется одним потоком по всем частям, поэтому результат на стыках
+    частей такой же, как при обработке текста целиком. Часть с ошибкой в output не пишется
+    (исходный текст не выводится). В памяти находится не больше queue_size частей на каждом стыке этапов.
+    Возвращает счетчики: chunks - прочитано частей, chars - символов, failed - частей с ошибкой.
+    Ошибка чтения chunks или записи в output выбрасывается после остановки конвейера.
+    """
+    logger = logging.getLogger()
+    replacement_engine = SpanReplacementEngine()
+    stage_times = {"сегментация": 0.0, "анализ": 0.0, "диапазоны": 0.0, "запись": 0.0}
+    counts = {"chunks": 0, "chars": 0, "failed": 0}
+    # Фрагменты частей передаются одному потоку записи, в котором работает потоковая пост-обработка
+    pieces_queue = queue.Queue(maxsize=queue_size)
+    queue_finished = threading.Event()
+    errors = []
+
+    def segment_stage(item: dict) -> None:
+        item["sentences"] = segment_sentences(item["text"])
+
+    def analyze_stage(item: dict) -> None:
+        item["results"] = analyze_document(item["text"], item["sentences"], bundle, exceptions_list)
+        item["sentences"] = None
+
+    def resolve_stage(item: dict) -> None:
+        item["pieces"] = resolve_replacements(item["text"], item["results"], bundle["entities"], replacement_engine, bundle["operators"])
+
+    def write_stage(item: dict) -> None:
+        pieces_queue.put(item["pieces"])
+        item["text"] = item["pieces"] = item["results"] = None
+
+    async def count_failed(item: dict) -> None:
+        if item["error"] is not None:
+            counts["failed"] += 1
+
+    def iter_pieces() -> Iterator[str]:
+        while True:
+            pieces = pieces_queue.get()
+            if pieces is _END:
+                queue_finished.set()
+                return
+            yield from pieces
+
+    def write_output() -> None:
+        try:
+            for chunk in iter_post_processed_text(iter_pieces(), chunk_size=STREAM_CHUNK_SIZE):
+                output.write(chunk)
+                output.flush()
+        except Exception as e:
+            errors.append(e)
+            # Очередь вычитывается до конца, чтобы этап записи не заблокировался
+            while not queue_finished.is_set() and pieces_queue.get() is not _END:
+                pass
+
+    async def produce(target: asyncio.Queue) -> None:
+        try:
+            while not errors: # После ошибки записи (например, закрыт stdout) чтение прекращается
+                text = await asyncio.to_thread(next, chunks, None)
+                if text is None:
+                    break
+                counts["chunks"] += 1
+                counts["chars"] += len(text)
+                await target.put({"input_file": f"часть {counts['chunks']}", "text": text, "error": None})
+        except Exception as e:
+            errors.append(e)
+        finally:
+            await target.put(_END)
+
+    async def write_all(source: asyncio.Queue) -> None:
+        await _run_stage("запись", write_stage, source, None, stage_times, on_item=count_failed)
+        await asyncio.to_thread(pieces_queue.put, _END)
+
+    segment_queue, analyze_queue, resolve_queue, write_queue = (asyncio.Queue(maxsize=queue_size) for _ in range(4))
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        produce(segment_queue),
+        _run_stage("сегментация", segment_stage, segment_queue, analyze_queue, stage_times),
+        _run_stage("анализ", analyze_stage, analyze_queue, resolve_queue, stage_times),
+        _run_stage("диапазоны", resolve_stage, resolve_queue, write_queue, stage_times),
+        write_all(write_queue),
+        asyncio.to_thread(write_output)
+    )
+    total_time = time.perf_counter() - start_time
+    logger.info(
+        f"Конвейер: {counts['chunks']} частей ({counts['chars']} символов) за {total_time:.2f} сек. (суммарно по этапам: "
+        + ", ".join(f"{name} {seconds:.2f}" for name, seconds in stage_times.items()) + " сек.)"
+    )
+    if errors:
+        raise errors[0]
+    return counts
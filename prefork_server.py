@@ -0,0 +1,394 @@
+# prefork_server.py
+"""
+HTTP-сервер анонимизации с pre-fork рабочими процессами (только Linux/Unix).
+Родительский процесс один раз загружает модели (spaCy, Stanza, Natasha) и создает анализатор,
+переносит все объекты в постоянное поколение сборщика мусора (gc.freeze) и создает fork()
+SERVER_WORKERS рабочих процессов. Рабочие процессы принимают соединения на общем сокете и
+используют память моделей совместно (copy-on-write): страницы копируются только при записи,
+а сборщик мусора не обходит замороженные объекты и не портит их заголовки.
+Массивы эмбеддингов Natasha дополнительно отображаются в память из NATASHA_MMAP_DIR.
+С SERVER_SCHEDULER рабочий процесс принимает запросы в потоках, а части документов получают
+слоты анализа в порядке оценки стоимости (scheduler.py): длинный документ не задерживает короткие.
+С SERVER_MICRO_BATCHING вызовы NER-моделей одновременно анализируемых частей объединяются
+в общие пакеты (microbatch.py).
+Родительский процесс перезапускает завершившиеся рабочие процессы и периодически
+(и по сигналу SIGUSR1) пишет в журнал уникальную память (USS) каждого рабочего процесса
+в сравнении с независимо загруженными процессами.
+
+Запросы:
+  POST /anonymize - текст в теле запроса (utf-8 или cp1251), ответ - обезличенный текст (utf-8);
+    параметры ?entities=PERSON,ORG&profile=fast переопределяют список сущностей и профиль сервера
+    (наборы для анализа кэшируются get_analysis_bundle и используют общие модели);
+  GET /health - pid рабочего процесса, число обработанных им запросов и состояние планировщика (JSON).
+Запуск: python prefork_server.py --workers 4 --port 8080
+        curl --data-binary @input.txt http://127.0.0.1:8080/anonymize
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+from anonymize import EXIT_OK, EXIT_IO_ERROR, EXIT_SETUP_ERROR, REQUIRED_MODELS, positive_int
+from config import (
+    ENTITIES_FILENAME, EXCEPTIONS_FILENAME, LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN,
+    USE_GPU, PIPELINE_PROFILES, USE_KNOWN_ENTITIES, STREAM_CHUNK_SIZE,
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_REQUEST_BYTES, NATASHA_MMAP_DIR,
+    SERVER_WORKER_TORCH_THREADS, SERVER_MEMORY_REPORT_INTERVAL, SERVER_SCHEDULER, SERVER_SCHEDULER_SLOTS,
+    SERVER_SCHEDULER_MAX_SLOTS_PER_CLIENT, SERVER_SCHEDULER_SHARD_CHARS, SERVER_SCHEDULER_CHARS_PER_SECOND,
+    SERVER_MICRO_BATCHING, SERVER_MICRO_BATCH_SIZE, SERVER_MICRO_BATCH_DELAY
+)
+
+# Поля /proc/<pid>/smaps_rollup (кБ), из которых складывается отчет о памяти
+MEMORY_FIELDS = {"Rss": "rss", "Pss": "pss", "Private_Clean": "uss", "Private_Dirty": "uss"}
+
+
+# --- Память процессов ---
+def read_process_memory(pid: int) -> dict[str, int] | None:
+    """
+    Возвращает память процесса в байтах: rss, pss (доля в общих страницах) и uss (уникальная
+    память - страницы, которые освободятся при завершении процесса). None, если /proc недоступен.
+    """
+    memory = {"rss": 0, "pss": 0, "uss": 0}
+    for filename in (f"/proc/{pid}/smaps_rollup", f"/proc/{pid}/smaps"):
+        try:
+            with open(filename, mode='r') as f:
+                for line in f:
+                    field, _, value = line.partition(":")
+                    if field in MEMORY_FIELDS:
+                        memory[MEMORY_FIELDS[field]] += int(value.split()[0]) * 1024
+            return memory
+        except (OSError, ValueError, IndexError):
+            continue
+    return None
+
+
+def _log_memory_report(worker_pids: list[int]) -> None:
+    """Пишет в журнал память рабочих процессов и оценку экономии относительно независимой загрузки моделей."""
+    logger = logging.getLogger()
+    parent_memory = read_process_memory(os.getpid())
+    workers_memory = {pid: read_process_memory(pid) for pid in worker_pids}
+    if parent_memory is None or any(memory is None for memory in workers_memory.values()):
+        logger.info("Отчет о памяти недоступен (нужен /proc/<pid>/smaps_rollup).")
+        return
+
+    def megabytes(value: int) -> str:
+        return f"{value / 2**20:.0f} МБ"
+
+    for pid, memory in sorted(workers_memory.items()):
+        logger.info(
+            f"  Рабочий процесс {pid}: уникальная память (USS) {megabytes(memory['uss'])}, "
+            f"RSS {megabytes(memory['rss'])}, PSS {megabytes(memory['pss'])}."
+        )
+    # Независимо загруженный процесс занимает примерно столько же, сколько родитель с моделями
+    shared_total = parent_memory["pss"] + sum(memory["pss"] for memory in workers_memory.values())
+    independent_total = len(workers_memory) * parent_memory["rss"]
+    logger.info(
+        f"Память: родитель с моделями - RSS {megabytes(parent_memory['rss'])}; "
+        f"всего с {len(workers_memory)} рабочими процессами (PSS) {megabytes(shared_total)} "
+        f"против ~{megabytes(independent_total)} при независимой загрузке моделей в каждом "
+        f"(экономия ~{megabytes(independent_total - shared_total)})."
+    )
+
+
+# --- Обработка запросов ---
+def _request_bundle(query: dict[str, list[str]], context: dict) -> dict:
+    """
+    Набор для анализа запроса: параметры entities (через запятую) и profile переопределяют
+    настройки сервера. Выбрасывает ValueError при неизвестном профиле или пустом списке сущностей.
+    """
+    from anonymizer_logic import get_analysis_bundle
+
+    profile = query.get("profile", [context["profile"]])[-1]
+    if profile is not None and profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown profile '{profile}', available: {', '.join(PIPELINE_PROFILES)}")
+    entities = context["entities"]
+    if "entities" in query:
+        entities = [entity.strip() for value in query["entities"] for entity in value.split(",") if entity.strip()]
+        if not entities:
+            raise ValueError("Empty entity list")
+    bundle = get_analysis_bundle(
+        entities, LANGUAGE_CODE, SPACY_MODEL_RU,
+        nlp_engine=context["nlp_engine"], en_nlp=context["en_nlp"], profile=profile
+    )
+    if bundle is None:
+        raise ValueError("Analysis is not possible with the requested entities")
+    return bundle
+
+
+def _anonymize_text(text: str, bundle: dict, context: dict) -> str:
+    """Анализ, замена и пост-обработка текста одного запроса."""
+    from anonymizer_logic import analyze_text, resolve_replacements, get_known_entity_dictionary
+    from text_utils import iter_post_processed_text, segment_sentences
+
+    final_results, known_entity_results = analyze_text(text, bundle, context["exceptions"], segment_sentences(text))
+    if USE_KNOWN_ENTITIES:
+        # Словарь пополняется в памяти рабочего процесса и не сохраняется: файл не перезаписывается конкурентно
+        get_known_entity_dictionary().learn(text, final_results, known_entity_results)
+    pieces = resolve_replacements(text, final_results, bundle["entities"], context["replacement_engine"], bundle["operators"])
+    return "".join(iter_post_processed_text(pieces, chunk_size=STREAM_CHUNK_SIZE))
+
+
+class AnonymizeRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов рабочего процесса (соединение закрывается после ответа: HTTP/1.0)."""
+
+    def _send(self, status: int, body: str, content_type: str = "text/plain; charset=utf-8") -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        from anonymizer_logic import micro_batch_stats
+
+        if self.path != "/health":
+            self._send(404, "Not found")
+            return
+        state = {"pid": os.getpid(), "requests": self.server.context["requests"]}
+        if self.server.context["scheduler"] is not None:
+            state["scheduler"] = self.server.context["scheduler"].stats()
+        batch_stats = micro_batch_stats()
+        if batch_stats:
+            state["micro_batches"] = batch_stats
+        self._send(200, json.dumps(state), "application/json")
+
+    def do_POST(self) -> None:
+        from file_utils import decode_text
+
+        url = urlsplit(self.path)
+        if url.path != "/anonymize":
+            self._send(404, "Not found")
+            return
+        try:
+            bundle = _request_bundle(parse_qs(url.query), self.server.context)
+        except ValueError as e:
+            self._send(400, str(e))
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._send(411, "Content-Length required")
+            return
+        if length > SERVER_MAX_REQUEST_BYTES:
+            self._send(413, f"Request body exceeds {SERVER_MAX_REQUEST_BYTES} bytes")
+            return
+
+        start_time = time.perf_counter()
+        text = decode_text(self.rfile.read(length))
+        scheduler = self.server.context["scheduler"]
+        client = self.headers.get("X-Client-Id") or self.client_address[0]
+        try:
+            with scheduler.document(client, len(text)) if scheduler is not None else nullcontext():
+                result = _anonymize_text(text, bundle, self.server.context)
+        except Exception as e:
+            logging.getLogger().error(f"Ошибка обработки запроса ({len(text)} символов): {e}", exc_info=True)
+            self._send(500, "Anonymization failed")
+            return
+        self.server.context["requests"] += 1
+        self._send(200, result)
+        logging.getLogger().info(f"Запрос обработан: {len(text)} символов за {time.perf_counter() - start_time:.2f} сек.")
+
+    def log_message(self, format: str, *args) -> None:
+        logging.getLogger().debug(f"{self.address_string()} - {format % args}")
+
+
+class PreforkHTTPServer(HTTPServer):
+    """HTTPServer, сокет которого создается в родительском процессе и принимает соединения во всех рабочих."""
+    request_queue_size = 128
+
+
+class ThreadingPreforkHTTPServer(ThreadingMixIn, PreforkHTTPServer):
+    """PreforkHTTPServer, рабочий процесс которого обрабатывает запросы в потоках (с планировщиком анализа)."""
+    daemon_threads = True
+
+
+# --- Рабочие процессы ---
+def _start_worker(server: PreforkHTTPServer) -> int:
+    """Создает рабочий процесс (fork), обслуживающий server до сигнала SIGTERM. Возвращает его pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(SERVER_WORKER_TORCH_THREADS)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        logging.getLogger().critical("Рабочий процесс завершился с ошибкой.", exc_info=True)
+        exit_code = 1
+    finally:
+        # Рабочий процесс не выполняет завершающий код родителя (atexit, finally выше по стеку)
+        os._exit(exit_code)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HTTP-сервер анонимизации с pre-fork рабочими процессами.")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"Адрес (по умолчанию {SERVER_HOST}).")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"Порт (по умолчанию {SERVER_PORT}).")
+    parser.add_argument("--workers", type=positive_int, default=SERVER_WORKERS, help=f"Число рабочих процессов (по умолчанию {SERVER_WORKERS}).")
+    parser.add_argument("--entities", help="Типы сущностей через запятую (по умолчанию из --entities-file).")
+    parser.add_argument("--entities-file", default=ENTITIES_FILENAME, help=f"Файл со списком сущностей (по умолчанию {ENTITIES_FILENAME}).")
+    parser.add_argument("--exceptions-file", default=EXCEPTIONS_FILENAME, help=f"Файл исключений (по умолчанию {EXCEPTIONS_FILENAME}).")
+    parser.add_argument("--profile", choices=list(PIPELINE_PROFILES), help="Профиль скорость/полнота (по умолчанию PIPELINE_PROFILE из config.py).")
+    parser.add_argument("--no-scheduler", dest="scheduler", action="store_false", default=SERVER_SCHEDULER, help="Обрабатывать запросы по одному, без планировщика.")
+    parser.add_argument("--no-micro-batching", dest="micro_batching", action="store_false", default=SERVER_MICRO_BATCHING, help="Не объединять вызовы NER-моделей одновременных запросов в пакеты.")
+    parser.add_argument("--log-file", help="Писать журнал в файл вместо stderr.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Подробный журнал (DEBUG).")
+    return parser.parse_args()
+
+
+def serve(args: argparse.Namespace) -> int:
+    """Загружает модели, создает рабочие процессы и следит за ними до SIGTERM/SIGINT."""
+    logger = logging.getLogger()
+    from anonymizer_logic import get_analysis_bundle, get_known_entity_dictionary, set_analysis_scheduler, set_micro_batching
+    from file_utils import load_entities_to_process, load_exceptions
+    from model_loader import load_models_parallel
+    from replacement_engine import SpanReplacementEngine
+    from scheduler import AnalysisScheduler
+
+    # --- Модели и анализатор (один раз, в родительском процессе) ---
+    if args.entities:
+        entities_to_process = [entity.strip() for entity in args.entities.split(",") if entity.strip()]
+    else:
+        entities_to_process = asyncio.run(load_entities_to_process(args.entities_file))
+    if not entities_to_process:
+        logger.error("Список сущностей для обработки пуст. Анонимизация невозможна.")
+        return EXIT_SETUP_ERROR
+    exceptions_list = asyncio.run(load_exceptions(args.exceptions_file))
+
+    # asyncio.run завершает пул потоков загрузки: к моменту fork() в процессе нет рабочих потоков
+    models = asyncio.run(load_models_parallel(
+        LANGUAGE_CODE, SPACY_MODEL_RU, SPACY_MODEL_EN, USE_GPU,
+        natasha_mmap_dir=NATASHA_MMAP_DIR
+    ))
+    missing_models = [name for name in REQUIRED_MODELS if models["errors"].get(name) is not None]
+    if missing_models:
+        for name in missing_models:
+            logger.error(f"Не удалось загрузить модель '{name}': {models['errors'][name]}")
+        return EXIT_SETUP_ERROR
+    # Набор по умолчанию создается до fork() и попадает в кэш, общий для всех рабочих процессов
+    bundle = get_analysis_bundle(
+        entities_to_process, LANGUAGE_CODE, SPACY_MODEL_RU,
+        nlp_engine=models["spacy_engine"], en_nlp=models["spacy_en"], profile=args.profile
+    )
+    if bundle is None:
+        return EXIT_SETUP_ERROR
+    if USE_KNOWN_ENTITIES:
+        get_known_entity_dictionary() # Загружается до fork(), чтобы рабочие процессы не читали файл сами
+
+    scheduler = None
+    if args.scheduler:
+        # С микропакетами одновременно анализируются столько частей, сколько входит в пакет
+        slots = max(SERVER_SCHEDULER_SLOTS, SERVER_MICRO_BATCH_SIZE) if args.micro_batching else SERVER_SCHEDULER_SLOTS
+        scheduler = AnalysisScheduler(
+            slots, SERVER_SCHEDULER_MAX_SLOTS_PER_CLIENT, SERVER_SCHEDULER_SHARD_CHARS, SERVER_SCHEDULER_CHARS_PER_SECOND
+        )
+        set_analysis_scheduler(scheduler)
+        logger.info(f"Планировщик анализа: {slots} слотов на рабочий процесс, части по ~{SERVER_SCHEDULER_SHARD_CHARS} символов.")
+        if args.micro_batching:
+            set_micro_batching(SERVER_MICRO_BATCH_SIZE, SERVER_MICRO_BATCH_DELAY, lambda: scheduler.stats()["running"])
+            logger.info(f"Микропакеты NER: до {SERVER_MICRO_BATCH_SIZE} частей, сбор не дольше {SERVER_MICRO_BATCH_DELAY * 1000:.0f} мс.")
+    elif args.micro_batching:
+        logger.info("Микропакеты NER не используются: без планировщика запросы обрабатываются по одному.")
+
+    server_class = ThreadingPreforkHTTPServer if scheduler is not None else PreforkHTTPServer
+    try:
+        server = server_class((args.host, args.port), AnonymizeRequestHandler)
+    except OSError as e:
+        logger.error(f"Не удалось открыть {args.host}:{args.port}: {e}")
+        return EXIT_IO_ERROR
+    server.context = {
+        "entities": entities_to_process, "profile": args.profile, "nlp_engine": models["spacy_engine"], "en_nlp": models["spacy_en"],
+        "exceptions": exceptions_list, "replacement_engine": SpanReplacementEngine(), "scheduler": scheduler, "requests": 0
+    }
+
+    # --- Заморозка объектов и создание рабочих процессов ---
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Заморожено объектов для совместного использования рабочими процессами: {gc.get_freeze_count()}.")
+
+    state = {"stop": False, "report": False}
+
+    def request_stop(signum, frame) -> None:
+        state["stop"] = True
+
+    def request_report(signum, frame) -> None:
+        state["report"] = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGUSR1, request_report)
+
+    workers = {_start_worker(server) for _ in range(args.workers)}
+    logger.info(f"Сервер слушает http://{args.host}:{args.port}/anonymize, рабочих процессов: {args.workers} ({', '.join(map(str, sorted(workers)))}).")
+    next_report_time = time.monotonic() + SERVER_MEMORY_REPORT_INTERVAL
+    try:
+        while not state["stop"]:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = 0, 0
+            if pid in workers:
+                workers.discard(pid)
+                if state["stop"]:
+                    break
+                logger.error(f"Рабочий процесс {pid} завершился (код {os.waitstatus_to_exitcode(status)}). Запуск нового...")
+                workers.add(_start_worker(server))
+                continue
+            if state["report"] or time.monotonic() >= next_report_time:
+                state["report"] = False
+                next_report_time = time.monotonic() + SERVER_MEMORY_REPORT_INTERVAL
+                _log_memory_report(sorted(workers))
+            time.sleep(0.5)
+    finally:
+        logger.info("Остановка рабочих процессов...")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        server.server_close()
+    return EXIT_OK
+
+
+def main() -> int:
+    args = _parse_args()
+    handler = logging.FileHandler(args.log_file, encoding='utf-8') if args.log_file else logging.StreamHandler(sys.stderr)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(process)d - %(levelname)s - %(message)s', handlers=[handler]
+    )
+    logger = logging.getLogger()
+    if not hasattr(os, "fork"):
+        logger.error("Режим pre-fork требует fork() и доступен только в Linux/Unix.")
+        return EXIT_SETUP_ERROR
+    try:
+        return serve(args)
+    except ImportError as e:
+        logger.critical(f"Ошибка импорта необходимой библиотеки: {e}. Установите зависимости: pip install -r requirements.txt")
+        return EXIT_SETUP_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
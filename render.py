@@ -0,0 +1,39 @@
+# render.py
+"""
+Повторная замена по сохраненным диапазонам, без загрузки моделей и анализа.
+Используется после изменения ENTITY_PLACEHOLDERS в config.py или для получения
+другого варианта обезличенного текста.
+Запуск: python render.py [входной файл] [--spans файл диапазонов] [--output выходной файл]
+"""
+import argparse
+import logging
+import sys
+import time
+
+from config import INPUT_FILENAME, OUTPUT_FILENAME, STANDOFF_SUFFIX
+from rendering import render_from_spans
+from standoff import standoff_filename
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замена по сохраненным диапазонам без повторного анализа.")
+    parser.add_argument("input", nargs="?", default=INPUT_FILENAME, help="Исходный (не обезличенный) текст.")
+    parser.add_argument("--spans", help=f"Файл диапазонов (по умолчанию {OUTPUT_FILENAME}{STANDOFF_SUFFIX}).")
+    parser.add_argument("--output", default=OUTPUT_FILENAME, help="Куда записать результат.")
+    args = parser.parse_args()
+    spans_file = args.spans or standoff_filename(OUTPUT_FILENAME, STANDOFF_SUFFIX)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start_time = time.perf_counter()
+    try:
+        count = render_from_spans(args.input, spans_file, args.output)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    print(f"Заменено диапазонов: {count}, результат записан в '{args.output}' за {(time.perf_counter() - start_time) * 1000:.1f} мс.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
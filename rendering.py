@@ -0,0 +1,105 @@
+# rendering.py
+"""
+Замена найденных диапазонов на плейсхолдеры и запись результата.
+Модуль не импортирует NLP-модели (spaCy, Stanza, Natasha): его используют и конвейер
+анализа (anonymizer_logic), и повторная замена по сохраненным диапазонам (render.py),
+которая должна запускаться без загрузки моделей.
+"""
+import logging
+from typing import Iterable, Iterator
+
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer.entities import OperatorConfig
+
+from config import ENTITY_PLACEHOLDERS, STREAM_CHUNK_SIZE
+from file_utils import read_text, write_text_atomic
+from replacement_engine import SpanReplacementEngine
+from standoff import load_spans, check_text, spans_to_results
+from text_utils import iter_post_processed_text
+
+
+# --- Операторы замены ---
+def get_anonymizer_operators(entities: list[str]) -> dict[str, OperatorConfig]:
+    """Создает словарь операторов для AnonymizerEngine на основе плейсхолдеров."""
+    logger = logging.getLogger()
+    operators = {}
+    if "DEFAULT" in ENTITY_PLACEHOLDERS and ("DEFAULT" not in entities or not entities):
+        operators["DEFAULT"] = OperatorConfig("replace", {"new_value": ENTITY_PLACEHOLDERS["DEFAULT"]})
+        logger.debug("Добавлен оператор DEFAULT для замены.")
+
+    processed_entities = set()
+    for entity in entities:
+        if entity in processed_entities:
+            continue
+
+        if entity in ENTITY_PLACEHOLDERS:
+            placeholder = ENTITY_PLACEHOLDERS[entity]
+            operators[entity] = OperatorConfig("replace", {"new_value": placeholder})
+            processed_entities.add(entity)
+        elif entity == "DEFAULT" and entity in ENTITY_PLACEHOLDERS:
+             operators["DEFAULT"] = OperatorConfig("replace", {"new_value": ENTITY_PLACEHOLDERS["DEFAULT"]})
+             processed_entities.add(entity)
+        else:
+            known_types = set(ENTITY_PLACEHOLDERS.keys()) | {"PERSON", "LOCATION", "ORG", "DATE_TIME", "NRP",
+                             "EMAIL_ADDRESS", "PHONE_NUMBER", "CREDIT_CARD", "IBAN_CODE", "IP_ADDRESS", "URL",
+                             "RU_QUOTED_DATE", "RU_ADDRESS_PART", "RU_POSTAL_CODE", "RU_IDENTIFIER"}
+            if entity not in known_types:
+                 logger.warning(f"Неизвестный тип сущности '{entity}' обнаружен. Плейсхолдер не будет создан (кроме DEFAULT).")
+            elif entity != "DEFAULT":
+                 logger.warning(f"Сущность '{entity}' не найдена в словаре плейсхолдеров ENTITY_PLACEHOLDERS. Для нее не будет создан оператор замены (кроме DEFAULT, если он активен).")
+            processed_entities.add(entity)
+
+    logger.info(f"Сконфигурированы операторы анонимизации (замена на плейсхолдеры): {list(operators.keys())}")
+    return operators
+
+
+# --- Замена и запись ---
+def resolve_replacements(
+    text: str,
+    final_results: list[RecognizerResult],
+    entities: list[str],
+    replacement_engine: SpanReplacementEngine,
+    operators: dict[str, OperatorConfig] | None = None
+) -> Iterator[str]:
+    """
+    Этап разрешения диапазонов: возвращает фрагменты анонимизированного текста
+    (неизмененные участки и плейсхолдеры) для потоковой пост-обработки и записи.
+    operators - готовые операторы замены для entities (bundle["operators"]); создаются заново,
+    если в результатах есть типы без оператора.
+    """
+    logger = logging.getLogger()
+    if not final_results:
+        logger.info("Сущности для замены (после всех фильтраций) не найдены. Анонимизация не выполняется.")
+        return iter([text])
+
+    logger.info(f"Запуск анонимизации текста... Найдено {len(final_results)} сущностей для замены.")
+    final_entities_in_results = set(res.entity_type for res in final_results)
+    if operators is None or not final_entities_in_results <= operators.keys():
+        all_possible_entities = list(final_entities_in_results | set(entities))
+        operators = get_anonymizer_operators(all_possible_entities)
+
+    if replacement_engine.can_stream(final_results, len(text)):
+        logger.info("Используется потоковая замена по отсортированным диапазонам.")
+        return replacement_engine.iter_pieces(text, final_results, operators)
+    return iter([replacement_engine.anonymize(text, final_results, operators)])
+
+
+def write_document(output_file: str, replacement_pieces: Iterable[str]) -> None:
+    """Этап записи: потоковая пост-обработка и атомарная запись результата."""
+    # Запись во временный файл и переименование: при ошибке прежний output не повреждается
+    write_text_atomic(output_file, iter_post_processed_text(replacement_pieces, chunk_size=STREAM_CHUNK_SIZE))
+
+
+def render_from_spans(input_file: str, spans_file: str, output_file: str) -> int:
+    """
+    Повторно выполняет замену и пост-обработку по сохраненным диапазонам, без анализа.
+    Плейсхолдеры берутся из текущего ENTITY_PLACEHOLDERS. Возвращает число замененных диапазонов.
+    Эта функция является СИНХРОННОЙ.
+    """
+    text = read_text(input_file)
+    standoff = load_spans(spans_file)
+    check_text(standoff, text, spans_file)
+    final_results = spans_to_results(standoff)
+    replacement_pieces = resolve_replacements(text, final_results, standoff["entities"], SpanReplacementEngine())
+    write_document(output_file, replacement_pieces)
+    return len(final_results)
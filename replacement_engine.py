@@ -0,0 +1,121 @@
+# replacement_engine.py
+"""
+Собственный движок замены диапазонов на плейсхолдеры.
+Работает с уже отсортированными и непересекающимися результатами
+(после merge_and_filter_results и filter_by_ner_priority) и собирает
+результат одним проходом, без разрешения конфликтов AnonymizerEngine.
+Операторы, отличные от 'replace', выполняются операторами Presidio,
+а пересекающиеся диапазоны целиком передаются в AnonymizerEngine.
+Как и AnonymizerEngine, соседние диапазоны одного типа, разделенные только
+пробелами, заменяются одним плейсхолдером.
+"""
+import logging
+import re
+from typing import Iterator
+
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+from presidio_anonymizer.operators import OperatorsFactory, OperatorType
+
+# Промежуток между диапазонами одного типа, при котором они объединяются
+# (как AnonymizerEngine._merge_entities_with_whitespace_between: только пробелы)
+MERGE_GAP_PATTERN = re.compile(r"^( )+$")
+
+
+class SpanReplacementEngine:
+    """
+    Замена диапазонов по конфигурации операторов (get_anonymizer_operators).
+    Результат побайтно совпадает с AnonymizerEngine.anonymize для
+    непересекающихся диапазонов.
+    """
+
+    def __init__(self):
+        self._operators_factory = OperatorsFactory()
+        self._presidio_engine = None # Создается только при необходимости
+
+    @staticmethod
+    def _get_operator(entity_type: str, operators: dict[str, OperatorConfig]) -> OperatorConfig:
+        """Выбирает оператор для типа сущности так же, как AnonymizerEngine (с fallback на DEFAULT)."""
+        operator = operators.get(entity_type) or operators.get("DEFAULT")
+        if operator is None:
+            # AnonymizerEngine по умолчанию использует 'replace' со значением <ENTITY_TYPE>
+            operator = OperatorConfig("replace")
+        return operator
+
+    @staticmethod
+    def can_stream(results: list[RecognizerResult], text_length: int) -> bool:
+        """Проверяет, что диапазоны корректны и не пересекаются (их можно заменить за один проход)."""
+        last_end = 0
+        for result in sorted(results, key=lambda r: (r.start, r.end)):
+            if result.start < last_end or result.start >= result.end or result.end > text_length:
+                return False
+            last_end = result.end
+        return True
+
+    def _operate(self, text: str, entity_type: str, operator: OperatorConfig) -> str:
+        """Возвращает замену для фрагмента текста."""
+        if operator.operator_name == "replace":
+            return operator.params.get("new_value") or f"<{entity_type}>"
+        # Нестандартный оператор - выполняем его реализацией Presidio
+        params = dict(operator.params)
+        params["entity_type"] = entity_type
+        operator_class = self._operators_factory.create_operator_class(operator.operator_name, OperatorType.Anonymize)
+        operator_class.validate(params=params)
+        return operator_class.operate(text=text, params=params)
+
+    def replacement_for(self, text: str, result: RecognizerResult, operators: dict[str, OperatorConfig]) -> str:
+        """Возвращает замену для одного диапазона результата."""
+        operator = self._get_operator(result.entity_type, operators)
+        return self._operate(text[result.start:result.end], result.entity_type, operator)
+
+    @staticmethod
+    def merged_spans(text: str, results: list[RecognizerResult]) -> list[tuple[int, int, str]]:
+        """
+        Возвращает отсортированные диапазоны (start, end, тип), в которых соседние диапазоны
+        одного типа, разделенные только пробелами, объединены (как в AnonymizerEngine).
+        Исходные результаты не изменяются.
+        """
+        spans = []
+        for result in sorted(results, key=lambda r: (r.start, r.end)):
+            if spans:
+                last_start, last_end, last_type = spans[-1]
+                if last_type == result.entity_type and MERGE_GAP_PATTERN.match(text[last_end:result.start]):
+                    spans[-1] = (last_start, result.end, last_type)
+                    continue
+            spans.append((result.start, result.end, result.entity_type))
+        return spans
+
+    def iter_pieces(
+        self,
+        text: str,
+        results: list[RecognizerResult],
+        operators: dict[str, OperatorConfig]
+    ) -> Iterator[str]:
+        """
+        Выдает фрагменты результата по порядку: неизмененные участки между
+        диапазонами и замены. Диапазоны должны проходить can_stream.
+        """
+        position = 0
+        for start, end, entity_type in self.merged_spans(text, results):
+            if start > position:
+                yield text[position:start]
+            yield self._operate(text[start:end], entity_type, self._get_operator(entity_type, operators))
+            position = end
+        if position < len(text):
+            yield text[position:]
+
+    def anonymize(
+        self,
+        text: str,
+        results: list[RecognizerResult],
+        operators: dict[str, OperatorConfig]
+    ) -> str:
+        """Возвращает анонимизированный текст (одним join или через AnonymizerEngine при пересечениях)."""
+        if self.can_stream(results, len(text)):
+            return "".join(self.iter_pieces(text, results, operators))
+
+        logging.getLogger().info("Диапазоны пересекаются. Анонимизация через AnonymizerEngine Presidio...")
+        if self._presidio_engine is None:
+            self._presidio_engine = AnonymizerEngine()
+        return self._presidio_engine.anonymize(text=text, analyzer_results=results, operators=operators).text
@@ -0,0 +1,89 @@
+# scheduler.py
+"""
+Планировщик анализа для сервиса: порядок, в котором части документов разных запросов
+получают вычислительные слоты.
+Запросы обрабатываются в потоках, но тяжелые этапы анализа (части Presidio и группы
+предложений Natasha, см. anonymizer_logic.set_analysis_scheduler) выполняются только в одном
+из slots слотов. Ожидающие части упорядочены по оценке времени завершения документа:
+время поступления + длина текста / chars_per_second. Короткий документ, пришедший во время
+анализа длинного, занимает первый освободившийся слот (длинный документ режется на части по
+shard_chars символов, поэтому ждать приходится не дольше одной части), а длинный документ
+не голодает: по мере ожидания его оценка становится меньше, чем у новых коротких.
+Один клиент занимает не больше max_slots_per_client слотов одновременно.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AnalysisScheduler:
+    """Слоты анализа с приоритетом по оценке стоимости документа и ограничением на клиента."""
+
+    def __init__(self, slots: int, max_slots_per_client: int, shard_chars: int, chars_per_second: float):
+        self.slots = slots
+        self.max_slots_per_client = max_slots_per_client
+        self.shard_chars = shard_chars
+        self.chars_per_second = chars_per_second
+        self._condition = threading.Condition()
+        self._waiting = [] # (оценка завершения, номер, клиент)
+        self._running = 0
+        self._running_by_client = {}
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    @contextmanager
+    def document(self, client: str, cost: int):
+        """Задает клиента и стоимость (длину текста) документа, анализируемого в этом потоке."""
+        self._local.document = (time.monotonic() + cost / self.chars_per_second, client)
+        try:
+            yield
+        finally:
+            self._local.document = None
+
+    def _next_entry(self) -> tuple | None:
+        """Ожидающая часть с наименьшей оценкой среди клиентов, не исчерпавших свои слоты."""
+        eligible = [
+            entry for entry in self._waiting
+            if self._running_by_client.get(entry[2], 0) < self.max_slots_per_client
+        ]
+        return min(eligible, default=None)
+
+    @contextmanager
+    def slot(self):
+        """
+        Ждет своей очереди и занимает слот на время блока. Вне document() и внутри
+        уже занятого слота (вложенный вызов) блок выполняется сразу.
+        """
+        document = getattr(self._local, "document", None)
+        if document is None or getattr(self._local, "in_slot", False):
+            yield
+            return
+
+        priority, client = document
+        entry = (priority, next(self._counter), client)
+        with self._condition:
+            self._waiting.append(entry)
+            while self._running >= self.slots or self._next_entry() is not entry:
+                self._condition.wait()
+            self._waiting.remove(entry)
+            self._running += 1
+            self._running_by_client[client] = self._running_by_client.get(client, 0) + 1
+            if self._running < self.slots:
+                self._condition.notify_all() # Свободный слот может занять следующий ожидающий
+        self._local.in_slot = True
+        try:
+            yield
+        finally:
+            self._local.in_slot = False
+            with self._condition:
+                self._running -= 1
+                self._running_by_client[client] -= 1
+                if not self._running_by_client[client]:
+                    del self._running_by_client[client]
+                self._condition.notify_all()
+
+    def stats(self) -> dict[str, int]:
+        """Число занятых слотов и ожидающих частей (для /health)."""
+        with self._condition:
+            return {"running": self._running, "waiting": len(self._waiting)}
@@ -0,0 +1,64 @@
+# standoff.py
+"""
+Хранение найденных диапазонов (standoff) рядом с анонимизированным текстом.
+Файл диапазонов - компактный JSON:
+  {"version": 1, "text_length": ..., "text_digest": ..., "entities": [...],
+   "spans": [[start, end, тип, score, распознаватель], ...]}
+Смещения относятся к исходному (декодированному) тексту; text_digest позволяет
+убедиться, что повторная замена выполняется для того же текста.
+"""
+import hashlib
+import json
+
+from presidio_analyzer import RecognizerResult
+
+from file_utils import read_text, write_text_atomic
+
+STANDOFF_VERSION = 1
+
+
+def standoff_filename(output_file: str, suffix: str) -> str:
+    """Имя файла диапазонов для выходного файла."""
+    return output_file + suffix
+
+
+def text_digest(text: str) -> str:
+    """Хэш текста (blake2b от utf-8), по которому проверяется соответствие диапазонов тексту."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def save_spans(filename: str, text: str, entities: list[str], spans: list[tuple[int, int, str, float, str]]) -> None:
+    """Атомарно сохраняет диапазоны [(start, end, тип, score, распознаватель)] для текста."""
+    data = {
+        "version": STANDOFF_VERSION,
+        "text_length": len(text),
+        "text_digest": text_digest(text),
+        "entities": entities,
+        "spans": [list(span) for span in spans],
+    }
+    write_text_atomic(filename, [json.dumps(data, ensure_ascii=False, separators=(",", ":"))])
+
+
+def load_spans(filename: str) -> dict:
+    """Читает файл диапазонов. Выбрасывает ValueError для неподдерживаемой версии формата."""
+    data = json.loads(read_text(filename, encoding="utf-8"))
+    if data.get("version") != STANDOFF_VERSION:
+        raise ValueError(f"Неподдерживаемая версия файла диапазонов '{filename}': {data.get('version')}")
+    return data
+
+
+def check_text(data: dict, text: str, filename: str) -> None:
+    """Проверяет, что диапазоны относятся к этому тексту (длина и хэш)."""
+    if data["text_length"] != len(text) or data["text_digest"] != text_digest(text):
+        raise ValueError(f"Диапазоны '{filename}' относятся к другому тексту (входной файл изменился).")
+
+
+def spans_to_results(data: dict) -> list[RecognizerResult]:
+    """Восстанавливает результаты RecognizerResult из диапазонов (имя распознавателя - в recognition_metadata)."""
+    return [
+        RecognizerResult(
+            entity_type=entity_type, start=start, end=end, score=score,
+            recognition_metadata={RecognizerResult.RECOGNIZER_NAME_KEY: recognizer_name}
+        )
+        for start, end, entity_type, score, recognizer_name in data["spans"]
+    ]
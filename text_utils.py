@@ -4,28 +4,261 @@
 """
 import re
 import logging
+from bisect import bisect_right
+from typing import Iterable, Iterator
 
-def post_process_text(text: str) -> str:
-    """
-    Выполняет пост-обработку текста: удаление лишних пробелов/табов
-    и слияние плейсхолдеров, сохраняя переносы строк.
-    """
-    logging.debug("Выполнение пост-обработки текста...")
+# Правила пост-обработки (применяются по порядку)
+POST_PROCESS_RULES = [
     # Сначала объединяем одинаковые соседние плейсхолдеры, разделенные только пробелами/табами/переносами
-    processed_text = re.sub(r'(?P<tag><[\w_]+>)(?:\s*(?P=tag))+', r'\1', text)
+    (re.compile(r'(?P<tag><[\w_]+>)(?:\s*(?P=tag))+'), r'\1'),
     # Удаляем лишние пробелы и табы внутри строк
-    processed_text = re.sub(r'[ \t]{2,}', ' ', processed_text)
+    (re.compile(r'[ \t]{2,}'), ' '),
     # Удаляем пробелы перед знаками препинания
-    processed_text = re.sub(r'\s+([.,!?;:])', r'\1', processed_text)
+    (re.compile(r'\s+([.,!?;:])'), r'\1'),
     # Удаляем пробелы после открывающих скобок/кавычек
-    processed_text = re.sub(r'([\(«"\'])(\s+)', r'\1', processed_text)
+    (re.compile(r'([\(«"\'])(\s+)'), r'\1'),
     # Удаляем пробелы перед закрывающими скобками/кавычками
-    processed_text = re.sub(r'(\s+)([\)»"\'])', r'\2', processed_text)
+    (re.compile(r'(\s+)([\)»"\'])'), r'\2'),
     # Удаляем пробелы/табы в конце строк
-    processed_text = re.sub(r'[ \t]+\n', '\n', processed_text)
+    (re.compile(r'[ \t]+\n'), '\n'),
     # Удаляем пробелы/табы в начале строк (после переноса)
-    processed_text = re.sub(r'\n[ \t]+', '\n', processed_text)
+    (re.compile(r'\n[ \t]+'), '\n'),
+]
+
+# Безопасная точка разреза потока: два соседних непробельных символа, не '<'/'>',
+# хотя бы один из которых не является символом слова. Ни одно из правил
+# POST_PROCESS_RULES не может совпасть через такую границу (совпадения состоят из
+# пробелов, знаков препинания рядом с пробелами и плейсхолдеров <...>).
+SAFE_CUT_PATTERN = re.compile(r'[^\s<>\w][^\s<>]|[^\s<>][^\s<>\w]')
+
+
+def _apply_post_process_rules(text: str) -> str:
+    """Применяет правила POST_PROCESS_RULES к тексту (без обрезки краев)."""
+    for pattern, replacement in POST_PROCESS_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def post_process_text(text: str) -> str:
+    """
+    Выполняет пост-обработку текста: удаление лишних пробелов/табов
+    и слияние плейсхолдеров, сохраняя переносы строк.
+    """
+    logging.debug("Выполнение пост-обработки текста...")
+    processed_text = _apply_post_process_rules(text)
     # Удаляем пробелы/табы в начале и конце всего текста
     processed_text = processed_text.strip()
     logging.debug("Пост-обработка завершена.")
-    return processed_text
\ No newline at end of file
+    return processed_text
+
+
+def _find_safe_cut(buffer: str) -> int:
+    """Возвращает последнюю безопасную позицию разреза буфера или -1."""
+    search_from = max(0, len(buffer) - 65536)
+    while True:
+        cut = -1
+        for match in SAFE_CUT_PATTERN.finditer(buffer, search_from):
+            cut = match.start() + 1
+        if cut != -1 or search_from == 0:
+            return cut
+        search_from = 0
+
+
+def iter_post_processed_text(pieces: Iterable[str], chunk_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    Потоковая версия post_process_text.
+    Принимает фрагменты текста (например, неизмененные участки и плейсхолдеры)
+    и выдает обработанные куски. Конкатенация результата побайтно совпадает с
+    post_process_text(''.join(pieces)), но полный текст в памяти не собирается.
+    """
+    logging.debug("Выполнение потоковой пост-обработки текста...")
+    pending = []
+    pending_length = 0
+    flush_length = chunk_size
+    is_first_chunk = True
+    for piece in pieces:
+        pending.append(piece)
+        pending_length += len(piece)
+        if pending_length < flush_length:
+            continue
+        buffer = "".join(pending)
+        cut = _find_safe_cut(buffer)
+        if cut <= 0:
+            # Безопасной точки нет - копим дальше (следующая попытка - после еще chunk_size символов,
+            # иначе каждый мелкий фрагмент приводил бы к повторному поиску по всему буферу)
+            pending = [buffer]
+            flush_length = pending_length + chunk_size
+            continue
+        flush_length = chunk_size
+        chunk = _apply_post_process_rules(buffer[:cut])
+        pending = [buffer[cut:]]
+        pending_length = len(pending[0])
+        if is_first_chunk:
+            chunk = chunk.lstrip()
+            is_first_chunk = False
+        if chunk:
+            yield chunk
+
+    chunk = _apply_post_process_rules("".join(pending))
+    chunk = chunk.strip() if is_first_chunk else chunk.rstrip()
+    if chunk:
+        yield chunk
+    logging.debug("Потоковая пост-обработка завершена.")
+
+def _trie_to_regex(node: dict) -> str:
+    """Рекурсивно преобразует префиксное дерево в регулярное выражение."""
+    is_terminal = "" in node
+    branches = []
+    for char in sorted(key for key in node if key):
+        branches.append(re.escape(char) + _trie_to_regex(node[char]))
+    if not branches:
+        return ""
+    if len(branches) == 1 and not is_terminal:
+        return branches[0]
+    body = "(?:" + "|".join(branches) + ")"
+    return body + "?" if is_terminal else body
+
+
+def compile_phrase_matcher(phrases: Iterable[str], flags: int = 0) -> re.Pattern | None:
+    """
+    Компилирует набор фраз в одно регулярное выражение на основе префиксного дерева.
+    Поиск выполняется за один проход по тексту, предпочитается самое длинное совпадение,
+    совпадения не могут начинаться или заканчиваться внутри слова.
+    Возвращает None для пустого набора.
+    """
+    trie = {}
+    for phrase in phrases:
+        if not phrase:
+            continue
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    if not trie:
+        return None
+    return re.compile(r"(?<!\w)" + _trie_to_regex(trie) + r"(?!\w)", flags)
+
+
+# --- Разбиение на предложения (с сохранением смещений) ---
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'[.!?…]+(?=\s)|\n')
+# Сокращения, после которых точка не завершает предложение
+SENTENCE_ABBREVIATIONS = {
+    "г", "гг", "ул", "д", "кв", "корп", "стр", "пом", "обл", "р-н", "пос", "просп", "пер", "пл", "ш", "наб",
+    "п", "пп", "ст", "ч", "т", "тел", "руб", "коп", "им", "см", "рис", "табл", "прим", "др", "пр"
+}
+_TRAILING_WORD_PATTERN = re.compile(r'([\w-]+)$')
+
+
+def _is_abbreviation(text: str, dot_position: int) -> bool:
+    """Проверяет, стоит ли точка после инициала или известного сокращения."""
+    match = _TRAILING_WORD_PATTERN.search(text, max(0, dot_position - 12), dot_position)
+    if not match:
+        return False
+    word = match.group(1)
+    return len(word) == 1 or word.lower() in SENTENCE_ABBREVIATIONS
+
+
+def _append_sentence(sentences: list[tuple[int, int]], text: str, start: int, end: int) -> None:
+    """Добавляет диапазон предложения без пробелов по краям (пустые пропускаются)."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        sentences.append((start, end))
+
+
+def segment_sentences(text: str) -> list[tuple[int, int]]:
+    """
+    Быстро разбивает текст на предложения и строки.
+    Возвращает список диапазонов (start, end) в исходном тексте, без пробелов по краям.
+    Точки после инициалов и распространенных сокращений (г., ул., д.) предложение не завершают.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY_PATTERN.finditer(text):
+        if match.group() == "." and _is_abbreviation(text, match.start()):
+            continue
+        _append_sentence(sentences, text, start, match.end())
+        start = match.end()
+    _append_sentence(sentences, text, start, len(text))
+    return sentences
+
+
+# --- Определение письменности предложений (маршрутизация по языкам) ---
+SCRIPT_CYRILLIC = "cyrillic"
+SCRIPT_LATIN = "latin"
+SCRIPT_NONE = "none" # Нет слов: числа, символы, коды, адреса email/URL
+
+CYRILLIC_LETTER_PATTERN = re.compile(r'[А-Яа-яЁё]')
+LATIN_WORD_PATTERN = re.compile(r'(?<![\w@./-])[A-Za-z][A-Za-z\'-]+(?![\w@/])')
+
+
+def detect_script(text: str, min_latin_words: int = 3) -> str:
+    """
+    Определяет письменность фрагмента текста.
+    Латиница засчитывается только отдельными словами (не частями email, URL, кодов),
+    и фрагмент считается латинским, если таких слов не меньше min_latin_words
+    и в них больше букв, чем кириллических букв во фрагменте.
+    """
+    cyrillic_count = len(CYRILLIC_LETTER_PATTERN.findall(text))
+    latin_words = LATIN_WORD_PATTERN.findall(text)
+    latin_count = sum(len(word) for word in latin_words)
+    if len(latin_words) >= min_latin_words and latin_count > cyrillic_count:
+        return SCRIPT_LATIN
+    if cyrillic_count:
+        return SCRIPT_CYRILLIC
+    return SCRIPT_NONE
+
+
+def route_sentences(
+    text: str,
+    sentences: list[tuple[int, int]],
+    min_latin_words: int = 3
+) -> dict[str, list[tuple[int, int]]]:
+    """Распределяет предложения по письменности: письменность -> список предложений (start, end)."""
+    routes = {SCRIPT_CYRILLIC: [], SCRIPT_LATIN: [], SCRIPT_NONE: []}
+    for start, end in sentences:
+        routes[detect_script(text[start:end], min_latin_words)].append((start, end))
+    return routes
+
+
+def shard_regions(
+    regions: list[tuple[int, int]],
+    sentences: list[tuple[int, int]],
+    max_chars: int
+) -> list[tuple[int, int]]:
+    """
+    Разбивает регионы на части не длиннее max_chars по началам предложений
+    (предложение не разрезается, поэтому часть с длинным предложением может быть больше).
+    Части покрывают каждый регион целиком и без пересечений.
+    """
+    sentence_starts = [start for start, _ in sentences]
+    shards = []
+    for region_start, region_end in regions:
+        shard_start = region_start
+        cut_candidate = None
+        first_sentence = bisect_right(sentence_starts, region_start)
+        for sentence_start in sentence_starts[first_sentence:]:
+            if sentence_start >= region_end:
+                break
+            if sentence_start - shard_start > max_chars and cut_candidate is not None:
+                shards.append((shard_start, cut_candidate))
+                shard_start = cut_candidate
+            cut_candidate = sentence_start
+        if region_end - shard_start > max_chars and cut_candidate is not None and cut_candidate > shard_start:
+            shards.append((shard_start, cut_candidate))
+            shard_start = cut_candidate
+        shards.append((shard_start, region_end))
+    return shards
+
+
+def merge_adjacent_regions(text: str, regions: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Объединяет отсортированные регионы, между которыми в тексте только пробельные символы."""
+    merged = []
+    for start, end in regions:
+        if merged and not text[merged[-1][1]:start].strip():
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged